@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+Times the placeholder scanner on adversarial filament notes of growing size and checks that the time grows linearly.
+The notes are user-controlled text from filament profiles, the old regular expression took quadratic time on some of
+these inputs, run with --compare-regex to see it
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import re
+import sys
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from placeholders import compile_plan, find_spool_name  # noqa: E402
+
+OLD_PATTERN = re.compile(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]")
+
+# name -> builds notes of about the given size
+ADVERSARIAL_NOTES: dict[str, Callable[[int], str]] = {
+    "whitespace-heavy value, no closing bracket": lambda size: "[sm_name=" + " a" * (size // 2),
+    "whitespace after the name, no closing bracket": lambda size: "[sm_name" + " " * size,
+    "nested openings": lambda size: "[sm_name=" * (size // 9),
+    "only opening brackets": lambda size: "[" * size,
+    "escaped brackets": lambda size: "[sm_name=" + "\\]" * (size // 2) + "]",
+    "backslash runs": lambda size: "[sm_name=" + ("\\" * 63 + "]") * (size // 64),
+    "many short tags": lambda size: "[sm_name = Spool] " * (size // 18),
+}
+# the most a run may slow down per byte from the smallest to the largest size before it counts as superlinear
+MAX_SLOPE = 1.25
+
+
+def time_call(fn: Callable[[], object], repeat: int = 3) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def scan_all(notes: str) -> None:
+    plan = compile_plan()
+    plan.find(notes)
+    plan.apply(notes, {"sm_name": "Benchmark Spool"})
+    find_spool_name(notes)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--min-size", type=int, default=64 * 1024, help="Smallest notes size in bytes.")
+    parser.add_argument("--max-size", type=int, default=4 * 1024 * 1024, help="Largest notes size in bytes.")
+    parser.add_argument("--compare-regex", action="store_true",
+                        help="Also time the old regular expression, only up to 64 KB since it is quadratic.")
+    args = parser.parse_args()
+
+    sizes = []
+    size = args.min_size
+    while size <= args.max_size:
+        sizes.append(size)
+        size *= 2
+
+    superlinear = []
+    for name, build in ADVERSARIAL_NOTES.items():
+        print(name)
+        times = []
+        for size in sizes:
+            notes = build(size)
+            elapsed = time_call(lambda: scan_all(notes))
+            times.append(elapsed)
+            line = f"  {len(notes):>9} bytes  {elapsed * 1000:9.2f} ms  {elapsed * 1e9 / len(notes):6.1f} ns/byte"
+            if args.compare_regex and size <= 64 * 1024:
+                regex_time = time_call(lambda: OLD_PATTERN.search(notes), repeat=1)
+                line += f"  (regex {regex_time * 1000:.2f} ms)"
+            print(line)
+        # log-log slope of time against size, 1 is linear and 2 quadratic
+        slope = math.log(times[-1] / times[0]) / math.log(sizes[-1] / sizes[0]) if len(sizes) > 1 else 1
+        print(f"  scaling exponent {slope:.2f}")
+        if slope > MAX_SLOPE:
+            superlinear.append(name)
+
+    if superlinear:
+        print("Superlinear: " + ", ".join(superlinear))
+        return 1
+    print("All inputs scale linearly")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Union
+from urllib.parse import urlsplit
+
+
+# how often an abortable wait checks whether it was aborted, in seconds
+ABORT_POLL_INTERVAL = 0.05
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of making a request to a host that failed recently
+    """
+
+
+class BudgetExceeded(TimeoutError):
+    """
+    Raised when an operation doesn't finish within its latency budget
+    """
+
+
+class CircuitBreaker:
+    """
+    Remembers the recent failures of each host, once a host failed failure_threshold times in a row requests to it fail
+    right away until reset_after seconds have passed, then one request is let through to check if it is back
+    """
+
+    def __init__(self, failure_threshold: int = 2, reset_after: float = 30):
+        """
+        :param failure_threshold: the consecutive failures after which requests to a host fail fast
+        :param reset_after: the seconds to fail fast for before trying the host again
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        # host -> (consecutive failures, time of the last failure)
+        self._failures: dict[str, tuple[int, float]] = {}
+
+    def check(self, url: str) -> None:
+        """
+        Check that a request to the host of a url may be made
+        :param url: the url about to be requested
+        :raises CircuitOpen: if the host failed recently
+        """
+        host = host_of(url)
+        with self._lock:
+            failures, last_failure = self._failures.get(host, (0, 0.0))
+            if failures < self.failure_threshold:
+                return
+            waited = time.monotonic() - last_failure
+            if waited >= self.reset_after:
+                # let this request through as the trial, the next ones fail fast until it succeeds or fails
+                self._failures[host] = (failures, time.monotonic())
+                return
+        raise CircuitOpen(f"{host} did not respond recently, trying again in {self.reset_after - waited:.0f}s")
+
+    def record_success(self, url: str) -> None:
+        with self._lock:
+            self._failures.pop(host_of(url), None)
+
+    def record_failure(self, url: str) -> None:
+        host = host_of(url)
+        with self._lock:
+            failures, _ = self._failures.get(host, (0, 0.0))
+            self._failures[host] = (failures + 1, time.monotonic())
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def run_with_budget(fn: Callable[..., Any], budget: Union[float, None], *args: Any,
+                    abort: Union[threading.Event, None] = None, **kwargs: Any) -> Any:
+    """
+    Run a blocking call and stop waiting for it once the budget is spent. The call runs on a daemon thread, if it
+    overruns it is left to finish on its own and never holds up the exit of the program
+    :param fn: the blocking call
+    :param budget: the most seconds to wait, None to wait forever
+    :param abort: stop waiting as soon as this event is set, for callers that are shutting down
+    :return: the return value of the call
+    :raises BudgetExceeded: if the call didn't finish in time or the wait was aborted
+    """
+    if budget is None and abort is None:
+        return fn(*args, **kwargs)
+    result: list[Any] = []
+    error: list[BaseException] = []
+
+    def run() -> None:
+        try:
+            result.append(fn(*args, **kwargs))
+        except BaseException as e:
+            error.append(e)
+
+    thread = threading.Thread(target=run, name="nvf-budgeted-call", daemon=True)
+    thread.start()
+    if abort is None:
+        thread.join(budget)
+    else:
+        deadline = None if budget is None else time.monotonic() + budget
+        while thread.is_alive() and not abort.is_set():
+            remaining = ABORT_POLL_INTERVAL if deadline is None else min(ABORT_POLL_INTERVAL,
+                                                                         deadline - time.monotonic())
+            if remaining <= 0:
+                break
+            thread.join(remaining)
+    if thread.is_alive():
+        if abort is not None and abort.is_set():
+            raise BudgetExceeded("stopped waiting for a response")
+        raise BudgetExceeded(f"no response within {budget:g}s")
+    if error:
+        raise error[0]
+    return result[0]
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import getpass
+import hashlib
+import os
+from typing import Union
+
+from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtNetwork import QLocalServer, QLocalSocket
+
+# how long a new instance waits for the instance that is already running to answer
+CONNECT_TIMEOUT_MS = 500
+
+# the replies of the first instance to a forwarded file
+ACCEPTED = "accepted"
+BUSY = "busy"
+DONE = "done"
+FAILED = "failed"
+CLOSED = "closed"
+
+
+def server_name() -> str:
+    """
+    :return: the name of the local socket the first instance listens on, one per user and install
+    """
+    try:
+        user = getpass.getuser()
+    except (KeyError, OSError):
+        user = "user"
+    install = hashlib.sha1(os.path.abspath(os.path.dirname(__file__)).encode("utf-8")).hexdigest()[:8]
+    return f"nvf-postprocessor-{user}-{install}"
+
+
+class export_listener(QObject):
+    """
+    Collects the files of the instances started after the first one, when the slicer exports several plates it starts
+    one instance per file and they all end up in the window of the first. Each forwarding instance keeps its connection
+    open until its file is written and then exits
+    """
+    file_received = pyqtSignal(str)
+
+    def __init__(self, parent: Union[QObject, None] = None):
+        super().__init__(parent)
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.accept_connections)
+        # gcode path -> the connections of the instances waiting for it
+        self.clients: dict[str, list[QLocalSocket]] = {}
+        self.accepting = True
+
+    def listen(self) -> bool:
+        """
+        Start listening for other instances
+        :return: False if another instance is already listening
+        """
+        name = server_name()
+        if self.server.listen(name):
+            return True
+        probe = forward_connection()
+        if probe is not None:
+            probe.abort()
+            return False
+        # the socket of an instance that crashed
+        QLocalServer.removeServer(name)
+        return self.server.listen(name)
+
+    def stop_accepting(self) -> None:
+        """
+        Turn away files forwarded from now on, their instances show their own window
+        """
+        self.accepting = False
+
+    def accept_connections(self) -> None:
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda socket=socket: self.read_path(socket))
+
+    def read_path(self, socket: QLocalSocket) -> None:
+        if not socket.canReadLine():
+            return
+        path = bytes(socket.readLine()).decode("utf-8").rstrip("\n")
+        if not self.accepting:
+            _send(socket, BUSY)
+            socket.disconnectFromServer()
+            return
+        self.clients.setdefault(path, []).append(socket)
+        _send(socket, ACCEPTED)
+        self.file_received.emit(path)
+
+    def finish(self, path: str, error: Union[str, None] = None) -> None:
+        """
+        Tell the instances waiting for a file that it was written, so they can exit
+        :param path: the gcode path
+        :param error: why the file could not be written, None if it was written
+        """
+        for socket in self.clients.pop(path, []):
+            _send(socket, DONE if error is None else f"{FAILED} {error}")
+            socket.disconnectFromServer()
+
+    def close(self, reply: str = CLOSED) -> None:
+        """
+        Release every waiting instance and stop listening
+        :param reply: what the waiting instances are told
+        """
+        for path in list(self.clients):
+            for socket in self.clients.pop(path):
+                _send(socket, reply)
+                socket.disconnectFromServer()
+        self.server.close()
+
+
+def forward_connection() -> Union[QLocalSocket, None]:
+    """
+    :return: a connection to the first instance, or None if no instance is listening
+    """
+    socket = QLocalSocket()
+    socket.connectToServer(server_name())
+    if socket.waitForConnected(CONNECT_TIMEOUT_MS):
+        return socket
+    return None
+
+
+def forward_file(gcode_path: str) -> Union[int, None]:
+    """
+    Hand a gcode file to the first instance and wait until it was written
+    :param gcode_path: the gcode path given by the slicer
+    :return: the exit code for this instance, or None if there is no first instance taking files and this instance has
+    to show its own window
+    """
+    socket = forward_connection()
+    if socket is None:
+        return None
+    _send(socket, os.path.abspath(gcode_path))
+    reply = _receive(socket)
+    if reply != ACCEPTED:
+        socket.abort()
+        return None
+    # wait as long as it takes the user to confirm the export
+    reply = _receive(socket) or CLOSED
+    if reply.startswith(FAILED):
+        print(f"Could not edit {gcode_path}: {reply[len(FAILED):].strip()}")
+        return 1
+    return 0
+
+
+def _send(socket: QLocalSocket, message: str) -> None:
+    socket.write((message + "\n").encode("utf-8"))
+    socket.flush()
+
+
+def _receive(socket: QLocalSocket) -> Union[str, None]:
+    """
+    Block until a line is received
+    :return: the line, or None if the connection was closed first
+    """
+    while not socket.canReadLine():
+        if socket.state() != QLocalSocket.LocalSocketState.ConnectedState:
+            return None
+        socket.waitForReadyRead(1000)
+    return bytes(socket.readLine()).decode("utf-8").rstrip("\n")
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Union
+
+LOCK_SUFFIX = ".nvflock"
+
+if os.name == 'nt':
+    import msvcrt
+
+
+    def _try_lock(fd: int) -> bool:
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+
+    def _unlock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+
+    def _try_lock(fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+
+    def _unlock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class LockTimeout(Exception):
+    """
+    Raised when a file lock could not be acquired in time
+    """
+
+
+def lock_path(path: str) -> str:
+    """
+    Get the path of the lock file guarding a file
+    :param path: the path of the file being locked
+    :return: the path of the lock file
+    """
+    return os.path.abspath(path) + LOCK_SUFFIX
+
+
+@contextmanager
+def locked(path: str, timeout: Union[float, None] = None, poll_interval: float = 0.05) -> Iterator[None]:
+    """
+    Hold an exclusive advisory lock on a file for the duration of the with block.
+    The lock is taken on a sidecar lock file, it is released by the OS if the process crashes, and the leftover lock
+    file is reused or cleaned up by the next run.
+    :param path: the path of the file to lock
+    :param timeout: how long to wait for the lock in seconds, None to wait forever
+    :param poll_interval: the delay between attempts to take the lock
+    """
+    fd = acquire(path, timeout, poll_interval)
+    try:
+        yield
+    finally:
+        release(path, fd)
+
+
+def acquire(path: str, timeout: Union[float, None] = None, poll_interval: float = 0.05) -> int:
+    """
+    Acquire the lock for a file, see locked
+    :param path: the path of the file to lock
+    :param timeout: how long to wait for the lock in seconds, None to wait forever
+    :param poll_interval: the delay between attempts to take the lock
+    :return: the file descriptor of the held lock file
+    """
+    lock_file = lock_path(path)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        if _try_lock(fd):
+            # the previous holder may have removed the lock file between our open and lock, in which case we hold a
+            # lock on an orphaned inode and have to start over
+            if _same_file(fd, lock_file):
+                os.ftruncate(fd, 0)
+                os.write(fd, str(os.getpid()).encode())
+                return fd
+            _unlock(fd)
+        os.close(fd)
+        if deadline is not None and time.monotonic() >= deadline:
+            raise LockTimeout(f"Timed out waiting for the lock on {path}")
+        time.sleep(poll_interval)
+
+
+def release(path: str, fd: int) -> None:
+    """
+    Release a lock taken with acquire and remove the lock file
+    :param path: the path of the locked file
+    :param fd: the file descriptor returned by acquire
+    """
+    if os.name != 'nt':
+        # removed while still held, so a waiter that opened it sees an orphaned inode and starts over
+        _remove_lock_file(path)
+        _unlock(fd)
+        os.close(fd)
+        return
+    # windows can't remove an open file, so it is removed once closed. If another process already opened it to wait
+    # for the lock the removal fails and the file is left for that process
+    _unlock(fd)
+    os.close(fd)
+    _remove_lock_file(path)
+
+
+def _remove_lock_file(path: str) -> None:
+    try:
+        os.unlink(lock_path(path))
+    except OSError:
+        pass
+
+
+def clean_stale_locks(directory: str) -> int:
+    """
+    Remove lock files left behind by crashed runs, locks that are still held are left alone
+    :param directory: the directory to clean
+    :return: the number of lock files removed
+    """
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        if not name.endswith(LOCK_SUFFIX):
+            continue
+        lock_file = os.path.join(directory, name)
+        try:
+            fd = os.open(lock_file, os.O_RDWR)
+        except OSError:
+            continue
+        try:
+            if not _try_lock(fd):
+                continue
+            try:
+                if os.name == 'nt':
+                    _unlock(fd)
+                    os.close(fd)
+                    fd = -1
+                os.unlink(lock_file)
+                removed += 1
+            except OSError:
+                pass
+            finally:
+                if fd != -1:
+                    _unlock(fd)
+        finally:
+            if fd != -1:
+                os.close(fd)
+    return removed
+
+
+def _same_file(fd: int, path: str) -> bool:
+    """
+    :return: True if the open file descriptor still refers to the file at path
+    """
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except OSError:
+        return False
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, NamedTuple, Union
+
+from spool_matcher import MATERIAL_COST, Filament, SpoolCatalog, normalize
+
+# loads the selected spool records of a printer, called as load_selection(url, api_key) and returning the records and
+# None or None and an error message, like octoprint_client.get_loaded_spool_records
+SelectionLoader = Callable[[str, Union[str, None]], tuple[Union[list, None], Union[str, None]]]
+
+
+class Printer(NamedTuple):
+    """
+    An OctoPrint instance of the fleet
+    """
+    name: str
+    url: str
+    api_key: Union[str, None] = None
+
+
+class PrinterState(NamedTuple):
+    """
+    What the index knows about a printer: its loaded spools in order of the extruders, when they were polled and the
+    error of the last poll
+    """
+    printer: Printer
+    spools: tuple[Union[dict[str, Any], None], ...]
+    catalog: SpoolCatalog
+    updated_at: float
+    error: Union[str, None] = None
+
+
+class PrinterMatch(NamedTuple):
+    """
+    How well a printer's loaded spools fit a gcode file, a lower cost is a better fit
+    """
+    printer: Printer
+    cost: float
+    name_matches: int
+    stale: bool
+
+
+def load_fleet(data: Any) -> list[Printer]:
+    """
+    Read the printers of the fleet from a fleet json file
+    :param data: the parsed file, a list of {"name", "url", "api_key"} objects
+    :return: the printers
+    """
+    return [Printer(entry.get("name") or entry["url"], entry["url"], entry.get("api_key")) for entry in data]
+
+
+class FleetIndex:
+    """
+    An in-memory index of the spools loaded on each printer of the fleet, kept fresh by polling every printer at once
+    on a background thread, so matching files against the fleet never waits on the network. Use it as a context
+    manager, or call start and stop, to poll in the background, or call refresh to poll once
+    """
+
+    def __init__(self, printers: Iterable[Printer], load_selection: SelectionLoader, poll_interval: float = 30,
+                 max_workers: int = 8, stale_after: Union[float, None] = None,
+                 on_error: Union[Callable[[Printer, str], None], None] = None):
+        """
+        :param printers: the printers of the fleet
+        :param load_selection: loads the selected spool records of a printer
+        :param poll_interval: the seconds between polls of the fleet
+        :param max_workers: the most printers polled at once
+        :param stale_after: the age in seconds after which a printer's spools are marked stale, defaults to three poll
+        intervals
+        :param on_error: called with each printer that could not be polled and the error, on every poll
+        """
+        self.printers = list(printers)
+        self.load_selection = load_selection
+        self.poll_interval = poll_interval
+        self.max_workers = max_workers
+        self.stale_after = stale_after if stale_after is not None else poll_interval * 3
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        self._states: dict[str, PrinterState] = {}
+        # printer name -> error of the last poll, for the printers whose last poll failed
+        self._errors: dict[str, str] = {}
+        # (extruder index, material) -> names of the printers with a spool of that material in that extruder
+        self._by_material: dict[tuple[int, str], set[str]] = {}
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Union[threading.Thread, None] = None
+
+    def __enter__(self) -> FleetIndex:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start polling the fleet in the background, the first poll starts right away
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._poll_loop, name="nvf-fleet-poll", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Union[float, None] = None) -> None:
+        """
+        Stop polling and wait for the poll in progress to finish
+        :param timeout: the most seconds to wait, None to wait until it finished
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wait_ready(self, timeout: Union[float, None] = None) -> bool:
+        """
+        Wait for the first poll of the fleet to finish
+        :param timeout: the most seconds to wait, None to wait forever
+        :return: True if the fleet was polled
+        """
+        return self._ready.wait(timeout)
+
+    def _poll_loop(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # a poll that went wrong is retried at the next interval, the index keeps what it knew
+                traceback.print_exc()
+                self._ready.set()
+            self._stopped.wait(self.poll_interval)
+
+    def refresh(self) -> None:
+        """
+        Poll every printer of the fleet at once and update the index, a printer that can't be reached keeps the spools
+        of its last poll
+        """
+        with ThreadPoolExecutor(max(1, min(self.max_workers, len(self.printers))),
+                                thread_name_prefix="nvf-fleet") as executor:
+            results = list(executor.map(self._poll_printer, self.printers))
+        with self._lock:
+            self._errors = {}
+            for printer, (spools, error) in zip(self.printers, results):
+                previous = self._states.get(printer.name)
+                if spools is None:
+                    self._errors[printer.name] = error = error or "no response"
+                    if previous is not None:
+                        self._states[printer.name] = previous._replace(error=error)
+                    continue
+                self._states[printer.name] = PrinterState(printer, tuple(spools), SpoolCatalog(
+                    [spool if isinstance(spool, dict) else {} for spool in spools], skip_inactive=False), time.time())
+            self._rebuild_index()
+            errors = dict(self._errors)
+        self._ready.set()
+        if self.on_error is not None:
+            for printer in self.printers:
+                if printer.name in errors:
+                    self.on_error(printer, errors[printer.name])
+
+    def _poll_printer(self, printer: Printer) -> tuple[Union[list, None], Union[str, None]]:
+        try:
+            return self.load_selection(printer.url, printer.api_key)
+        except Exception as e:
+            return None, str(e)
+
+    def _rebuild_index(self) -> None:
+        by_material: dict[tuple[int, str], set[str]] = {}
+        for name, state in self._states.items():
+            for extruder, material in enumerate(state.catalog.materials):
+                by_material.setdefault((extruder, material), set()).add(name)
+        self._by_material = by_material
+
+    def states(self) -> list[PrinterState]:
+        """
+        :return: what the index knows about each printer that was polled successfully at least once
+        """
+        with self._lock:
+            return list(self._states.values())
+
+    def spools(self, printer: Printer) -> tuple[Union[dict[str, Any], None], ...]:
+        """
+        :return: the spools loaded on a printer at its last successful poll, in order of the extruders
+        """
+        with self._lock:
+            state = self._states.get(printer.name)
+        return state.spools if state is not None else ()
+
+    def errors(self) -> dict[str, str]:
+        """
+        :return: printer name -> error of the last poll, for each printer whose last poll failed, including the ones
+        that were never polled successfully and are left out of the matches
+        """
+        with self._lock:
+            return dict(self._errors)
+
+    def match(self, filaments: list[Filament], spool_names: list[str]) -> list[PrinterMatch]:
+        """
+        Rank the printers whose loaded spools fit a gcode file, looked up in the index without any request.
+        A printer fits if it has a spool of the sliced material in every extruder the file uses, unless the spool is
+        the one tagged in the file
+        :param filaments: the filament each extruder was sliced with, see spool_matcher.gcode_filaments
+        :param spool_names: the sm_name tagged for each extruder, empty for untagged extruders
+        :return: the printers that fit, best first
+        """
+        with self._lock:
+            states = dict(self._states)
+            by_material = self._by_material
+        candidates = set(states)
+        for extruder, filament in enumerate(filaments):
+            if filament.material and not _tagged(spool_names, extruder):
+                candidates &= by_material.get((extruder, filament.material), set())
+
+        now = time.time()
+        matches = []
+        for name in candidates:
+            state = states[name]
+            if len(state.spools) < len(filaments):
+                continue
+            cost = 0.0
+            name_matches = 0
+            for extruder, filament in enumerate(filaments):
+                spool = state.spools[extruder] or {}
+                if _tagged(spool_names, extruder) and normalize(spool.get("displayName")) == \
+                        normalize(spool_names[extruder]):
+                    name_matches += 1
+                    continue
+                extruder_cost = state.catalog.cost(filament, extruder)
+                if _tagged(spool_names, extruder) and extruder_cost >= MATERIAL_COST:
+                    # a tagged spool that isn't loaded, and not even of the same material
+                    break
+                cost += extruder_cost
+            else:
+                matches.append(PrinterMatch(state.printer, cost, name_matches, now - state.updated_at > self.stale_after))
+        matches.sort(key=lambda match: (match.stale, -match.name_matches, match.cost, match.printer.name))
+        return matches
+
+
+def _tagged(spool_names: list[str], extruder: int) -> bool:
+    return extruder < len(spool_names) and bool(spool_names[extruder])
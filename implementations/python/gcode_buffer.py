@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import io
+import os
+from typing import Any, BinaryIO, Iterator, NamedTuple, Union
+
+import postprocessor
+from placeholders import SubstitutionPlan
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class TailPatch(NamedTuple):
+    """
+    The result of editing gcode in memory: the edited file is header + the original data up to offset + tail, where
+    each skipped line marker in tail stands for the span of the original data at the same position in skipped
+    """
+    offset: int
+    tail: bytes
+    header: bytes
+    skipped: tuple[tuple[int, int], ...] = ()
+
+    def segments(self) -> list[Union[bytes, tuple[int, int]]]:
+        """
+        :return: the non-empty parts of the edited file in order, either new bytes or a (start, end) span of the
+        original data
+        """
+        parts = self.tail.split(postprocessor.SKIPPED_LINE_MARKER)
+        if len(parts) != len(self.skipped) + 1:
+            raise ValueError("The edited gcode tail lost track of the lines that were too long to edit")
+        segments: list[Union[bytes, tuple[int, int]]] = [self.header, (0, self.offset), parts[0]]
+        for span, part in zip(self.skipped, parts[1:]):
+            segments += [span, part]
+        return [segment for segment in segments
+                if (segment[1] > segment[0] if isinstance(segment, tuple) else len(segment) > 0)]
+
+
+def patch_buffer(buffer: BytesLike, json_data: list[Any], plan: Union[SubstitutionPlan, None] = None,
+                 num_lines: int = 1000) -> TailPatch:
+    """
+    Edit gcode held in memory, only the tail of the buffer is read and nothing is copied but the tail
+    :param buffer: the gcode, any bytes-like object such as bytes, a memoryview or an mmap
+    :param json_data: the placeholder values in order of the extruders
+    :param plan: the compiled placeholders to fill, see postprocessor.replace_names
+    :param num_lines: the number of trailing lines to edit
+    :return: the patch to apply to the buffer
+    """
+    view = memoryview(buffer).cast('B')
+    tail = postprocessor.scan_tail(lambda pos, size: bytes(view[pos:pos + size]), len(view), num_lines)
+    return _patch(bytes(view[:len(postprocessor.EDITED_HEADER)]), tail, json_data, plan)
+
+
+def patch_stream(stream: BinaryIO, json_data: list[Any], plan: Union[SubstitutionPlan, None] = None,
+                 num_lines: int = 1000) -> TailPatch:
+    """
+    Edit gcode read from a seekable binary stream, only the start and the tail of the stream are read
+    :param stream: the gcode stream, it is left at an unspecified position
+    :param json_data: the placeholder values in order of the extruders
+    :param plan: the compiled placeholders to fill, see postprocessor.replace_names
+    :param num_lines: the number of trailing lines to edit
+    :return: the patch to apply to the stream, its offsets are relative to the position the stream was at
+    """
+    start = stream.seek(0, os.SEEK_CUR)
+    length = stream.seek(0, os.SEEK_END) - start
+    tail = postprocessor.scan_tail(lambda pos, size: postprocessor.read_at(stream, start + pos, size), length,
+                                   num_lines)
+    return _patch(postprocessor.read_at(stream, start, len(postprocessor.EDITED_HEADER)), tail, json_data, plan)
+
+
+def _patch(first_bytes: bytes, tail: postprocessor.GcodeTail, json_data: list[Any],
+           plan: Union[SubstitutionPlan, None]) -> TailPatch:
+    new_tail = postprocessor.replace_names(tail.data.decode('utf-8', errors='replace'), json_data, plan)
+    has_header = first_bytes.startswith(postprocessor.EDITED_HEADER.rstrip())
+    return TailPatch(tail.start, new_tail.encode('utf-8'), b'' if has_header else postprocessor.EDITED_HEADER,
+                     tail.skipped)
+
+
+def as_view(source: Union[BytesLike, BinaryIO]) -> Union[memoryview, None]:
+    """
+    Get a byte view of a source that supports the buffer protocol, such as bytes or an mmap
+    :param source: a bytes-like object or a stream
+    :return: the view, or None if the source is a stream
+    """
+    try:
+        return memoryview(source).cast('B')
+    except TypeError:
+        return None
+
+
+class PatchedStream(io.RawIOBase):
+    """
+    A read-only stream of the edited gcode: the header line, the original data up to the patch offset unchanged and
+    then the new tail. The original data is read from the source as the stream is read, it is never copied as a whole,
+    so the stream can be handed straight to an OctoPrint preprocessor hook as the uploaded file's stream
+    """
+
+    def __init__(self, source: Union[BytesLike, BinaryIO], patch: TailPatch):
+        """
+        :param source: the original gcode, a bytes-like object or a seekable binary stream positioned at its start
+        :param patch: the patch of the source, from patch_buffer or patch_stream
+        """
+        super().__init__()
+        self._view = as_view(source)
+        self._source = None if self._view is not None else source
+        self._source_start = 0 if self._view is not None else source.seek(0, os.SEEK_CUR)
+        self.patch = patch
+        # (position in the edited gcode, segment) of each part of the edited gcode
+        self._segments = []
+        self.length = 0
+        for segment in patch.segments():
+            self._segments.append((self.length, segment))
+            self.length += segment[1] - segment[0] if isinstance(segment, tuple) else len(segment)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        out = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(out) and self._pos < self.length:
+            chunk = self._chunk_at(self._pos, len(out) - written)
+            out[written:written + len(chunk)] = chunk
+            written += len(chunk)
+            self._pos += len(chunk)
+        return written
+
+    def chunks(self, chunk_size: int = 1024 * 1024) -> Iterator[BytesLike]:
+        """
+        Iterate over the rest of the stream, for a buffer source the original data is yielded as memoryview slices of
+        the buffer without copying
+        :param chunk_size: the largest chunk yielded
+        """
+        while self._pos < self.length:
+            chunk = self._chunk_at(self._pos, chunk_size)
+            self._pos += len(chunk)
+            yield chunk
+
+    def _chunk_at(self, pos: int, size: int) -> BytesLike:
+        """
+        Get up to size bytes of the edited gcode at pos, never crossing from one segment into the next
+        """
+        segment_start, segment = next((start, segment) for start, segment in reversed(self._segments) if start <= pos)
+        pos -= segment_start
+        if not isinstance(segment, tuple):
+            return memoryview(segment)[pos:pos + size]
+        start, end = segment
+        size = min(size, end - start - pos)
+        if self._view is not None:
+            return self._view[start + pos:start + pos + size]
+        data = postprocessor.read_at(self._source, self._source_start + start + pos, size)
+        if not data:
+            raise EOFError("The gcode source ended before the end of the patch")
+        return data
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def patched_stream(source: Union[BytesLike, BinaryIO], json_data: list[Any],
+                   plan: Union[SubstitutionPlan, None] = None) -> PatchedStream:
+    """
+    Edit gcode from a buffer or a seekable stream and get the edited gcode as a stream, see PatchedStream
+    :param source: the original gcode, a bytes-like object or a seekable binary stream positioned at its start
+    :param json_data: the placeholder values in order of the extruders
+    :param plan: the compiled placeholders to fill, see postprocessor.replace_names
+    :return: the stream of the edited gcode
+    """
+    if as_view(source) is not None:
+        return PatchedStream(source, patch_buffer(source, json_data, plan))
+    start = source.seek(0, os.SEEK_CUR)
+    patch = patch_stream(source, json_data, plan)
+    source.seek(start)
+    return PatchedStream(source, patch)
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Iterable, Iterator, TextIO, Union
+
+import postprocessor
+
+GCODE_EXTENSIONS = (".gcode", ".gco", ".g")
+
+# names in the catalog snapshot, set in each worker process by the pool initializer
+_catalog: Union[frozenset[str], None] = None
+
+
+def inspect_file(gcode_path: str, catalog: Union[frozenset[str], None] = None) -> dict[str, Any]:
+    """
+    Read the filament metadata of a gcode file without modifying it, only the tail of the file is read
+    :param gcode_path: the path to the gcode file
+    :param catalog: the spool names in the SpoolManager catalog, None to skip the catalog check
+    :return: the metadata record of the file, or a record with an error message if it could not be read
+    """
+    try:
+        record = {"path": gcode_path, **postprocessor.get_filament_metadata(postprocessor.parse_gcode(gcode_path))}
+    except (OSError, ValueError) as e:
+        # a file that can't be read or whose settings don't fit in the tail budget, the other files are still audited
+        return {"path": gcode_path, "error": str(e)}
+    record["untagged"] = record["tagged_extruders"] == 0
+    if catalog is not None:
+        record["unknown_spools"] = [name for name in record["sm_name"] if name and name not in catalog]
+    return record
+
+
+def load_catalog(catalog_path: str) -> frozenset[str]:
+    """
+    Load the spool names from a SpoolManager catalog snapshot.
+    The snapshot can be a saved loadSpoolsByQuery response, a list of spool records or a list of names
+    :param catalog_path: the path to the snapshot json file
+    :return: the spool names
+    """
+    with open(catalog_path, 'r') as file:
+        data = json.load(file)
+    return frozenset(catalog_names(data))
+
+
+def catalog_names(data: Any) -> Iterator[str]:
+    """
+    Get the spool names from a SpoolManager catalog snapshot, see load_catalog
+    :param data: the parsed snapshot
+    :return: the spool names
+    """
+    if isinstance(data, dict):
+        data = data.get("allSpools", []) + data.get("selectedSpools", [])
+    for spool in data:
+        if isinstance(spool, str):
+            yield spool
+        elif isinstance(spool, dict) and spool.get("displayName"):
+            yield spool["displayName"]
+
+
+def iter_gcode_paths(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Expand directories into the gcode files below them, lazily so any number of files can be listed
+    :param paths: gcode file and directory paths
+    :return: the gcode file paths
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, _, file_names in os.walk(path):
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(GCODE_EXTENSIONS):
+                    yield os.path.join(directory, file_name)
+
+
+def inspect_files(paths: Iterable[str], output: TextIO, catalog: Union[frozenset[str], None] = None,
+                  workers: Union[int, None] = None) -> int:
+    """
+    Inspect gcode files on a process pool and stream one json record per line to the output as each file is done.
+    Only a bounded number of files are in flight at once, so memory use doesn't grow with the number of files
+    :param paths: gcode file and directory paths
+    :param output: the stream the records are written to
+    :param catalog: the spool names in the SpoolManager catalog, None to skip the catalog check
+    :param workers: the number of worker processes, defaults to the cpu count
+    :return: the number of files that could not be read
+    """
+    workers = workers or os.cpu_count() or 1
+    errors = 0
+    pending: set[Future] = set()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(catalog,)) as executor:
+        for gcode_path in iter_gcode_paths(paths):
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                errors += _write_records(done, output)
+            pending.add(executor.submit(_inspect_in_worker, gcode_path))
+        errors += _write_records(pending, output)
+    return errors
+
+
+def _init_worker(catalog: Union[frozenset[str], None]) -> None:
+    global _catalog
+    _catalog = catalog
+
+
+def _inspect_in_worker(gcode_path: str) -> dict[str, Any]:
+    return inspect_file(gcode_path, _catalog)
+
+
+def _write_records(futures: Iterable[Future], output: TextIO) -> int:
+    """
+    Write the records of finished inspections
+    :return: the number of records that are errors
+    """
+    errors = 0
+    for future in futures:
+        record = future.result()
+        errors += "error" in record
+        output.write(json.dumps(record) + "\n")
+    output.flush()
+    return errors
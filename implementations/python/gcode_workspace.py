@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Iterable, NamedTuple, Union
+
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, QObject, Qt, QTimer, pyqtSignal
+
+import postprocessor
+from gcode_inspect import iter_gcode_paths
+from task_runner import task, task_runner
+
+# the most files parsed at once, the tails are small so a few threads keep up with scrolling
+MAX_PARALLEL_LOADS = 4
+
+
+class file_state:
+    PENDING = "pending"
+    LOADING = "loading"
+    LOADED = "loaded"
+    FAILED = "failed"
+
+
+class WorkspaceFile(NamedTuple):
+    """
+    A gcode file of the workspace and what is known about its spools
+    """
+    path: str
+    state: str = file_state.PENDING
+    # extruder number -> spool name, None until the file is loaded
+    spools: Union[dict[int, str], None] = None
+    error: Union[str, None] = None
+
+
+class gcode_workspace(QAbstractListModel):
+    """
+    The gcode files open in the stand-alone window. Files are listed as soon as they are added and their tail is only
+    parsed in the background once a view asks for a row, so only the visible and selected files are read. The most
+    recently requested files are parsed first so the rows in view fill in before the ones scrolled past
+    """
+    file_loaded = pyqtSignal(str)
+
+    def __init__(self, parent: Union[QObject, None] = None, max_loads: int = MAX_PARALLEL_LOADS):
+        """
+        :param parent: the owner of the workspace
+        :param max_loads: the most files parsed at once
+        """
+        super().__init__(parent)
+        self.files: list[WorkspaceFile] = []
+        # path -> row of the file
+        self.rows: dict[str, int] = {}
+        self.max_loads = max_loads
+        self.tasks = task_runner(self, max_threads=max_loads)
+        # paths requested by a view and not loading yet, the last one is loaded first
+        self.wanted: list[str] = []
+        # path -> the task parsing it
+        self.loading: dict[str, task] = {}
+        self.load_timer = QTimer(self)
+        self.load_timer.setSingleShot(True)
+        self.load_timer.timeout.connect(self.start_loads)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.files)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if not index.isValid() or index.row() >= len(self.files):
+            return None
+        file = self.files[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            # the view only asks for the rows it paints
+            self.request(file.path)
+            return f"{os.path.basename(file.path)}  -  {describe(file)}"
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return file.path if file.error is None else f"{file.path}\n{file.error}"
+        return None
+
+    def add_paths(self, paths: Iterable[str]) -> list[str]:
+        """
+        List gcode files and the gcode files in folders, without reading them
+        :param paths: gcode file and folder paths
+        :return: the paths of the files that were not open yet
+        """
+        added = []
+        for path in iter_gcode_paths(paths):
+            path = os.path.abspath(path)
+            if path not in self.rows and path not in added:
+                added.append(path)
+        if added:
+            self.beginInsertRows(QModelIndex(), len(self.files), len(self.files) + len(added) - 1)
+            for path in added:
+                self.rows[path] = len(self.files)
+                self.files.append(WorkspaceFile(path))
+            self.endInsertRows()
+        return added
+
+    def clear(self) -> None:
+        """
+        Close every file, the files being parsed are cancelled
+        """
+        self.tasks.cancel_all()
+        self.beginResetModel()
+        self.files = []
+        self.rows = {}
+        self.wanted = []
+        self.loading = {}
+        self.endResetModel()
+
+    def file(self, path: str) -> Union[WorkspaceFile, None]:
+        row = self.rows.get(path)
+        return self.files[row] if row is not None else None
+
+    def path_at(self, row: int) -> str:
+        return self.files[row].path
+
+    def request(self, path: str) -> None:
+        """
+        Ask for a file to be parsed, the request is moved to the front if it was already asked for
+        :param path: the path of the file
+        """
+        file = self.file(path)
+        if file is None or file.state != file_state.PENDING:
+            return
+        if path in self.wanted:
+            self.wanted.remove(path)
+        self.wanted.append(path)
+        # start the loads once the view is done painting
+        if not self.load_timer.isActive():
+            self.load_timer.start(0)
+
+    def invalidate(self, paths: Iterable[str]) -> None:
+        """
+        Parse files again the next time they are shown, after they were edited
+        :param paths: the paths of the files
+        """
+        for path in paths:
+            file = self.file(path)
+            if file is None:
+                continue
+            job = self.loading.pop(path, None)
+            if job is not None:
+                # a parse that started before the edit may read the old tail
+                job.cancel()
+            self.set_file(file._replace(state=file_state.PENDING))
+        self.start_loads()
+
+    def start_loads(self) -> None:
+        while self.wanted and len(self.loading) < self.max_loads:
+            path = self.wanted.pop()
+            file = self.file(path)
+            if file is None or file.state != file_state.PENDING:
+                continue
+            self.set_file(file._replace(state=file_state.LOADING))
+            job = task(load_spools, path)
+            job.signals.finished.connect(lambda spools, job=job: self.file_parsed(job, spools))
+            job.signals.failed.connect(lambda e, job=job: self.file_parsed(job, None, str(e)))
+            self.loading[path] = self.tasks.start_task(job)
+
+    def file_parsed(self, job: task, spools: Union[dict[int, str], None], error: Union[str, None] = None) -> None:
+        """
+        Store the spools of a parsed file and start parsing the next requested file, the result of a parse that was
+        cancelled or replaced since it started is dropped
+        :param job: the task that parsed the file
+        :param spools: extruder number -> spool name, None if the file could not be parsed
+        :param error: why the file could not be parsed
+        """
+        path = job.args[0]
+        if self.loading.get(path) is not job:
+            return
+        del self.loading[path]
+        file = self.file(path)
+        if file is not None:
+            if spools is None:
+                self.set_file(file._replace(state=file_state.FAILED, error=error))
+            else:
+                self.set_file(file._replace(state=file_state.LOADED, spools=spools, error=None))
+            self.file_loaded.emit(path)
+        self.start_loads()
+
+    def set_file(self, file: WorkspaceFile) -> None:
+        row = self.rows[file.path]
+        self.files[row] = file
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+def describe(file: WorkspaceFile) -> str:
+    """
+    :return: the state of a file or its spool names, as shown in its row
+    """
+    if file.state == file_state.FAILED:
+        return f"could not be read: {file.error}"
+    if file.state != file_state.LOADED:
+        return "loading..."
+    if not file.spools:
+        return "no spools tagged, the file may not have been sliced correctly"
+    return ", ".join(spool or "(untagged)" for spool in file.spools.values())
+
+
+def load_spools(job: task, gcode_path: str) -> Union[dict[int, str], None]:
+    """
+    Background job reading the spool of each extruder from the tail of a gcode file
+    :param job: the running task
+    :param gcode_path: the path to the gcode file
+    :return: extruder number -> spool name
+    """
+    if job.is_cancelled():
+        return None
+    return postprocessor.get_spools(postprocessor.parse_gcode(gcode_path))
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Union
+
+
+class PathJobQueue:
+    """
+    Run jobs that each work on one file, jobs for the same path run one after another in submission order while jobs
+    for different paths run in parallel on a thread pool
+    """
+
+    def __init__(self, max_workers: Union[int, None] = None):
+        """
+        :param max_workers: the maximum number of files worked on at once, defaults to the cpu count
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 4,
+                                            thread_name_prefix="nvf-job")
+        self._lock = threading.Lock()
+        # pending jobs per path, a path is present while one of its jobs is running
+        self._pending: dict[str, deque[tuple[Future, Callable[..., Any], tuple, dict]]] = {}
+
+    def submit(self, path: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Queue a job for a path
+        :param path: the file the job works on
+        :param fn: the job function
+        :return: a future resolving to the return value of fn
+        """
+        key = os.path.normcase(os.path.abspath(path))
+        future: Future = Future()
+        with self._lock:
+            if key in self._pending:
+                self._pending[key].append((future, fn, args, kwargs))
+                return future
+            self._pending[key] = deque()
+        self._executor.submit(self._run, key, future, fn, args, kwargs)
+        return future
+
+    def _run(self, key: str, future: Future, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        """
+        Run a job and then hand the thread to the next job queued for the same path
+        """
+        while True:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._lock:
+                queue = self._pending[key]
+                if not queue:
+                    del self._pending[key]
+                    return
+                future, fn, args, kwargs = queue.popleft()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the queue, waiting for queued jobs to finish if wait is True
+        """
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> PathJobQueue:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.shutdown()
@@ -1,21 +1,24 @@
 from __future__ import annotations
 
-import json
 import math
 import os
-import re
 import sys
-import time
-from threading import Thread
-from urllib.parse import urljoin
 
-import requests
 from PyQt6.QtCore import Qt, QTimer, QSize
 from PyQt6.QtGui import QIcon
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel, QVBoxLayout, QWidget, QFileDialog,
-                             QHBoxLayout, QLineEdit, QWIDGETSIZE_MAX)
+                             QHBoxLayout, QLineEdit, QProgressBar, QListView, QAbstractItemView, QWIDGETSIZE_MAX)
 
+import octoprint_client
 import postprocessor
+from export_coalescer import export_listener, forward_file
+from gcode_workspace import file_state, gcode_workspace
+from octoprint_client import check_octoprint_settings, get_loaded_spool_records, get_spool_manager_response
+from placeholders import spool_fields
+from settings_store import SettingsStore
+from spool_subscription import spool_subscription
+from spool_matcher import SpoolCatalog, Match, catalog_records, gcode_filaments
+from task_runner import task, task_runner
 
 
 class modes:
@@ -35,6 +38,8 @@ if getattr(sys, 'frozen', False):
 SETTINGS_PATH = os.path.join(SETTINGS_DIR, SETTINGS_FILENAME)
 LEGACY_SETTINGS_PATH = os.path.join(SETTINGS_DIR, LEGACY_SETTINGS_FILENAME)
 
+SETTINGS_STORE = SettingsStore(SETTINGS_PATH, legacy_paths=(LEGACY_SETTINGS_PATH,))
+
 MAX_WIDTH = 800
 
 
@@ -49,9 +54,17 @@ class main_app(QMainWindow):
         self.setObjectName("Nozzle Filament Validator Post-Processor")
         self.setWindowFlag(Qt.WindowType.WindowMaximizeButtonHint, False)
 
-        self.json_data: dict = load_json_data()
+        self.json_data: dict = load_json_data(settings)
 
         self.gcode_path = None
+        # the files exported by the slicer, the first from the command line and the rest forwarded by later instances
+        self.export_paths: list[str] = [os.path.abspath(sys.argv[1])] if MODE == modes.POST_PROCESSOR else []
+        self.export_extruders: dict[str, int] = {}
+        # path -> (bytes written, total bytes) of each file of the running batch of edits
+        self.batch_progress: dict[str, tuple[int, int]] = {}
+        self.batch_errors: dict[str, str] = {}
+        self.batch_size = 0
+        self.export_listener: export_listener | None = None
 
         try:
             self.octoprint_url = settings["octoprint_url"] if settings["octoprint_url"] is not None else None
@@ -62,7 +75,13 @@ class main_app(QMainWindow):
         except KeyError:
             self.octoprint_api_key = None
 
-        self.pick_path_button = QPushButton("Select Gcode file")
+        self.pick_path_button = QPushButton("Open Gcode files")
+        self.pick_folder_button = QPushButton("Open folder")
+        # the gcode files open in stand-alone mode, parsed in the background when they are shown
+        self.workspace = gcode_workspace(self)
+        self.file_list = QListView()
+        # the file whose spools are shown once it is parsed
+        self.awaiting_spools: str | None = None
         self.save_button = QPushButton("Save data")
         self.file_path_layout = QLabel("Gcode file path: ")
         self.continue_print = QPushButton("Export")
@@ -73,9 +92,25 @@ class main_app(QMainWindow):
         self.octoprint_api_key_field = QLineEdit(self.octoprint_api_key)
         self.octoprint_url_button = QPushButton("Save Octoprint settings")
         self.load_current_spool_button = QPushButton("load current spools")
+        self.suggest_spools_button = QPushButton("Suggest spools from the catalog")
+        # the indexed SpoolManager catalog, loaded the first time spools are suggested
+        self.spool_catalog: SpoolCatalog | None = None
         self.num_of_extruders_label = QLabel("Number of extruders in gcode: ")
         self.octoprint_error = QLabel("")
         self.edit_gcode_button = QPushButton("Edit Gcode")
+        self.add_button = QPushButton("Add")
+        # extruder key -> the row showing it, rows are kept between updates and only changed where the data changed
+        self.extruder_rows: dict[str, extruder_row] = {}
+        self.progress_bar = QProgressBar()
+        self.cancel_button = QPushButton("Cancel")
+        self.error_timer = QTimer(self)
+        self.save_button_timer = QTimer(self)
+        # file edits and octoprint requests run in the background so the window stays responsive
+        self.tasks = task_runner(self)
+        # pushes spool selection changes from octoprint, started once the octoprint settings are known
+        self.spool_subscription: spool_subscription | None = None
+        # the spool records last pushed by the subscription, in order of the extruders
+        self.selected_spools: list[dict | None] | None = None
 
         # setup the elements
         self.setup_elements()
@@ -98,6 +133,12 @@ class main_app(QMainWindow):
         # set the central widget
         self.setCentralWidget(container)
 
+        self.subscribe_to_spools()
+
+        if MODE == modes.POST_PROCESSOR and settings.get("suggest_spools"):
+            # propose spools for the sliced filaments right away, they are only used once the export is confirmed
+            self.suggest_spools()
+
     def setup_elements(self) -> None:
         """
         Setup the elements of the window
@@ -119,15 +160,32 @@ class main_app(QMainWindow):
         # only allow json files by default
         self.save_button.clicked.connect(self.save_button_click)
         self.pick_path_button.clicked.connect(self.pick_file_button_click)
+        self.pick_folder_button.clicked.connect(self.pick_folder_button_click)
+        self.file_list.setModel(self.workspace)
+        # only the rows in view are asked for, so only their files are parsed
+        self.file_list.setUniformItemSizes(True)
+        self.file_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.file_list.setFixedHeight(160)
+        self.file_list.selectionModel().selectionChanged.connect(lambda *_: self.files_selected())
+        self.workspace.file_loaded.connect(self.workspace_file_loaded)
         # self.file_dialog.fileSelected.connect(self.handle_file_selected)
         self.load_current_spool_button.clicked.connect(self.load_current_spools)
+        self.suggest_spools_button.clicked.connect(self.suggest_spools)
         self.edit_gcode_button.clicked.connect(self.edit_gcode)
+        self.add_button.clicked.connect(self.add_extruder)
+        self.cancel_button.clicked.connect(self.tasks.cancel_all)
+        self.error_timer.setSingleShot(True)
+        self.error_timer.timeout.connect(lambda: self.octoprint_error.setText(""))
+        self.save_button_timer.setSingleShot(True)
+        self.save_button_timer.timeout.connect(lambda: self.save_button.setText("Save Data"))
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.hide()
+        self.cancel_button.hide()
         if MODE == modes.POST_PROCESSOR:
-            self.num_of_extruders_label.setText(f"Number of extruders in gcode:"
-                                                f" {get_num_extruders_from_gcode(sys.argv[1])}")
+            self.update_export_label()
         if MODE == modes.STAND_ALONE:
-            self.file_path_layout.setText(
-                f"Gcode file path: {self.get_gcode_path() if self.get_gcode_path() else 'No file selected'}")
+            self.setAcceptDrops(True)
+            self.update_file_label()
         else:
             self.file_path_layout.setText(f"Post-processing the slicer file")
 
@@ -138,9 +196,13 @@ class main_app(QMainWindow):
         self.layout.setSpacing(10)
         set_global_stretch_factor(self.layout, 0)
         self.data_box.setSpacing(5)
+        self.data_box.addWidget(self.add_button)
         self.layout.addWidget(self.file_path_layout)
         if MODE == modes.STAND_ALONE:
-            self.layout.addWidget(self.pick_path_button)
+            pick_buttons = QHBoxLayout()
+            pick_buttons.addWidget(self.pick_path_button)
+            pick_buttons.addWidget(self.pick_folder_button)
+            self.layout.addLayout(pick_buttons)
             self.layout.addWidget(self.edit_gcode_button)
         else:
             self.layout.addWidget(self.continue_print)
@@ -151,23 +213,29 @@ class main_app(QMainWindow):
         self.layout.addWidget(self.octoprint_api_key_field)
         self.layout.addWidget(self.octoprint_url_button)
         self.layout.addWidget(self.load_current_spool_button)
+        self.layout.addWidget(self.suggest_spools_button)
         self.layout.addWidget(self.octoprint_error)
-        if MODE == modes.POST_PROCESSOR:
-            self.layout.addWidget(self.num_of_extruders_label)
 
         data_boxes = QWidget()
         data_boxes.setLayout(self.layout)
-        data_boxes.setFixedHeight(375)
+        data_boxes.setFixedHeight(420)
         bottom_buttons = QVBoxLayout()
         self.widget.addWidget(data_boxes)
+        if MODE == modes.POST_PROCESSOR:
+            # outside the fixed height box, it grows with the files forwarded by other instances
+            self.widget.addWidget(self.num_of_extruders_label)
+        else:
+            self.widget.addWidget(self.file_list)
         self.widget.addLayout(self.data_box)
         self.widget.setSpacing(15)
+        bottom_buttons.addWidget(self.progress_bar)
+        bottom_buttons.addWidget(self.cancel_button)
         bottom_buttons.addWidget(self.save_button)
         self.widget.addLayout(bottom_buttons)
 
     def continue_print_click(self) -> None:
         """
-        Save the data and close the window
+        Save the data and edit every exported file in parallel, the window closes once they are all edited
         only used when in post-processor mode
         """
         if self.json_data is None:
@@ -175,50 +243,282 @@ class main_app(QMainWindow):
             return
         self.octoprint_error.setText("")
         self.save_data()
-        postprocessor.main(sys.argv[1], json_data=postprocessor.parse_json_data(self.json_data))
-        self.close()
+        if self.export_listener is not None:
+            # files forwarded from now on are exported by their own instance
+            self.export_listener.stop_accepting()
+        self.set_busy(True)
+        json_data = postprocessor.parse_json_data(self.json_data)
+        self.start_batch(self.export_paths, json_data, False, self.file_exported)
+
+    def attach_export_listener(self, listener: export_listener) -> None:
+        """
+        Add the files forwarded by later instances to this window
+        :param listener: the listener the instances forward their files to
+        """
+        self.export_listener = listener
+        listener.file_received.connect(self.add_export_file)
+
+    def add_export_file(self, path: str) -> None:
+        """
+        Add a file forwarded by another instance to the files exported with the next click
+        :param path: the absolute gcode path
+        """
+        if path not in self.export_paths:
+            self.export_paths.append(path)
+            self.update_export_label()
+            self.resize_to_contents()
+        self.raise_()
+        self.activateWindow()
+
+    def update_export_label(self) -> None:
+        """
+        List the exported files with the number of extruders of each
+        """
+        for path in self.export_paths:
+            if path not in self.export_extruders:
+                self.export_extruders[path] = get_num_extruders_from_gcode(path)
+        if len(self.export_paths) == 1:
+            self.num_of_extruders_label.setText(f"Number of extruders in gcode: "
+                                                f"{self.export_extruders[self.export_paths[0]]}")
+            return
+        self.num_of_extruders_label.setText(f"Exporting {len(self.export_paths)} files:\n" + "\n".join(
+            f"{os.path.basename(path)}: {self.export_extruders[path]} extruders" for path in self.export_paths))
+
+    def start_batch(self, paths: list[str], json_data: list, undo: bool, on_file_done) -> None:
+        """
+        Edit several gcode files with the same spool data in parallel, showing their combined progress
+        :param paths: the paths to the gcode files
+        :param json_data: the placeholder values in order of the extruders
+        :param undo: record each edit in the undo journal of its file
+        :param on_file_done: called with the path and the error, None if the file was edited, as each file is done
+        """
+        self.set_busy(True)
+        self.batch_progress = {path: (0, 0) for path in paths}
+        self.batch_errors = {}
+        self.batch_size = len(paths)
+        for path in paths:
+            self.tasks.start(edit_gcode_file, path, json_data, undo,
+                             on_finished=lambda _, path=path: on_file_done(path, None),
+                             on_failed=lambda e, path=path: on_file_done(path, str(e)),
+                             on_cancelled=lambda path=path: on_file_done(path, "cancelled"),
+                             on_progress=lambda done, total, path=path: self.show_batch_progress(path, done, total))
+
+    def show_batch_progress(self, path: str, done: int, total: int) -> None:
+        """
+        Show the combined progress of the files being edited
+        :param path: the file the progress is for
+        :param done: the bytes written so far to the file
+        :param total: the total bytes to write to the file
+        """
+        self.batch_progress[path] = (done, total)
+        self.show_progress(sum(done for done, _ in self.batch_progress.values()),
+                           sum(total for _, total in self.batch_progress.values()))
+
+    def finish_batch_file(self, path: str, error: str | None) -> bool:
+        """
+        Record that a file of the running batch is done
+        :param path: the edited file
+        :param error: why the file could not be edited, None if it was edited
+        :return: True once every file of the batch is done
+        """
+        self.batch_progress.pop(path, None)
+        if error is not None:
+            self.batch_errors[path] = error
+        if self.batch_progress:
+            return False
+        self.set_busy(False)
+        return True
+
+    def show_batch_errors(self) -> None:
+        self.show_message("Could not edit " + ", ".join(
+            f"{os.path.basename(path)} ({error})" for path, error in self.batch_errors.items()), 15)
+
+    def file_exported(self, path: str, error: str | None = None) -> None:
+        """
+        Release the instance that forwarded a file once it is edited, and close the window once every file is
+        :param path: the edited file
+        :param error: why the file could not be edited, None if it was edited
+        """
+        if self.export_listener is not None:
+            self.export_listener.finish(path, error)
+        if not self.finish_batch_file(path, error):
+            return
+        if not self.batch_errors:
+            self.close()
+            return
+        self.show_batch_errors()
 
     def edit_gcode(self) -> None:
         """
-        Open the gcode file in the default text editor
+        Write the spool data to every selected gcode file at once, each edit can be undone on its own
         """
         self.save_data()
-        if self.get_gcode_path() is not None:
-            postprocessor.main(self.get_gcode_path(), json_data=postprocessor.parse_json_data(self.json_data))
-            self.octoprint_error.setText("Gcode updated successfully")
-            Thread(target=self.clear_error, args=(5,)).start()
+        paths = self.selected_paths()
+        if not paths:
+            self.show_message("No Gcode file selected")
+            return
+        self.start_batch(paths, postprocessor.parse_json_data(self.json_data), True, self.file_edited)
+
+    def file_edited(self, path: str, error: str | None = None) -> None:
+        """
+        Parse a file of the workspace again once it is edited, and report the batch once every file is
+        :param path: the edited file
+        :param error: why the file could not be edited, None if it was edited
+        """
+        self.workspace.invalidate([path])
+        if not self.finish_batch_file(path, error):
+            return
+        if self.batch_errors:
+            self.show_batch_errors()
+        elif self.batch_size == 1:
+            self.show_message("Gcode updated successfully")
         else:
-            self.octoprint_error.setText("No Gcode file selected")
-            Thread(target=self.clear_error, args=(5,)).start()
+            self.show_message(f"{self.batch_size} Gcode files updated successfully")
+
+    def set_busy(self, busy: bool) -> None:
+        """
+        Show or hide the progress of a running edit and block starting another one
+        :param busy: True while an edit is running
+        """
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(busy)
+        self.cancel_button.setVisible(busy)
+        for button in (self.edit_gcode_button, self.continue_print, self.pick_path_button, self.pick_folder_button):
+            button.setEnabled(not busy)
+
+    def show_progress(self, done: int, total: int) -> None:
+        """
+        Show the progress of a running edit
+        :param done: the bytes written so far
+        :param total: the total bytes to write
+        """
+        self.progress_bar.setValue(int(done * 100 / total) if total else 100)
+
+    def show_message(self, message: str, delay: int = 5) -> None:
+        """
+        Show a message under the octoprint settings and clear it after a delay
+        :param message: the message
+        :param delay: the delay in seconds before clearing the text
+        """
+        self.octoprint_error.setText(message)
+        self.clear_error(delay)
 
     def clear_error(self, delay: int) -> None:
         """
-        Clear the error text after a specified delay.
-        This function is meant to be run in a separate thread
+        Clear the error text after a specified delay, restarting the delay if a clear is already pending
         :param delay: the delay in seconds before clearing the text
         """
-        time.sleep(delay)
-        self.octoprint_error.setText("")
+        self.error_timer.start(delay * 1000)
 
     def load_current_spools(self) -> None:
         """
-        Load the current spools from octoprint and store them in the json_data dictionary
+        Load the current spools from octoprint in the background and store them in the json_data dictionary, the
+        selection pushed by octoprint is used without a request when it is known
         """
         url = self.octoprint_url_field.text() or self.octoprint_url
         api_key = self.octoprint_api_key_field.text() or self.octoprint_api_key
-        spools, error = get_loaded_spools(url, api_key)
+        if self.selected_spools is not None and url == self.octoprint_url:
+            self.current_spools_loaded((self.selected_spools, None))
+            return
+        self.load_current_spool_button.setEnabled(False)
+        self.tasks.start(lambda _: get_loaded_spool_records(url, api_key, allow_stale=True),
+                         on_finished=self.current_spools_loaded,
+                         on_failed=lambda e: self.current_spools_loaded((None, str(e))))
+
+    def subscribe_to_spools(self) -> None:
+        """
+        Follow the spool selection on octoprint so the rows change as soon as a spool is selected there, any previous
+        subscription is stopped. Turned off with the live_spool_updates setting
+        """
+        if self.spool_subscription is not None:
+            self.spool_subscription.stop()
+            self.spool_subscription.deleteLater()
+            self.spool_subscription = None
+        if not self.octoprint_url or not self.settings.get("live_spool_updates", True):
+            return
+        self.spool_subscription = spool_subscription(self.octoprint_url, self.octoprint_api_key, self.tasks,
+                                                     get_loaded_spool_records, self)
+        self.spool_subscription.selection_changed.connect(self.spool_selection_changed)
+        self.spool_subscription.status_changed.connect(self.show_message)
+        self.spool_subscription.start()
+
+    def spool_selection_changed(self, spools: list[dict | None]) -> None:
+        """
+        Update the rows of the extruders whose selected spool changed on octoprint, the other rows keep their edits.
+        The first selection is only stored, the rows keep the saved spools until a spool is changed
+        :param spools: the selected spool record of each extruder
+        """
+        previous = self.selected_spools
+        self.selected_spools = spools
+        if previous is None:
+            return
+        for i, spool in enumerate(spools):
+            if i < len(previous) and previous[i] == spool:
+                continue
+            self.json_data[str(i + 1)] = spool_fields(spool, self.settings.get("template_fields"))
+        self.update_display_data(self.json_data)
+
+    def current_spools_loaded(self, result: tuple[list[dict | None] | None, str | None]) -> None:
+        """
+        Show the spools loaded by load_current_spools
+        :param result: the loaded spool records and error message, if there are records too they are the last known
+        selection and the message says how old it is
+        """
+        self.load_current_spool_button.setEnabled(True)
+        spools, error = result
         if spools is None:
             self.octoprint_error.setText(error)
             return
-        # if the spool is none add an empty string to the json_data
+        # keep every placeholder value of the spool, the spool name is an empty string if no spool is selected
         for i, spool in enumerate(spools):
-            self.json_data[str(i + 1)] = {"sm_name": spool}
+            self.json_data[str(i + 1)] = spool_fields(spool, self.settings.get("template_fields"))
 
         self.update_display_data(self.json_data)
+        # a stale selection stays marked until the spools are loaded again
+        self.octoprint_error.setText(error or "")
+
+    def suggest_spools(self) -> None:
+        """
+        Propose a spool from the SpoolManager catalog for each extruder of the gcode, matching the material, color and
+        vendor the gcode was sliced with. The catalog is loaded and indexed in the background the first time
+        """
+        gcode_path = sys.argv[1] if MODE == modes.POST_PROCESSOR else self.get_gcode_path()
+        if gcode_path is None:
+            self.show_message("No Gcode file selected")
+            return
+        url = self.octoprint_url_field.text() or self.octoprint_url
+        api_key = self.octoprint_api_key_field.text() or self.octoprint_api_key
+        self.suggest_spools_button.setEnabled(False)
+        self.tasks.start(suggest_spools, gcode_path, url, api_key, self.spool_catalog,
+                         on_finished=self.spools_suggested,
+                         on_failed=lambda e: self.spools_suggested((self.spool_catalog, None, str(e))))
+
+    def spools_suggested(self, result: tuple[SpoolCatalog | None, list[Match] | None, str | None]) -> None:
+        """
+        Show the spools proposed by suggest_spools, extruders without a proposal keep their spool
+        :param result: the catalog, the proposed spool of each extruder and an error message
+        """
+        self.suggest_spools_button.setEnabled(True)
+        self.spool_catalog, matches, error = result
+        if matches is None:
+            self.octoprint_error.setText(error)
+            return
+        for i, match in enumerate(matches):
+            if match.spool is not None:
+                self.json_data[str(i + 1)] = spool_fields(match.spool, self.settings.get("template_fields"))
+        self.update_display_data(self.json_data)
+        proposed = sum(match.spool is not None for match in matches)
+        review = [str(i + 1) for i, match in enumerate(matches) if match.review]
+        if review:
+            self.show_message(f"Suggested spools for {proposed} of {len(matches)} extruders, the spools of extruders "
+                              f"{', '.join(review)} are a poor fit, check them before exporting")
+        else:
+            self.show_message(f"Suggested spools for {proposed} of {len(matches)} extruders, check them before "
+                              f"exporting")
 
     def get_gcode_path(self) -> str | None:
         """
-        Get the path to the gcode file
+        Get the path to the gcode file, the first selected file of the workspace in stand-alone mode
         :return: the path to the gcode file or None if the file is not set
         """
 
@@ -226,11 +526,23 @@ class main_app(QMainWindow):
 
     def save_octoprint_url(self) -> None:
         """
-        Save the octoprint url to the settings
+        Check the octoprint settings in the background and save them to the settings if they work
         """
         url = self.octoprint_url_field.text()
         api_key = self.octoprint_api_key_field.text()
-        octoprint_check = check_octoprint_settings(url, api_key)
+        self.octoprint_url_button.setEnabled(False)
+        self.tasks.start(lambda _: check_octoprint_settings(url, api_key),
+                         on_finished=lambda result: self.octoprint_settings_checked(url, api_key, result),
+                         on_failed=lambda e: self.octoprint_settings_checked(url, api_key, str(e)))
+
+    def octoprint_settings_checked(self, url: str, api_key: str, octoprint_check: bool | str) -> None:
+        """
+        Save the octoprint settings checked by save_octoprint_url
+        :param url: the checked url
+        :param api_key: the checked api key
+        :param octoprint_check: True if the settings work, the error message otherwise
+        """
+        self.octoprint_url_button.setEnabled(True)
         if octoprint_check is not True:
             self.octoprint_error.setText(octoprint_check)
         else:
@@ -240,75 +552,77 @@ class main_app(QMainWindow):
             self.octoprint_error.setText("Octoprint settings saved successfully")
             self.octoprint_url = url
             self.octoprint_api_key = api_key
+            self.subscribe_to_spools()
 
     def read_current_spools(self) -> None:
         """
-        Read the spool names from the display and update the json_data dictionary
-        """
-        # Iterate over the widgets in the data_box layout
-        for i in range(self.data_box.count()):
-            widget = self.data_box.itemAt(i).widget()
-            if widget:
-                # Get the layout of the widget
-                layout = widget.layout()
-                if layout:
-                    # Get the extruder number from the QLabel
-                    extruder_number = layout.itemAt(0).widget().text().split()[1][:-1]
-                    # Get the spool name from the QLineEdit
-                    spool_name = layout.itemAt(1).widget().text()
-                    # Update the json_data dictionary
-                    self.json_data[extruder_number]['sm_name'] = spool_name
+        Make sure the json_data dictionary has the spool names shown on the display,
+        the rows write every edit to json_data as it is made so only rows without an entry need to be filled in
+        """
+        for key, row in self.extruder_rows.items():
+            if key not in self.json_data:
+                self.json_data[key] = {'sm_name': row.spool_name_field.text()}
+
+    def spool_name_edited(self, key: str, spool_name: str) -> None:
+        """
+        spool name edit event handler, stores the edited name in the json data
+        :param key: the key of the edited extruder
+        :param spool_name: the new spool name
+        """
+        # the other spool values no longer apply if the name was edited
+        if self.json_data.get(key, {}).get('sm_name') != spool_name:
+            self.json_data[key] = {'sm_name': spool_name}
 
     def clear_extruder_data(self) -> None:
         """
         Clear the extruder data from the display
         """
-        # remove current data while leaving buttons
-        for i in reversed(range(self.data_box.count())):
-            widget = self.data_box.itemAt(i).widget()
-            if widget is not None:
-                # Remove widget from data_box
-                self.data_box.removeWidget(widget)
-                # Delete widget
-                widget.destroy()
+        for key in list(self.extruder_rows):
+            self.remove_extruder_row(key)
+
+    def remove_extruder_row(self, key: str) -> None:
+        """
+        Remove the row of an extruder from the display
+        :param key: the key of the extruder
+        """
+        row = self.extruder_rows.pop(key)
+        self.data_box.removeWidget(row)
+        row.deleteLater()
 
     def update_display_data(self, json_data: dict[str, dict[str, str]] | dict[str, None]) -> None:
         """
-        Update the display with the json data
+        Update the display with the json data, only the rows of extruders that were added, removed or changed are
+        touched
         :param json_data: the json data to display
         """
-        self.clear_extruder_data()
-        for key, value in json_data.items():
-            # Create a QHBoxLayout for each extruder
-            extruder_layout = QHBoxLayout()
-            # Create a QLabel for the extruder number and add it to the layout
-            extruder_label = QLabel(f"Extruder {key}:")
-            extruder_layout.addWidget(extruder_label)
-            # Create a QLineEdit for the spool name and add it to the layout
-            spool_name_field = QLineEdit(value['sm_name'])
-            extruder_layout.addWidget(spool_name_field)
-            # Create a QPushButton for removing the extruder and add it to the layout
-            remove_button = QPushButton("Remove")
-            remove_button.clicked.connect(lambda: self.remove_extruder(key))
-            extruder_layout.addWidget(remove_button)
-            # Create a QWidget to hold the layout and add a border to it
-            extruder_widget = QWidget()
-            extruder_widget.setLayout(extruder_layout)
-            extruder_widget.setStyleSheet("border: 1px solid black;")
-            # Add the QWidget to the data_box layout
-            extruder_widget.setFixedHeight(54)
-            self.data_box.addWidget(extruder_widget)
-        # Create a QPushButton for adding a new extruder and add it to the layout
-        add_button = QPushButton("Add")
-        add_button.clicked.connect(self.add_extruder)
-        self.data_box.addWidget(add_button)
+        row_count = len(self.extruder_rows)
+        self.setUpdatesEnabled(False)
+        try:
+            for key in [key for key in self.extruder_rows if key not in json_data]:
+                self.remove_extruder_row(key)
+            for index, (key, value) in enumerate(json_data.items()):
+                row = self.extruder_rows.get(key)
+                if row is None:
+                    row = extruder_row(key, self)
+                    self.extruder_rows[key] = row
+                row.set_spool_name((value or {}).get('sm_name'))
+                if self.data_box.indexOf(row) != index:
+                    # (re)insert the row at its position, before the add button
+                    self.data_box.removeWidget(row)
+                    self.data_box.insertWidget(index, row)
+        finally:
+            self.setUpdatesEnabled(True)
+
+        if len(self.extruder_rows) != row_count or not self.isVisible():
+            self.resize_to_contents()
+
+    def resize_to_contents(self) -> None:
+        """
+        Resize the window to fit the extruder rows and lock it at that size
+        """
         self.setMinimumSize(MAX_WIDTH, 0)
-        if self.centralWidget():
-            self.centralWidget().update()
+        self.setMaximumHeight(QWIDGETSIZE_MAX)
         self.adjustSize()
-        if self.centralWidget():
-            self.centralWidget().update()
-
         self.setFixedWidth(MAX_WIDTH)
         # Use a QTimer to delay the call to self.size()
         QTimer.singleShot(0, self.lock_size)
@@ -355,7 +669,7 @@ class main_app(QMainWindow):
         self.read_current_spools()
         if self.json_data is None or self.json_data == {}:
             self.save_button.setText("No data to save")
-            Thread(target=self.clear_save_button, args=(10,)).start()
+            self.clear_save_button(10)
             return
         else:
             self.save_data()
@@ -363,53 +677,208 @@ class main_app(QMainWindow):
             self.save_button.setText("Data saved successfully")
             delay = 2
 
-        Thread(target=self.clear_save_button, args=(delay,)).start()
+        self.clear_save_button(delay)
 
     def clear_save_button(self, delay: int) -> None:
         """
-        Clear the save button text after a specified delay.
-        This function is meant to be run in a separate thread
+        Clear the save button text after a specified delay, restarting the delay if a clear is already pending
         :param delay: the delay in seconds before clearing the text
         """
-        time.sleep(delay)
-        self.save_button.setText("Save Data")
+        self.save_button_timer.start(delay * 1000)
+
+    def closeEvent(self, event) -> None:
+        """
+        Stop the background tasks before the window closes, a cancelled edit leaves the gcode file untouched. The
+        requests to octoprint are given up on instead of waited for, so a host that doesn't answer can't hold up the
+        export
+        """
+        if self.spool_subscription is not None:
+            self.spool_subscription.stop()
+        octoprint_client.abort_requests()
+        self.tasks.cancel_all()
+        self.workspace.tasks.cancel_all()
+        self.tasks.wait()
+        self.workspace.tasks.wait()
+        if self.export_listener is not None:
+            # the instances still waiting export their file as it is
+            self.export_listener.close()
+        super().closeEvent(event)
 
     def pick_file_button_click(self) -> None:
         """
-        Open a file dialog to select the json file
+        Open a file dialog to add gcode files to the workspace
         """
         home_dir = os.path.expanduser('~')
-        file_name, _ = QFileDialog.getOpenFileName(self, "Select the data json file", home_dir, "Gcode Files (*.gcode)")
-
-        if file_name:
-            _, ext = os.path.splitext(file_name)
-            # If not, add .json
-            if not ext:
-                file_name += '.gcode'
-            self.gcode_path = file_name
+        file_names, _ = QFileDialog.getOpenFileNames(self, "Select the Gcode files", home_dir,
+                                                     "Gcode Files (*.gcode *.gco *.g)")
+        if file_names:
+            self.open_paths(file_names)
+
+    def pick_folder_button_click(self) -> None:
+        """
+        Open a folder dialog to add the gcode files of a folder and its subfolders to the workspace
+        """
+        folder = QFileDialog.getExistingDirectory(self, "Select a folder of Gcode files", os.path.expanduser('~'))
+        if folder:
+            self.open_paths([folder])
+
+    def dragEnterEvent(self, event) -> None:
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+
+    def dropEvent(self, event) -> None:
+        """
+        Add the dropped gcode files and folders to the workspace
+        """
+        paths = [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+        if paths:
+            event.acceptProposedAction()
+            self.open_paths(paths)
+
+    def open_paths(self, paths: list[str]) -> None:
+        """
+        List gcode files and folders in the workspace right away, their spools are read as they come into view
+        :param paths: gcode file and folder paths
+        """
+        added = self.workspace.add_paths(paths)
+        if not added:
+            self.show_message("No new Gcode files found")
+            return
+        if not self.selected_paths():
+            self.file_list.setCurrentIndex(self.workspace.index(self.workspace.rows[added[0]]))
+        self.file_list.scrollTo(self.workspace.index(self.workspace.rows[added[0]]))
+        self.update_file_label()
+
+    def selected_paths(self) -> list[str]:
+        """
+        :return: the paths of the selected files of the workspace, in the order they are listed
+        """
+        return [self.workspace.path_at(index.row())
+                for index in sorted(self.file_list.selectionModel().selectedRows(), key=lambda index: index.row())]
+
+    def files_selected(self) -> None:
+        """
+        Show the spools of the first selected file, they are written to every selected file by the next edit
+        """
+        paths = self.selected_paths()
+        self.gcode_path = paths[0] if paths else None
+        self.update_file_label()
+        if paths:
+            self.show_file_spools(paths[0])
+        else:
+            self.awaiting_spools = None
+
+    def update_file_label(self) -> None:
+        paths = self.selected_paths()
+        if len(paths) > 1:
+            self.file_path_layout.setText(f"{len(paths)} of {len(self.workspace.files)} Gcode files selected, the "
+                                          f"spools of {os.path.basename(paths[0])} are written to all of them")
+        else:
             self.file_path_layout.setText(
                 f"Gcode file path: {self.get_gcode_path() if self.get_gcode_path() else 'No file selected'}")
-            self.get_spools_from_gcode()
 
-    def get_spools_from_gcode(self):
+    def show_file_spools(self, path: str) -> None:
         """
-        Get the spools from the gcode file and update the json data
+        Show the spools of a file of the workspace, once it is parsed if it isn't yet
+        :param path: the path of the file
         """
-        spools = get_spools_from_gcode(self.get_gcode_path())
-        if spools is None or spools == {}:
-            self.octoprint_error.setText("Could not load the spools, file may not have been sliced correctly")
-            Thread(target=self.clear_error, args=(5,)).start()
-            self.gcode_path = None
-            self.json_data = load_json_data()
+        file = self.workspace.file(path)
+        if file.state not in (file_state.LOADED, file_state.FAILED):
+            self.awaiting_spools = path
+            self.workspace.request(path)
+            return
+        self.awaiting_spools = None
+        if not file.spools:
+            self.show_message("Could not load the spools, file may not have been sliced correctly")
+            self.json_data = load_json_data(self.settings)
             self.update_display_data(self.json_data)
             return
-        self.file_path_layout.setText(f"Gcode file path: "
-                                      f"{self.get_gcode_path() if self.get_gcode_path() else 'No file selected'}")
         self.json_data = {}
-        for i, spool in spools.items():
+        for i, spool in file.spools.items():
             self.json_data[str(i)] = {"sm_name": spool}
         self.update_display_data(self.json_data)
 
+    def workspace_file_loaded(self, path: str) -> None:
+        """
+        Show the spools of the selected file once it is parsed, rows edited since then are left alone
+        :param path: the parsed file
+        """
+        if path == self.awaiting_spools:
+            self.show_file_spools(path)
+
+
+class extruder_row(QWidget):
+    """
+    The row showing the spool name of one extruder
+    """
+
+    def __init__(self, key: str, window: main_app):
+        """
+        :param key: the key of the extruder in the json data
+        :param window: the window the row belongs to
+        """
+        super().__init__()
+        self.key = key
+        extruder_layout = QHBoxLayout()
+        # Create a QLabel for the extruder number and add it to the layout
+        extruder_layout.addWidget(QLabel(f"Extruder {key}:"))
+        # Create a QLineEdit for the spool name and add it to the layout
+        self.spool_name_field = QLineEdit()
+        self.spool_name_field.textEdited.connect(lambda text: window.spool_name_edited(self.key, text))
+        extruder_layout.addWidget(self.spool_name_field)
+        # Create a QPushButton for removing the extruder and add it to the layout
+        remove_button = QPushButton("Remove")
+        remove_button.clicked.connect(lambda: window.remove_extruder(self.key))
+        extruder_layout.addWidget(remove_button)
+        self.setLayout(extruder_layout)
+        self.setStyleSheet("border: 1px solid black;")
+        self.setFixedHeight(54)
+
+    def set_spool_name(self, spool_name: str | None) -> None:
+        """
+        Show a spool name, the field is left alone if it already shows it so the cursor doesn't jump
+        :param spool_name: the spool name
+        """
+        spool_name = spool_name or ""
+        if self.spool_name_field.text() != spool_name:
+            self.spool_name_field.setText(spool_name)
+
+
+def edit_gcode_file(job: task, gcode_path: str, json_data: list, undo: bool) -> None:
+    """
+    Background job editing a gcode file, see postprocessor.main
+    :param job: the running task
+    :param gcode_path: the path to the gcode file
+    :param json_data: the placeholder values in order of the extruders
+    :param undo: record the edit in the undo journal of the file
+    """
+    postprocessor.main(gcode_path, json_data=json_data, progress=job.report_progress, cancelled=job.is_cancelled,
+                       undo=undo)
+
+
+def suggest_spools(job: task, gcode_path: str, url: str, api_key: str,
+                   catalog: SpoolCatalog | None) -> tuple[SpoolCatalog | None, list[Match] | None, str | None]:
+    """
+    Background job proposing a spool for each extruder of a gcode file, see SpoolCatalog.assign
+    :param job: the running task
+    :param gcode_path: the path to the gcode file
+    :param url: the base octoprint url
+    :param api_key: the octoprint api key
+    :param catalog: the indexed catalog, loaded from octoprint if None
+    :return: the catalog, the proposed spool of each extruder and None, or the catalog, None and an error message
+    """
+    if catalog is None:
+        response, error = get_spool_manager_response(url, api_key)
+        if response is None:
+            return None, None, error
+        catalog = SpoolCatalog(catalog_records(response))
+    if job.is_cancelled():
+        return catalog, None, None
+    filaments = gcode_filaments(postprocessor.get_filament_metadata(postprocessor.parse_gcode(gcode_path)))
+    if not filaments:
+        return catalog, None, "The gcode has no filament settings to match the spools against"
+    return catalog, catalog.assign(filaments), None
+
 
 def set_global_stretch_factor(layout: QVBoxLayout, stretch_factor: int) -> None:
     """
@@ -423,27 +892,39 @@ def set_global_stretch_factor(layout: QVBoxLayout, stretch_factor: int) -> None:
             layout.setStretchFactor(widget, stretch_factor)
 
 
-def main() -> None:
+def main(listener: export_listener | None = None) -> None:
     """
     Main function
+    :param listener: collects the files of later instances in post-processor mode
     :return:
     """
     # show interface to edit the json data and add/remove extruders
     settings = load_settings()
+    octoprint_client.set_latency_budget(settings.get("octoprint_latency_budget"))
+    # hosts with little memory can lower how much of the end of a gcode file is read
+    postprocessor.set_tail_budget(settings.get("tail_max_bytes"), settings.get("tail_max_line_bytes"))
+    try:
+        postprocessor.set_durability(settings.get("durability"))
+    except ValueError as e:
+        print(e)
     # the app
     window = main_app(settings)
+    if listener is not None:
+        window.attach_export_listener(listener)
     window.show()
     app.exec()
     save_settings(window.settings)
+    SETTINGS_STORE.flush()
 
 
-def load_json_data() -> dict[str, None]:
+def load_json_data(settings: dict[str, None] | None = None) -> dict[str, None]:
     """
-    Load the data from the json file
-    :param path: the path to the json file
-    :return: the data or an empty dictionary if the file does not exist
+    Load the spool data from the settings
+    :param settings: the loaded settings, read from the settings store if not given
+    :return: the data or an empty dictionary if there is no saved spool data
     """
-    settings = load_settings()
+    if settings is None:
+        settings = load_settings()
     try:
         return settings["spool_data"]
     except KeyError:
@@ -452,110 +933,18 @@ def load_json_data() -> dict[str, None]:
 
 def save_settings(json_data: dict[str, None]) -> None:
     """
-    Save the settings to the json file
+    Save the settings to the json file, the write is debounced and done atomically by the settings store
     :param json_data: the json data
     """
-
-    with open(SETTINGS_PATH, 'w') as file:
-        json_data["settings version"] = 1
-
-        json.dump(json_data, file)
+    SETTINGS_STORE.save(json_data)
 
 
 def load_settings() -> dict[str, None]:
     """
-    Load the settings from the json file
+    Load the settings from the json file, the file is only parsed the first time this is called
     :return: the json data or an empty dictionary if the file does not exist
     """
-    for path in (SETTINGS_PATH, LEGACY_SETTINGS_PATH):
-        if os.path.isdir(path) or not os.path.exists(path):
-            continue
-        try:
-            with open(path, 'r') as file:
-                return json.load(file)
-        except (json.JSONDecodeError, FileNotFoundError):
-            continue
-    return {}
-
-
-def check_octoprint_settings(url: str, api_key: str = None) -> bool | str:
-    """
-    Check the octoprint settings
-    :param url: the base octoprint url
-    :return: True if the settings are correct, the error message otherwise
-    """
-    spools, error = get_loaded_spools(url, api_key)
-    if spools is None:
-        return error
-
-    return True
-
-
-def get_spool_manager_response(url: str, api_key: str = None) -> tuple[dict | None, str | None]:
-    if url is None or url.strip() == "":
-        return None, "No OctoPrint URL saved"
-
-    request_url = urljoin(url.rstrip("/") + "/", "plugin/SpoolManager/loadSpoolsByQuery")
-    headers = {}
-    if api_key is not None and api_key.strip() != "":
-        headers["X-Api-Key"] = api_key.strip()
-    params = {
-        "selectedPageSize": 100000,
-        "from": 0,
-        "to": 100000,
-        "sortColumn": "displayName",
-        "sortOrder": "desc",
-        "filterName": "",
-        "materialFilter": "all",
-        "vendorFilter": "all",
-        "colorFilter": "all",
-    }
-
-    try:
-        response = requests.get(url=request_url, params=params, headers=headers, timeout=10)
-    except requests.exceptions.RequestException as e:
-        return None, f"Could not connect to OctoPrint: {e}"
-
-    if response.status_code in (401, 403):
-        return None, f"Could not load the spools from OctoPrint: HTTP {response.status_code}. Check the OctoPrint API key."
-
-    if response.status_code != 200:
-        return None, f"Could not load the spools from OctoPrint: HTTP {response.status_code}"
-
-    try:
-        return response.json(), None
-    except ValueError:
-        return None, "Could not load the spools from OctoPrint: response was not valid JSON"
-
-
-def get_loaded_spools(url: str, api_key: str = None) -> tuple[list[str] | None, str | None]:
-    """
-    Get the loaded spools from octoprint
-    :param url: the base octoprint url
-    :return: a list of the loaded spools names and None, or None and an error message if there was an error
-    """
-    json_data, error = get_spool_manager_response(url, api_key)
-    if json_data is None:
-        return None, error
-
-    selected_spools = json_data.get("selectedSpools")
-    if not isinstance(selected_spools, list):
-        response_keys = ", ".join(json_data.keys())
-        return None, f"Could not load the spools from OctoPrint: missing selectedSpools in response ({response_keys})"
-
-    # create a list where each element is the name of a spool, the spools are in order of the extruders in the json
-    # response
-    spool_data = []
-
-    for spool in selected_spools:
-        try:
-            spool_data += [spool["displayName"]]
-        except KeyError:
-            spool_data += [""]
-        except TypeError:
-            spool_data += [""]
-    # the app
-    return spool_data, None
+    return SETTINGS_STORE.load()
 
 
 def get_num_extruders_from_gcode(gcode_path) -> int:
@@ -564,47 +953,7 @@ def get_num_extruders_from_gcode(gcode_path) -> int:
     :param gcode_path: the path to the gcode file
     :return: the number of extruders
     """
-    count = 0
-    gcode = postprocessor.parse_gcode(gcode_path)
-    filament_notes_pattern = re.compile(r'; filament_notes = (.+)')
-    filament_notes_match = filament_notes_pattern.search(gcode)
-    filament_notes = None
-    if filament_notes_match:
-        filament_notes = filament_notes_match.group(1).strip().split(';')
-    if filament_notes is None:
-        return 0
-
-    # loop through the json data
-    for i in range(len(filament_notes)):
-        if re.search(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]", filament_notes[i]):
-            count += 1
-    return count
-
-
-def get_spools_from_gcode(gcode_path) -> dict[int, str]:
-    """
-    Get the number of extruders from the gcode file
-    :param gcode_path: the path to the gcode file
-    :return: the number of extruders
-    """
-    spools = {}
-    gcode = postprocessor.parse_gcode(gcode_path)
-    filament_notes_pattern = re.compile(r'; filament_notes = (.+)')
-    filament_notes_match = filament_notes_pattern.search(gcode)
-    filament_notes = None
-    if filament_notes_match:
-        filament_notes = filament_notes_match.group(1).strip().split(';')
-    if filament_notes is None:
-        return {}
-    if filament_notes == ['""'] or filament_notes == ['']:
-        return {}
-    # loop through the json data
-    for i in range(len(filament_notes)):
-        if re.search(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]", filament_notes[i]):
-            spools[i + 1] = (re.search(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]", filament_notes[i]).group(1))
-        else:
-            spools[i + 1] = ""
-    return spools
+    return postprocessor.count_tagged_extruders(postprocessor.parse_gcode(gcode_path))
 
 
 if __name__ == "__main__":
@@ -639,4 +988,18 @@ if __name__ == "__main__":
     app.setWindowIcon(QIcon(os.path.dirname(__file__) + "/icon.png"))
     QApplication.setApplicationName("Nozzle Filament Validator Post-Processor")
     QApplication.setApplicationDisplayName("Nozzle Filament Validator Post-Processor")
-    main()
+    export_files = None
+    if MODE == modes.POST_PROCESSOR:
+        # when the slicer exports several files at once the first instance shows them all in one window, the others
+        # wait for their file to be edited
+        exit_code = forward_file(sys.argv[1])
+        if exit_code is not None:
+            sys.exit(exit_code)
+        export_files = export_listener()
+        if not export_files.listen():
+            # another instance started listening at the same time
+            exit_code = forward_file(sys.argv[1])
+            if exit_code is not None:
+                sys.exit(exit_code)
+            export_files = None
+    main(export_files)
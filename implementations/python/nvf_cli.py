@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+
+import gcode_inspect
+import octoprint_client
+import postprocessor
+import undo_journal
+from fleet_matcher import FleetIndex, Printer, load_fleet
+from placeholders import spool_fields
+from remote_tail import RemoteTailReader
+from spool_matcher import SpoolCatalog, catalog_records, gcode_filaments
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Command line tools for gcode files that work without the window
+    :param argv: the command line arguments, defaults to sys.argv
+    :return: the exit code
+    """
+    parser = argparse.ArgumentParser(description="Command line tools for NVF post-processed gcode files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    inspect_parser = commands.add_parser(
+        "inspect", help="Print the filament metadata of gcode files as one json record per line, without editing them.")
+    inspect_parser.add_argument("paths", nargs="+", help="Gcode files or directories to search for gcode files.")
+    inspect_parser.add_argument("--catalog", help="SpoolManager catalog snapshot (json) to check the spool names "
+                                                  "against.")
+    inspect_parser.add_argument("--workers", type=int, help="Number of worker processes, defaults to the cpu count.")
+
+    remote_parser = commands.add_parser(
+        "remote-inspect", help="Print the filament metadata of gcode files stored on OctoPrint, only downloading the "
+                               "end of each file.")
+    remote_parser.add_argument("paths", nargs="*", help="Paths of the files on OctoPrint, defaults to every file.")
+    remote_parser.add_argument("--url", required=True, help="The OctoPrint url.")
+    remote_parser.add_argument("--api-key", help="The OctoPrint API key.")
+    remote_parser.add_argument("--connections", type=int, default=16, help="Number of files read at once.")
+
+    edit_parser = commands.add_parser(
+        "edit", help="Fill the spool placeholders of gcode files from a spool data json file, printing what each "
+                     "rewrite cost as one json record per line.")
+    edit_parser.add_argument("json_path", help="The spool data json file, extruder number -> placeholder values.")
+    edit_parser.add_argument("paths", nargs="+", help="Gcode files to edit.")
+    edit_parser.add_argument("--durability", choices=postprocessor.durability.ALL, default=postprocessor.DURABILITY,
+                             help="fast skips fsync, safe fsyncs the file and its folder, verified also reads the "
+                                  "written tail back and checks its hash.")
+    edit_parser.add_argument("--undo", action="store_true", help="Record the edits so they can be undone.")
+
+    undo_parser = commands.add_parser("undo", help="Undo the last edit of gcode files.")
+    undo_parser.add_argument("paths", nargs="+", help="Gcode files to undo the last edit of.")
+    undo_parser.add_argument("--keep-header", action="store_true",
+                             help="Leave the 'Edited with NVF Postprocessor' line in the file.")
+
+    assign_parser = commands.add_parser(
+        "assign", help="Propose a SpoolManager spool for each extruder of gcode files from the material, color and "
+                       "vendor they were sliced with, printed as one json record per line.")
+    assign_parser.add_argument("paths", nargs="+", help="Gcode files to propose spools for.")
+    catalog_source = assign_parser.add_mutually_exclusive_group(required=True)
+    catalog_source.add_argument("--catalog", help="SpoolManager catalog snapshot (json) to pick the spools from.")
+    catalog_source.add_argument("--url", help="The OctoPrint url to load the SpoolManager catalog from.")
+    assign_parser.add_argument("--api-key", help="The OctoPrint API key.")
+    assign_parser.add_argument("--apply", action="store_true",
+                               help="Write the proposed spools into the gcode files, the edits can be undone. Files "
+                                    "with a proposal to review are left alone.")
+    assign_parser.add_argument("--force", action="store_true",
+                               help="With --apply, also write the proposals to review.")
+
+    fleet_parser = commands.add_parser(
+        "fleet-match", help="Rank the printers whose loaded spools fit each gcode file, printed as one json record per "
+                            "line. The printers are polled in the background and the files are matched against the "
+                            "last poll.")
+    fleet_parser.add_argument("paths", nargs="+", help="Gcode files or directories to search for gcode files.")
+    fleet_parser.add_argument("--fleet", required=True,
+                              help="json file listing the printers as {\"name\", \"url\", \"api_key\"} objects.")
+    fleet_parser.add_argument("--tag", action="store_true",
+                              help="Write the spools of the best printer into each file, the edits can be undone.")
+    fleet_parser.add_argument("--printer", help="Tag the files for this printer instead of the best one, if it fits.")
+
+    args = parser.parse_args(argv)
+    if args.command == "inspect":
+        return inspect_command(args)
+    if args.command == "remote-inspect":
+        return remote_inspect_command(args)
+    if args.command == "edit":
+        return edit_command(args)
+    if args.command == "undo":
+        return undo_command(args)
+    if args.command == "assign":
+        return assign_command(args)
+    if args.command == "fleet-match":
+        return fleet_match_command(args)
+    return 1
+
+
+def inspect_command(args: argparse.Namespace) -> int:
+    catalog = gcode_inspect.load_catalog(args.catalog) if args.catalog else None
+    errors = gcode_inspect.inspect_files(args.paths, sys.stdout, catalog, args.workers)
+    return 1 if errors else 0
+
+
+def remote_inspect_command(args: argparse.Namespace) -> int:
+    errors = 0
+    with RemoteTailReader(args.url, args.api_key, max_connections=args.connections) as reader:
+        for record in reader.inspect_files(args.paths or None):
+            errors += "error" in record
+            print(json.dumps(record), flush=True)
+    return 1 if errors else 0
+
+
+def edit_command(args: argparse.Namespace) -> int:
+    try:
+        json_data = postprocessor.parse_json_file(args.json_path)
+    except (OSError, ValueError) as e:
+        print(f"Could not read {args.json_path}: {e}", file=sys.stderr)
+        return 1
+    exit_code = 0
+    for gcode_path in args.paths:
+        try:
+            report = postprocessor.main(gcode_path, json_data=json_data, undo=args.undo,
+                                        durability_mode=args.durability)
+        except (OSError, ValueError, undo_journal.UndoError) as e:
+            print(json.dumps({"path": gcode_path, "error": str(e)}), flush=True)
+            exit_code = 1
+            continue
+        print(json.dumps({"path": gcode_path, **report._asdict()}), flush=True)
+    return exit_code
+
+
+def undo_command(args: argparse.Namespace) -> int:
+    exit_code = 0
+    for gcode_path in args.paths:
+        try:
+            undo_journal.undo(gcode_path, args.keep_header)
+        except (undo_journal.UndoError, OSError) as e:
+            print(f"Could not undo {gcode_path}: {e}", file=sys.stderr)
+            exit_code = 1
+    return exit_code
+
+
+def assign_command(args: argparse.Namespace) -> int:
+    if args.catalog:
+        with open(args.catalog, 'r') as file:
+            data = json.load(file)
+    else:
+        data, error = octoprint_client.get_spool_manager_response(args.url, args.api_key)
+        if data is None:
+            print(error, file=sys.stderr)
+            return 1
+    catalog = SpoolCatalog(catalog_records(data))
+
+    exit_code = 0
+    for gcode_path in args.paths:
+        applied = False
+        try:
+            metadata = postprocessor.get_filament_metadata(postprocessor.parse_gcode(gcode_path))
+            matches = catalog.assign(gcode_filaments(metadata))
+            review = [i + 1 for i, match in enumerate(matches) if match.review]
+            if args.apply and review and not args.force:
+                print(f"Not applied to {gcode_path}: check the spools of extruders "
+                      f"{', '.join(map(str, review))} and add --force to write them", file=sys.stderr)
+                exit_code = 1
+            elif args.apply:
+                # extruders without a proposal keep the spool they are tagged with
+                postprocessor.main(gcode_path, json_data=[spool_fields(match.spool) if match.spool else None
+                                                          for match in matches], undo=True)
+                applied = True
+        except (OSError, ValueError) as e:
+            print(json.dumps({"path": gcode_path, "error": str(e)}), flush=True)
+            exit_code = 1
+            continue
+        record = {"path": gcode_path, "applied": applied, "spools": [
+            {"extruder": i + 1, "sm_name": match.spool["displayName"] if match.spool else None,
+             "sm_id": match.spool.get("databaseId") if match.spool else None, "cost": round(match.cost, 2),
+             "review": match.review}
+            for i, match in enumerate(matches)]}
+        print(json.dumps(record), flush=True)
+    return exit_code
+
+
+def fleet_match_command(args: argparse.Namespace) -> int:
+    with open(args.fleet, 'r') as file:
+        printers = load_fleet(json.load(file))
+
+    def report_error(printer: Printer, error: str) -> None:
+        print(f"Could not poll {printer.name}: {error}", file=sys.stderr, flush=True)
+
+    exit_code = 0
+    # the fleet is polled again in the background while the files are matched, so a long run sees spool changes
+    with FleetIndex(printers, octoprint_client.get_loaded_spool_records, on_error=report_error) as index:
+        index.wait_ready()
+        for gcode_path in gcode_inspect.iter_gcode_paths(args.paths):
+            try:
+                metadata = postprocessor.get_filament_metadata(postprocessor.parse_gcode(gcode_path))
+                matches = index.match(gcode_filaments(metadata), metadata["sm_name"])
+                chosen = next((match.printer for match in matches
+                               if args.printer is None or match.printer.name == args.printer), None)
+                if args.tag and chosen is not None:
+                    postprocessor.main(gcode_path, json_data=[spool_fields(spool) for spool in index.spools(chosen)],
+                                       undo=True)
+            except (OSError, ValueError) as e:
+                print(json.dumps({"path": gcode_path, "error": str(e)}), flush=True)
+                exit_code = 1
+                continue
+            record = {"path": gcode_path, "tagged": chosen.name if args.tag and chosen else None, "printers": [
+                {"name": match.printer.name, "cost": round(match.cost, 2), "name_matches": match.name_matches,
+                 "stale": match.stale} for match in matches]}
+            print(json.dumps(record), flush=True)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
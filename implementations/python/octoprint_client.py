@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from typing import Union
+from urllib.parse import urljoin
+
+import requests
+
+from circuit_breaker import BudgetExceeded, CircuitBreaker, CircuitOpen, run_with_budget
+from settings_store import write_json_atomic
+
+# the last spool selection loaded from each octoprint url, shown when octoprint can't be reached. It is kept next to
+# the settings file, like the window does
+SELECTION_CACHE_PATH = os.path.join(
+    os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(__file__),
+    "nfvselection.json")
+SELECTION_CACHE_LOCK = threading.Lock()
+
+# the most seconds a request to octoprint may take, set with the octoprint_latency_budget setting
+LATENCY_BUDGET = 5.0
+# octoprint hosts that failed recently are not waited on again until they had time to come back
+OCTOPRINT_BREAKER = CircuitBreaker()
+# set when the program is closing, the requests still waiting for octoprint give up right away
+REQUESTS_ABORTED = threading.Event()
+
+
+def set_latency_budget(seconds: Union[float, None]) -> None:
+    """
+    Set the most seconds a request to octoprint may take, None keeps the current value
+    :param seconds: the latency budget
+    """
+    global LATENCY_BUDGET
+    if seconds is not None:
+        LATENCY_BUDGET = float(seconds)
+
+
+def abort_requests() -> None:
+    """
+    Stop waiting for octoprint, the requests in flight and any made afterwards fail right away with BudgetExceeded. Used
+    when the window closes so it doesn't wait for a host that doesn't answer
+    """
+    REQUESTS_ABORTED.set()
+
+
+def octoprint_request(method: str, request_url: str, **kwargs) -> requests.Response:
+    """
+    Make a request to octoprint through the circuit breaker, waiting at most LATENCY_BUDGET seconds for it
+    :param method: the http method
+    :param request_url: the full url of the request
+    :param kwargs: the arguments of requests.request
+    :return: the response, whatever its status
+    :raises CircuitOpen: if the host failed recently
+    :raises BudgetExceeded: if the host didn't answer in time or the requests were aborted
+    :raises requests.exceptions.RequestException: if the request failed
+    """
+    OCTOPRINT_BREAKER.check(request_url)
+    try:
+        response = run_with_budget(requests.request, LATENCY_BUDGET, method, request_url, timeout=LATENCY_BUDGET,
+                                   abort=REQUESTS_ABORTED, **kwargs)
+    except (requests.exceptions.RequestException, BudgetExceeded):
+        if not REQUESTS_ABORTED.is_set():
+            OCTOPRINT_BREAKER.record_failure(request_url)
+        raise
+    OCTOPRINT_BREAKER.record_success(request_url)
+    return response
+
+
+def octoprint_login(url: str, api_key: Union[str, None]) -> tuple[str, str]:
+    """
+    Log in to octoprint with the api key to get the credentials the push socket is authenticated with
+    :param url: the base octoprint url
+    :param api_key: the octoprint api key
+    :return: the user name and session
+    """
+    headers = {}
+    if api_key is not None and api_key.strip() != "":
+        headers["X-Api-Key"] = api_key.strip()
+    response = octoprint_request("POST", urljoin(url.rstrip("/") + "/", "api/login"), json={"passive": True},
+                                 headers=headers)
+    response.raise_for_status()
+    data = response.json()
+    return data["name"], data["session"]
+
+
+def check_octoprint_settings(url: str, api_key: str = None) -> bool | str:
+    """
+    Check the octoprint settings
+    :param url: the base octoprint url
+    :return: True if the settings are correct, the error message otherwise
+    """
+    spools, error = get_loaded_spools(url, api_key)
+    if spools is None:
+        return error
+
+    return True
+
+
+def get_spool_manager_response(url: str, api_key: str = None) -> tuple[dict | None, str | None]:
+    if url is None or url.strip() == "":
+        return None, "No OctoPrint URL saved"
+
+    request_url = urljoin(url.rstrip("/") + "/", "plugin/SpoolManager/loadSpoolsByQuery")
+    headers = {}
+    if api_key is not None and api_key.strip() != "":
+        headers["X-Api-Key"] = api_key.strip()
+    params = {
+        "selectedPageSize": 100000,
+        "from": 0,
+        "to": 100000,
+        "sortColumn": "displayName",
+        "sortOrder": "desc",
+        "filterName": "",
+        "materialFilter": "all",
+        "vendorFilter": "all",
+        "colorFilter": "all",
+    }
+
+    try:
+        response = octoprint_request("GET", request_url, params=params, headers=headers)
+    except (CircuitOpen, requests.exceptions.RequestException, BudgetExceeded) as e:
+        return None, f"Could not connect to OctoPrint: {e}"
+
+    if response.status_code in (401, 403):
+        return None, f"Could not load the spools from OctoPrint: HTTP {response.status_code}. Check the OctoPrint API key."
+
+    if response.status_code != 200:
+        return None, f"Could not load the spools from OctoPrint: HTTP {response.status_code}"
+
+    try:
+        return response.json(), None
+    except ValueError:
+        return None, "Could not load the spools from OctoPrint: response was not valid JSON"
+
+
+def get_loaded_spool_records(url: str, api_key: str = None,
+                             allow_stale: bool = False) -> tuple[list[dict | None] | None, str | None]:
+    """
+    Get the spool records of the loaded spools from octoprint, the selection is remembered so it can still be shown
+    when octoprint can't be reached
+    :param url: the base octoprint url
+    :param allow_stale: fall back to the last selection loaded from the url if octoprint can't be reached
+    :return: a list of the loaded spool records in order of the extruders and None, or None and an error message if
+    there was an error. A stale selection is returned with a message saying when it was loaded
+    """
+    json_data, error = get_spool_manager_response(url, api_key)
+    if json_data is None:
+        cached = load_last_selection(url) if allow_stale else None
+        if cached is None:
+            return None, error
+        loaded_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(cached["timestamp"]))
+        return cached["selectedSpools"], f"OFFLINE: showing the spools selected at {loaded_at}. {error}"
+
+    selected_spools = json_data.get("selectedSpools")
+    if not isinstance(selected_spools, list):
+        response_keys = ", ".join(json_data.keys())
+        return None, f"Could not load the spools from OctoPrint: missing selectedSpools in response ({response_keys})"
+    save_last_selection(url, selected_spools)
+    return selected_spools, None
+
+
+def load_last_selection(url: str) -> dict | None:
+    """
+    Get the last spool selection loaded from an octoprint url
+    :param url: the base octoprint url
+    :return: the selection and the time it was first loaded, or None if none was loaded yet
+    """
+    with SELECTION_CACHE_LOCK:
+        return _read_selection_cache().get(url.rstrip("/"))
+
+
+def save_last_selection(url: str, selected_spools: list[dict | None]) -> None:
+    """
+    Remember the spool selection loaded from an octoprint url with the time it was first loaded, the file is only
+    written when the selection differs from the one it holds, not on every poll
+    :param url: the base octoprint url
+    :param selected_spools: the selected spool record of each extruder
+    """
+    with SELECTION_CACHE_LOCK:
+        cache = _read_selection_cache()
+        saved = cache.get(url.rstrip("/"))
+        if isinstance(saved, dict) and saved.get("selectedSpools") == selected_spools:
+            return
+        cache[url.rstrip("/")] = {"timestamp": time.time(), "selectedSpools": selected_spools}
+        try:
+            write_json_atomic(SELECTION_CACHE_PATH, cache)
+        except OSError as e:
+            print(f"Could not save the spool selection: {e}")
+
+
+def _read_selection_cache() -> dict:
+    try:
+        with open(SELECTION_CACHE_PATH, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def get_loaded_spools(url: str, api_key: str = None) -> tuple[list[str] | None, str | None]:
+    """
+    Get the loaded spools from octoprint
+    :param url: the base octoprint url
+    :return: a list of the loaded spools names and None, or None and an error message if there was an error
+    """
+    selected_spools, error = get_loaded_spool_records(url, api_key)
+    if selected_spools is None:
+        return None, error
+
+    # create a list where each element is the name of a spool, the spools are in order of the extruders in the json
+    # response
+    spool_data = []
+
+    for spool in selected_spools:
+        try:
+            spool_data += [spool["displayName"]]
+        except KeyError:
+            spool_data += [""]
+        except TypeError:
+            spool_data += [""]
+    # the app
+    return spool_data, None
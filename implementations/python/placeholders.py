@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Any, Container, Iterable, Iterator, Mapping, NamedTuple, Union
+
+# placeholder name -> SpoolManager spool record key
+SPOOL_FIELDS = {
+    "sm_name": "displayName",
+    "sm_material": "material",
+    "sm_color": "colorName",
+    "sm_vendor": "vendor",
+    "sm_remaining_g": "remainingWeight",
+    "sm_id": "databaseId",
+}
+
+
+# runs of a single character class, used as fast building blocks of the scanner, they can't backtrack
+_WHITESPACE_RUN = re.compile(r"\s*")
+_NAME_RUN = re.compile(r"[^\s=\[\]]*")
+# characters that are escaped with a backslash in a placeholder value
+_ESCAPED = frozenset("[]\\")
+
+
+class Placeholder(NamedTuple):
+    """
+    A placeholder found in filament notes: its name, its unescaped value (None if it has no '=') and its span
+    """
+    name: str
+    value: Union[str, None]
+    start: int
+    end: int
+
+
+def scan_placeholders(notes: str, fields: Container[str]) -> Iterator[Placeholder]:
+    """
+    Find the placeholders in filament notes, like [sm_name = Spool] or [sm_material].
+    Brackets and backslashes in a value are escaped with a backslash, [sm_name = Spool \\[2\\]] is named "Spool [2]".
+    The notes are scanned once from left to right without backtracking, so the time is linear in their length whatever
+    they hold
+    :param notes: the filament notes of an extruder
+    :param fields: the placeholder names to find
+    :return: the placeholders in order
+    """
+    length = len(notes)
+    pos = notes.find("[")
+    while pos != -1:
+        start = pos
+        if pos + 1 < length and notes[pos + 1] in "[]":
+            # an empty name, the common case of bracket-heavy notes
+            pos = notes.find("[", pos + 1)
+            continue
+        name_start = _WHITESPACE_RUN.match(notes, pos + 1).end()
+        name_end = _NAME_RUN.match(notes, name_start).end()
+        name = notes[name_start:name_end]
+        pos = _WHITESPACE_RUN.match(notes, name_end).end()
+        if name not in fields or pos >= length or notes[pos] not in "=]":
+            # not a placeholder, none can start before pos since a name and whitespace don't hold a '['
+            pos = notes.find("[", pos)
+            continue
+        if notes[pos] == "]":
+            yield Placeholder(name, None, start, pos + 1)
+            pos = notes.find("[", pos + 1)
+            continue
+        value_end = _find_closing_bracket(notes, pos + 1)
+        if value_end == -1:
+            # no later placeholder can be closed either, the closing bracket it needs would have closed this one
+            return
+        yield Placeholder(name, unescape_value(notes[pos + 1:value_end].strip()), start, value_end + 1)
+        pos = notes.find("[", value_end + 1)
+
+
+def _find_closing_bracket(notes: str, pos: int) -> int:
+    """
+    :return: the position of the first unescaped ']' from pos, or -1 if there is none
+    """
+    while True:
+        bracket = notes.find("]", pos)
+        if bracket == -1:
+            return -1
+        # the bracket is escaped if an odd number of backslashes come right before it, the text between pos and the
+        # bracket is only looked at once
+        before = notes[pos:bracket]
+        if (len(before) - len(before.rstrip("\\"))) % 2 == 0:
+            return bracket
+        pos = bracket + 1
+
+
+def unescape_value(value: str) -> str:
+    """
+    Remove the escapes from a placeholder value, a backslash that doesn't escape a bracket or backslash is kept
+    :param value: the value as written in the notes
+    :return: the value
+    """
+    if "\\" not in value:
+        return value
+    out = []
+    pos = 0
+    while pos < len(value):
+        if value[pos] == "\\" and pos + 1 < len(value) and value[pos + 1] in _ESCAPED:
+            pos += 1
+        out.append(value[pos])
+        pos += 1
+    return "".join(out)
+
+
+def escape_value(value: str) -> str:
+    """
+    Escape a placeholder value so it can be written in the notes, values without brackets are written as they are
+    :param value: the value
+    :return: the value as written in the notes
+    """
+    if not any(char in _ESCAPED for char in value):
+        return value
+    out = []
+    for pos, char in enumerate(value):
+        if char in "[]" or (char == "\\" and (pos + 1 == len(value) or value[pos + 1] in _ESCAPED)):
+            out.append("\\")
+        out.append(char)
+    return "".join(out)
+
+
+class SubstitutionPlan:
+    """
+    A set of placeholders, applied to the notes of an extruder in a single pass
+    """
+
+    def __init__(self, fields: tuple[str, ...]):
+        """
+        :param fields: the placeholder names handled by the plan
+        """
+        self.fields = fields
+        self._fields = frozenset(fields)
+
+    def apply(self, notes: str, values: Mapping[str, Any]) -> str:
+        """
+        Fill the placeholders found in the notes with the values of an extruder
+        :param notes: the filament notes of the extruder
+        :param values: placeholder name -> value, placeholders without a value are left as they are
+        :return: the notes with the placeholders filled in
+        """
+        parts = []
+        copied = 0
+        for placeholder in scan_placeholders(notes, self._fields):
+            value = values.get(placeholder.name)
+            if value is None:
+                continue
+            parts.append(notes[copied:placeholder.start])
+            parts.append(f"[{placeholder.name} = {escape_value(str(value))}]")
+            copied = placeholder.end
+        if not parts:
+            return notes
+        parts.append(notes[copied:])
+        return "".join(parts)
+
+    def find(self, notes: str) -> dict[str, str]:
+        """
+        Read the current values of the placeholders in the notes of an extruder
+        :param notes: the filament notes of the extruder
+        :return: placeholder name -> value, empty placeholders have an empty string as value
+        """
+        return {placeholder.name: placeholder.value or "" for placeholder in scan_placeholders(notes, self._fields)}
+
+
+def find_spool_name(notes: str) -> Union[str, None]:
+    """
+    Get the spool name tagged in the notes of an extruder
+    :param notes: the filament notes of the extruder
+    :return: the value of the first [sm_name = ...] tag, or None if the notes have no tag
+    """
+    for placeholder in scan_placeholders(notes, ("sm_name",)):
+        if placeholder.value is not None:
+            return placeholder.value
+    return None
+
+
+@lru_cache(maxsize=None)
+def _compile(fields: tuple[str, ...]) -> SubstitutionPlan:
+    return SubstitutionPlan(fields)
+
+
+def compile_plan(extra_fields: Iterable[str] = ()) -> SubstitutionPlan:
+    """
+    Compile the built-in placeholders and any user-defined ones into a substitution plan,
+    plans are cached so compiling the same set of placeholders again is free
+    :param extra_fields: names of user-defined placeholders
+    :return: the substitution plan
+    """
+    return _compile(tuple(sorted(set(SPOOL_FIELDS) | set(extra_fields))))
+
+
+def spool_fields(spool: Union[Mapping[str, Any], None],
+                 custom_fields: Union[Mapping[str, str], None] = None) -> dict[str, str]:
+    """
+    Get the placeholder values for a SpoolManager spool record
+    :param spool: the spool record from SpoolManager
+    :param custom_fields: user-defined placeholder name -> spool record key, from the template_fields setting
+    :return: placeholder name -> value for every field the record has
+    """
+    if not isinstance(spool, Mapping):
+        return {"sm_name": ""}
+    fields = dict(SPOOL_FIELDS)
+    fields.update(custom_fields or {})
+    values = {}
+    for placeholder, key in fields.items():
+        value = spool.get(key)
+        if value is None:
+            continue
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        values[placeholder] = str(value)
+    values.setdefault("sm_name", "")
+    return values
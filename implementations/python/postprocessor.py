@@ -1,20 +1,109 @@
 #!/usr/bin/python3
 from __future__ import annotations
 
+import hashlib
 import json
 import os
 import re
 import sys
 import tempfile
-from typing import Any, Union
+import time
+from typing import Any, Callable, NamedTuple, Union
 
+import undo_journal
+from file_lock import clean_stale_locks, locked
+from job_queue import PathJobQueue
+from placeholders import SubstitutionPlan, compile_plan, find_spool_name
+from settings_store import fsync_directory
 
-def main(gcode_path: str, json_path: Union[str, None] = None, json_data: Union[list[str], None] = None) -> None:
+# how often the progress of a file rewrite is reported
+PROGRESS_INTERVAL = 1024 * 1024
+
+EDITED_HEADER = b'; Edited with NVF Postprocessor\n'
+
+# the memory budget for reading the end of a gcode file, see scan_tail
+TAIL_MAX_BYTES = 4 * 1024 * 1024
+TAIL_MAX_LINE_BYTES = 256 * 1024
+# stands in for a line that was too long to keep in memory, the NUL bytes can't appear in a gcode text line
+SKIPPED_LINE_MARKER = b'\x00nvf skipped line\x00\n'
+# the settings read from the config block, their lines are kept whole however long they are
+READ_CONFIG_LINES = tuple(f"; {key} = ".encode() for key in (
+    "filament_notes", "filament_type", "filament_colour", "filament_vendor", "filament used [mm]", "filament used [g]"))
+_READ_CONFIG_PEEK = max(len(prefix) for prefix in READ_CONFIG_LINES)
+
+
+class durability:
+    """
+    How hard a rewrite of a gcode file tries to survive a crash or power loss
+    """
+    # no fsync, for scratch disks, a crash can leave an empty or partial file
+    FAST = "fast"
+    # fsync the new file before the rename and the directory after it
+    SAFE = "safe"
+    # safe, and read the written tail back and compare its hash before the rename
+    VERIFIED = "verified"
+    ALL = (FAST, SAFE, VERIFIED)
+
+
+DURABILITY = durability.SAFE
+
+
+class WriteReport(NamedTuple):
+    """
+    What a rewrite of a gcode file wrote and how long each step took, in seconds
+    """
+    durability: str
+    bytes_written: int
+    copy_time: float
+    tail_time: float
+    fsync_time: float
+    verify_time: float
+    total_time: float
+
+
+class GcodeTail(NamedTuple):
+    """
+    The end of a gcode file: the tail bytes, where they start in the file and the (start, end) span in the file of
+    each line that was skipped, in the order of their markers in the tail
+    """
+    data: bytearray
+    start: int
+    skipped: tuple[tuple[int, int], ...]
+
+
+class TailBudgetExceeded(ValueError):
+    """
+    Raised when a setting the post-processor reads doesn't fit in the memory budget for the end of the gcode
+    """
+
+
+class EditCancelled(Exception):
+    """
+    Raised when an edit is cancelled before the new file replaced the old one, the file is left untouched
+    """
+
+
+class VerificationError(OSError):
+    """
+    Raised when the tail read back from a rewritten file doesn't match what was written, the file is left untouched
+    """
+
+
+def main(gcode_path: str, json_path: Union[str, None] = None, json_data: Union[list[Any], None] = None,
+         plan: Union[SubstitutionPlan, None] = None, progress: Union[Callable[[int, int], None], None] = None,
+         cancelled: Union[Callable[[], bool], None] = None, undo: bool = False,
+         durability_mode: Union[str, None] = None) -> WriteReport:
     """
     Main function,
     :param gcode_path: path to the gcode file
     :param json_path: path to the json file
     :param json_data: json data dictionary
+    :param plan: the compiled placeholders to fill, defaults to the built-in ones and any others found in json_data
+    :param progress: called with the bytes written so far and the total while the file is rewritten
+    :param cancelled: polled while the file is rewritten, the edit stops with EditCancelled once it returns True
+    :param undo: record the original tail in the undo journal of the file so the edit can be undone
+    :param durability_mode: one of durability.ALL, defaults to DURABILITY
+    :return: what the rewrite wrote and how long it took
     """
     if json_data is None:
         if json_path is None:
@@ -22,10 +111,30 @@ def main(gcode_path: str, json_path: Union[str, None] = None, json_data: Union[l
             sys.exit(1)
         json_data = parse_json_file(json_path)
 
-    gcode = parse_gcode(gcode_path)
-    new_file = replace_names(gcode, json_data)
+    # hold the lock from reading the tail until the new file is in place, so a concurrent run on the same path can't
+    # read a stale tail offset or race on the rename
+    with locked(gcode_path):
+        gcode = parse_gcode(gcode_path)
+        new_file = replace_names(gcode, json_data, plan)
+
+        return replace_gcode_tail(gcode_path, new_file, progress, cancelled, undo, durability_mode)
 
-    replace_gcode_tail(gcode_path, new_file)
+
+def process_files(gcode_paths: list[str], json_data: list[Any], max_workers: Union[int, None] = None) -> dict[
+    str, Union[Exception, None]]:
+    """
+    Edit several gcode files at once, different files are edited in parallel and repeated paths one after another
+    :param gcode_paths: the paths to the gcode files
+    :param json_data: the placeholder values in order of the extruders
+    :param max_workers: the maximum number of files edited at once
+    :return: a dictionary of each path to the exception it failed with, or None if it was edited successfully
+    """
+    for directory in {os.path.dirname(os.path.abspath(path)) for path in gcode_paths}:
+        clean_stale_locks(directory)
+    plan = compile_plan(placeholder_names(json_data))
+    with PathJobQueue(max_workers) as queue:
+        futures = [(path, queue.submit(path, main, path, json_data=json_data, plan=plan)) for path in gcode_paths]
+    return {path: future.exception() for path, future in futures}
 
 
 def parse_json_file(json_path: str) -> list[str | None]:
@@ -43,16 +152,16 @@ def parse_json_file(json_path: str) -> list[str | None]:
         # get each db id and the corresponding extruder position and put then in order in a list
 
 
-def parse_json_data(json_data: dict[str, Any]) -> list[str | None]:
+def parse_json_data(json_data: dict[str, Any]) -> list[dict[str, str] | None]:
     """
-    Parse the json data and return the names in order of the extruders
+    Parse the json data and return the placeholder values in order of the extruders
     :param json_data: the json data dictionary
-    :return: a list of db ids in order
+    :return: a list of placeholder name -> value dictionaries in order
     """
-    # get each db id and the corresponding extruder position and put then in order in a list
+    # get each entry and the corresponding extruder position and put then in order in a list
     out_list = [None] * len(json_data)
     for key, value in json_data.items():
-        out_list[int(key) - 1] = value['sm_name']
+        out_list[int(key) - 1] = {field: field_value for field, field_value in value.items() if field_value is not None}
     return out_list
 
 
@@ -60,81 +169,313 @@ def parse_gcode(gcode_path: str) -> str:
     """
     Parse the gcode file and return the last 1000 lines
     :param gcode_path: path to the gcode file
-    :return: the last 1000 lines of the gcode file
+    :return: the last 1000 lines of the gcode file, lines over the line budget are replaced by SKIPPED_LINE_MARKER
+    """
+    tail = read_gcode_tail(gcode_path, 1000)
+    return tail.data.decode('utf-8', errors='replace')
+
+
+def set_tail_budget(max_bytes: Union[int, None] = None, max_line_bytes: Union[int, None] = None) -> None:
+    """
+    Set how much of the end of a gcode file is kept in memory when it is read, None keeps the current value
+    :param max_bytes: the most tail bytes kept, the tail is cut short at a line boundary once it would grow past this
+    :param max_line_bytes: lines longer than this are skipped without being kept in memory
+    """
+    global TAIL_MAX_BYTES, TAIL_MAX_LINE_BYTES
+    if max_bytes is not None:
+        TAIL_MAX_BYTES = int(max_bytes)
+    if max_line_bytes is not None:
+        TAIL_MAX_LINE_BYTES = int(max_line_bytes)
+
+
+def set_durability(mode: Union[str, None]) -> None:
     """
-    tail, _ = read_gcode_tail(gcode_path, 1000)
-    return tail.decode('utf-8', errors='replace')
+    Set the durability of gcode rewrites that don't ask for one, None keeps the current mode
+    :param mode: one of durability.ALL
+    """
+    global DURABILITY
+    if mode is None:
+        return
+    if mode not in durability.ALL:
+        raise ValueError(f"Unknown durability mode {mode!r}, expected one of {', '.join(durability.ALL)}")
+    DURABILITY = mode
 
 
-def read_gcode_tail(gcode_path: str, num_lines: int) -> tuple[bytes, int]:
+def read_gcode_tail(gcode_path: str, num_lines: int, max_bytes: Union[int, None] = None,
+                    max_line_bytes: Union[int, None] = None) -> GcodeTail:
     """
     Read the last num_lines lines from a G-code file without loading the full file.
     :param gcode_path: path to the G-code file
     :param num_lines: number of trailing lines to read
-    :return: the tail bytes and the byte offset where the tail starts
+    :param max_bytes: the most tail bytes kept in memory, defaults to TAIL_MAX_BYTES
+    :param max_line_bytes: lines longer than this are skipped, defaults to TAIL_MAX_LINE_BYTES
+    :return: the tail, the byte offset where it starts and the spans of the skipped lines
     """
-    chunk_size = 8192
-
     with open(gcode_path, 'rb') as file:
         file.seek(0, os.SEEK_END)
-        pos = file.tell()
-        chunks = []
-        newline_count = 0
+        return scan_tail(lambda pos, size: read_at(file, pos, size), file.tell(), num_lines, max_bytes,
+                         max_line_bytes)
 
-        while pos > 0 and newline_count <= num_lines:
-            read_size = min(chunk_size, pos)
-            pos -= read_size
-            file.seek(pos)
-            chunk = file.read(read_size)
-            chunks.append(chunk)
-            newline_count += chunk.count(b'\n')
 
-    tail = b''.join(reversed(chunks))
-    lines = tail.splitlines(keepends=True)
-    tail_lines = lines[-num_lines:]
-    tail_bytes = b''.join(tail_lines)
-    tail_start = pos + len(tail) - len(tail_bytes)
-    return tail_bytes, tail_start
+def read_at(file, pos: int, size: int) -> bytes:
+    """
+    Read size bytes at pos from a seekable binary file
+    """
+    file.seek(pos)
+    return file.read(size)
 
 
-def replace_gcode_tail(gcode_path: str, new_tail: str) -> None:
+def scan_tail(read: Callable[[int, int], bytes], length: int, num_lines: int, max_bytes: Union[int, None] = None,
+              max_line_bytes: Union[int, None] = None) -> GcodeTail:
+    """
+    Find the last num_lines lines of some data, reading backwards from the end in chunks.
+    At most max_bytes of lines are kept and lines longer than max_line_bytes are replaced by SKIPPED_LINE_MARKER in the
+    tail, their spans are returned instead. The lines of READ_CONFIG_LINES are never skipped. The lines are found first
+    by looking only at the line breaks, then the tail is copied once into a buffer of its exact size, so the memory
+    used is the kept bytes plus a read chunk however long the lines are
+    :param read: called with a position and a size to get that many bytes of the data at the position
+    :param length: the length of the data
+    :param num_lines: number of trailing lines to read
+    :param max_bytes: the most tail bytes kept in memory, defaults to TAIL_MAX_BYTES
+    :param max_line_bytes: lines longer than this are skipped, defaults to TAIL_MAX_LINE_BYTES
+    :return: the tail, the byte offset where it starts and the spans of the skipped lines
+    :raises TailBudgetExceeded: if a line of READ_CONFIG_LINES doesn't fit in max_bytes
+    """
+    max_bytes = TAIL_MAX_BYTES if max_bytes is None else max_bytes
+    max_line_bytes = TAIL_MAX_LINE_BYTES if max_line_bytes is None else max_line_bytes
+    chunk_size = 8192
+    lines = 0
+    # the spans of the skipped lines, last line first
+    skipped = []
+    kept = 0
+    line_end = length
+    tail_start = length
+    pos = length
+
+    def finish_line(line_start: int) -> bool:
+        """
+        Add the line ending at line_end to the tail
+        :return: True if the tail is complete
+        """
+        nonlocal lines, kept, tail_start
+        size = line_end - line_start
+        oversized = size > max_line_bytes
+        if oversized and is_read_config_line(read(line_start, _READ_CONFIG_PEEK)):
+            check_config_line_fits(size)
+            oversized = False
+        line_size = len(SKIPPED_LINE_MARKER) if oversized else size
+        if kept + line_size > max_bytes:
+            if not oversized and is_read_config_line(read(line_start, _READ_CONFIG_PEEK)):
+                check_config_line_fits(size)
+            return True
+        if oversized:
+            skipped.append((line_start, line_end))
+        lines += 1
+        kept += line_size
+        tail_start = line_start
+        return lines >= num_lines
+
+    def check_config_line_fits(size: int) -> None:
+        if kept + size > max_bytes:
+            raise TailBudgetExceeded(f"A {size} byte setting line near the end of the gcode doesn't fit in the "
+                                     f"{max_bytes} byte tail budget, raise the tail_max_bytes setting")
+
+    done = num_lines <= 0
+    while pos > 0 and not done:
+        read_size = min(chunk_size, pos)
+        pos -= read_size
+        chunk = read(pos, read_size)
+        end = read_size
+        while True:
+            # the newline ending the line before the current one, the newline of the current line doesn't count
+            search_end = min(end, line_end - 1 - pos)
+            index = chunk.rfind(b'\n', 0, search_end) if search_end > 0 else -1
+            if index == -1:
+                break
+            if finish_line(pos + index + 1):
+                done = True
+                break
+            line_end = pos + index + 1
+            end = index + 1
+    if not done and line_end > 0:
+        finish_line(0)
+
+    data = bytearray(kept)
+    filled = 0
+
+    def copy(start: int, stop: int) -> None:
+        nonlocal filled
+        while start < stop:
+            piece = read(start, min(chunk_size, stop - start))
+            if not piece:
+                raise EOFError("The gcode ended before its tail could be read")
+            data[filled:filled + len(piece)] = piece
+            filled += len(piece)
+            start += len(piece)
+
+    copied = tail_start
+    for start, stop in reversed(skipped):
+        copy(copied, start)
+        data[filled:filled + len(SKIPPED_LINE_MARKER)] = SKIPPED_LINE_MARKER
+        filled += len(SKIPPED_LINE_MARKER)
+        copied = stop
+    copy(copied, length)
+    return GcodeTail(data, tail_start, tuple(reversed(skipped)))
+
+
+def is_read_config_line(line: bytes) -> bool:
+    """
+    :return: True if the line holds a setting the post-processor reads from the config block
+    """
+    return line.startswith(READ_CONFIG_LINES)
+
+
+def write_tail(write: Callable[[bytes], Any], tail: bytes, skipped: tuple[tuple[int, int], ...],
+               read: Callable[[int, int], bytes]) -> tuple[int, list[tuple[int, int]]]:
+    """
+    Write an edited tail, copying each skipped line from the source in place of its marker
+    :param write: called with each piece of the tail to write
+    :param tail: the edited tail, with the markers of the skipped lines
+    :param skipped: the spans of the skipped lines in the source, from scan_tail
+    :param read: called with a position and a size to read from the source
+    :return: the number of bytes written, and the spans of the skipped lines relative to the start of the written tail
+    """
+    parts = tail.split(SKIPPED_LINE_MARKER)
+    if len(parts) != len(skipped) + 1:
+        raise ValueError("The edited gcode tail lost track of the lines that were too long to edit")
+    write(parts[0])
+    written = len(parts[0])
+    spans = []
+    for (start, end), part in zip(skipped, parts[1:]):
+        spans.append((written, written + end - start))
+        while start < end:
+            chunk = read(start, min(65536, end - start))
+            if not chunk:
+                raise EOFError("The gcode source ended inside a skipped line")
+            write(chunk)
+            start += len(chunk)
+        written = spans[-1][1]
+        write(part)
+        written += len(part)
+    return written, spans
+
+
+def replace_gcode_tail(gcode_path: str, new_tail: str, progress: Union[Callable[[int, int], None], None] = None,
+                       cancelled: Union[Callable[[], bool], None] = None, undo: bool = False,
+                       durability_mode: Union[str, None] = None) -> WriteReport:
     """
     Replace the last 1000 lines of a G-code file without loading the full file.
     :param gcode_path: path to the G-code file
-    :param new_tail: replacement text for the trailing slicer settings
+    :param new_tail: replacement text for the trailing slicer settings, as read by parse_gcode
+    :param progress: called with the bytes written so far and the total while the file is rewritten
+    :param cancelled: polled while the file is rewritten, the edit stops with EditCancelled once it returns True
+    :param undo: record the original tail in the undo journal of the file so the edit can be undone
+    :param durability_mode: one of durability.ALL, defaults to DURABILITY
+    :return: what the rewrite wrote and how long each step took
     """
-    _, tail_start = read_gcode_tail(gcode_path, 1000)
+    mode = durability_mode or DURABILITY
+    if mode not in durability.ALL:
+        raise ValueError(f"Unknown durability mode {mode!r}, expected one of {', '.join(durability.ALL)}")
+    started = time.perf_counter()
+    original_tail, tail_start, skipped = read_gcode_tail(gcode_path, 1000)
     directory = os.path.dirname(gcode_path) or '.'
+    new_tail_bytes = new_tail.encode('utf-8')
+    fsync_time = verify_time = 0.0
 
     with open(gcode_path, 'rb') as source:
         first_line = source.readline()
-        has_header = first_line.startswith(b'; Edited with NVF Postprocessor')
+        has_header = first_line.startswith(EDITED_HEADER.rstrip())
         source.seek(0)
 
         with tempfile.NamedTemporaryFile('wb', delete=False, dir=directory) as temp_file:
             temp_path = temp_file.name
-            if not has_header:
-                temp_file.write(b'; Edited with NVF Postprocessor\n')
-
-            remaining = tail_start
-            while remaining > 0:
-                chunk = source.read(min(8192, remaining))
-                if not chunk:
-                    break
-                temp_file.write(chunk)
-                remaining -= len(chunk)
-
-            temp_file.write(new_tail.encode('utf-8'))
-
+            try:
+                if not has_header:
+                    temp_file.write(EDITED_HEADER)
+
+                remaining = tail_start
+                next_report = 0
+                while remaining > 0:
+                    if cancelled is not None and cancelled():
+                        raise EditCancelled(f"Editing {gcode_path} was cancelled")
+                    if progress is not None and tail_start - remaining >= next_report:
+                        progress(tail_start - remaining, tail_start)
+                        next_report += PROGRESS_INTERVAL
+                    chunk = source.read(min(8192, remaining))
+                    if not chunk:
+                        break
+                    temp_file.write(chunk)
+                    remaining -= len(chunk)
+                tail_offset = temp_file.tell()
+                copied = time.perf_counter()
+
+                digest = hashlib.sha256()
+
+                def write(data: bytes) -> None:
+                    digest.update(data)
+                    temp_file.write(data)
+
+                written, new_spans = write_tail(write, new_tail_bytes, skipped,
+                                                lambda pos, size: read_at(source, pos, size))
+                temp_file.flush()
+                tail_written = time.perf_counter()
+                if mode != durability.FAST:
+                    os.fsync(temp_file.fileno())
+                    fsync_time += time.perf_counter() - tail_written
+                temp_file.close()
+                if mode == durability.VERIFIED:
+                    verify_started = time.perf_counter()
+                    verify_tail(temp_path, tail_offset, written, digest.hexdigest())
+                    verify_time = time.perf_counter() - verify_started
+            except BaseException:
+                temp_file.close()
+                os.unlink(temp_path)
+                raise
+
+    if progress is not None:
+        progress(tail_start, tail_start)
     os.replace(temp_path, gcode_path)
-
-
-def replace_names(gcode: str, json_data: list[Any]) -> str:
+    if mode != durability.FAST:
+        # the rename is only durable once the directory entry is on disk
+        renamed = time.perf_counter()
+        fsync_directory(directory)
+        fsync_time += time.perf_counter() - renamed
+    if undo:
+        # journaled once the edit is in place, a failed rename leaves no entry behind
+        undo_journal.record_edit(gcode_path, original_tail, tail_start, b'' if has_header else EDITED_HEADER, written,
+                                 digest.hexdigest(), new_spans)
+    return WriteReport(mode, tail_offset + written, copied - started, tail_written - copied, fsync_time,
+                       verify_time, time.perf_counter() - started)
+
+
+def verify_tail(path: str, offset: int, length: int, sha256: str) -> None:
+    """
+    Read a written tail back in chunks and compare it to the hash of what was written
+    :param path: the path to the written file
+    :param offset: where the tail starts in the file
+    :param length: the length of the tail, the file must end with it
+    :param sha256: the sha256 hex digest of the tail
+    :raises VerificationError: if the file doesn't end with the tail
     """
-    Replace the db ids in the gcode with the correct values
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size != offset + length:
+            raise VerificationError(f"{path} has the wrong size after writing, expected {offset + length} bytes")
+        file.seek(offset)
+        for chunk in iter(lambda: file.read(65536), b''):
+            digest.update(chunk)
+    if digest.hexdigest() != sha256:
+        raise VerificationError(f"The tail read back from {path} doesn't match what was written")
+
+
+def replace_names(gcode: str, json_data: list[Any], plan: Union[SubstitutionPlan, None] = None) -> str:
+    """
+    Fill the spool placeholders in the filament notes of the gcode with the correct values
     :param gcode: the last 1000 lines of the gcode
-    :param json_data: the list of db ids in order
-    :return: the last 1000 lines of the gcode with the db ids replaced
+    :param json_data: the placeholder values in order of the extruders, either a name or a placeholder name -> value
+    dictionary per extruder
+    :param plan: the compiled placeholders to fill, defaults to the built-in ones and any others found in json_data
+    :return: the last 1000 lines of the gcode with the placeholders filled in
     """
 
     if json_data is None:
@@ -144,11 +485,9 @@ def replace_names(gcode: str, json_data: list[Any]) -> str:
     filament_pattern = re.compile(r'; filament_type = (.+)')
     used_filament_pattern = re.compile(r'; filament used \[mm] = (.+)')
 
-    filament_notes_match = filament_notes_pattern.search(gcode)
     filament_match = filament_pattern.search(gcode)
     filament_used_match = used_filament_pattern.search(gcode)
 
-    filament_notes = None
     filament_types = None
     filament_used = None
 
@@ -157,16 +496,12 @@ def replace_names(gcode: str, json_data: list[Any]) -> str:
 
     if filament_match:
         filament_types = filament_match.group(1).strip().split(';')
-    if filament_notes_match:
-        filament_notes = filament_notes_match.group(1).strip().split(';')
-    if filament_notes is None:
+    if filament_notes_pattern.search(gcode) is None:
         return gcode
 
     num_filaments = 0
     if filament_types is not None:
         num_filaments = len(filament_types)
-    new_filament_notes = filament_notes_match.group(0)
-    new_filament_notes = new_filament_notes[1:].split(';')
     if filament_used is not None:
         if len(filament_used) != num_filaments:
             while len(filament_used) < num_filaments:
@@ -175,25 +510,142 @@ def replace_names(gcode: str, json_data: list[Any]) -> str:
 
             gcode = re.sub(r"; filament used \[mm] = (.+)", f"; filament used [mm] = {', '.join(filament_used)}", gcode)
 
-    # loop through the json data
+    if plan is None:
+        plan = compile_plan(placeholder_names(json_data))
+    # the filament used line may have moved the notes, so match them again
+    filament_notes_match = filament_notes_pattern.search(gcode)
+    filament_notes = filament_notes_match.group(1).split(';')
+
+    # fill the placeholders of each extruder in a single pass, keeping the separators of the notes as they are
     for i in range(len(filament_notes)):
         try:
-            if json_data[i] is None:
-                continue
+            values = json_data[i]
         except IndexError:
             continue
-        if re.search(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]", filament_notes[i]):
-            tmp_string = re.sub(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]", f"[sm_name = {json_data[i]}]", filament_notes[i])
-            # replace the match with the json data
-            new_filament_notes[i] = new_filament_notes[i].replace(filament_notes[i], tmp_string)
-    #convert the list to a string replacing the commas with a semicolon and not adding the brackets
-    new_filament_notes = ";" + '; '.join(new_filament_notes)
-    # replace the filament notes in the gcode
-    gcode = gcode.replace(filament_notes_match.group(0), new_filament_notes)
-    return gcode
+        if values is None:
+            continue
+        if not isinstance(values, dict):
+            values = {"sm_name": values}
+        filament_notes[i] = plan.apply(filament_notes[i], values)
+    return gcode[:filament_notes_match.start(1)] + ';'.join(filament_notes) + gcode[filament_notes_match.end(1):]
+
+
+def placeholder_names(json_data: Union[list[Any], None]) -> set[str]:
+    """
+    Get the names of the placeholders that have values in the json data
+    :param json_data: the placeholder values in order of the extruders
+    :return: the placeholder names
+    """
+    names = set()
+    for values in json_data or ():
+        if isinstance(values, dict):
+            names.update(values)
+    return names
+
+
+def get_config_value(gcode: str, key: str) -> str | None:
+    """
+    Get the value of a slicer setting from the config block at the end of the gcode
+    :param gcode: the last 1000 lines of the gcode
+    :param key: the name of the setting, e.g. filament_type
+    :return: the value of the setting or None if it is not in the gcode
+    """
+    match = re.search(r'^; ' + re.escape(key) + r' = (.*?)\r?$', gcode, re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def split_config_list(value: str | None, separator: str = ';') -> list[str]:
+    """
+    Split a per extruder slicer setting into the value of each extruder
+    :param value: the value of the setting
+    :param separator: the separator between the extruders, ';' for strings and ',' for numbers
+    :return: the value of each extruder with surrounding whitespace and quotes removed
+    """
+    if value is None:
+        return []
+    return [item.strip().strip('"') for item in value.strip().split(separator)]
+
+
+def get_filament_notes(gcode: str) -> list[str] | None:
+    """
+    Get the filament notes of each extruder
+    :param gcode: the last 1000 lines of the gcode
+    :return: the notes of each extruder or None if the gcode has no filament notes
+    """
+    filament_notes_match = re.search(r'; filament_notes = (.+)', gcode)
+    if filament_notes_match is None:
+        return None
+    return filament_notes_match.group(1).strip().split(';')
+
+
+def get_spools(gcode: str) -> dict[int, str]:
+    """
+    Get the spool name tagged for each extruder
+    :param gcode: the last 1000 lines of the gcode
+    :return: extruder number -> spool name, untagged extruders have an empty name
+    """
+    filament_notes = get_filament_notes(gcode)
+    if filament_notes is None or filament_notes == ['""'] or filament_notes == ['']:
+        return {}
+    spools = {}
+    for i, notes in enumerate(filament_notes):
+        spools[i + 1] = find_spool_name(notes) or ""
+    return spools
+
+
+def count_tagged_extruders(gcode: str) -> int:
+    """
+    Count the extruders whose filament notes have an sm_name tag
+    :param gcode: the last 1000 lines of the gcode
+    :return: the number of tagged extruders
+    """
+    return sum(1 for notes in get_filament_notes(gcode) or () if find_spool_name(notes) is not None)
+
+
+def get_filament_metadata(gcode: str) -> dict[str, Any]:
+    """
+    Get the filament settings of each extruder from the config block at the end of the gcode
+    :param gcode: the last 1000 lines of the gcode
+    :return: the number of extruders and the spool name, filament type, colour, vendor and filament used of each
+    """
+    filament_notes = get_filament_notes(gcode)
+    filament_types = split_config_list(get_config_value(gcode, "filament_type"))
+    return {
+        "extruders": max(len(filament_types), len(filament_notes or ())),
+        "tagged_extruders": count_tagged_extruders(gcode),
+        "sm_name": list(get_spools(gcode).values()),
+        "filament_type": filament_types,
+        "filament_colour": split_config_list(get_config_value(gcode, "filament_colour")),
+        "filament_vendor": split_config_list(get_config_value(gcode, "filament_vendor")),
+        "filament_used_mm": parse_numbers(get_config_value(gcode, "filament used [mm]")),
+        "filament_used_g": parse_numbers(get_config_value(gcode, "filament used [g]")),
+    }
+
+
+def parse_numbers(value: str | None) -> list[float | None]:
+    """
+    Parse a comma separated per extruder number setting
+    :param value: the value of the setting
+    :return: the number of each extruder, None for values that are not numbers
+    """
+    numbers = []
+    for item in split_config_list(value, ','):
+        try:
+            numbers.append(float(item))
+        except ValueError:
+            numbers.append(None)
+    return numbers
 
 
 if __name__ == "__main__":
-    GCODE_PATH = sys.argv[2]
     JSON_PATH = sys.argv[1]
-    main(GCODE_PATH, JSON_PATH)
+    GCODE_PATHS = sys.argv[2:]
+    if len(GCODE_PATHS) == 1:
+        main(GCODE_PATHS[0], JSON_PATH)
+    else:
+        errors = process_files(GCODE_PATHS, parse_json_file(JSON_PATH))
+        for failed_path, error in errors.items():
+            if error is not None:
+                print(f"Could not edit {failed_path}: {error}")
+        if any(error is not None for error in errors.values()):
+            sys.exit(1)
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, Union
+from urllib.parse import quote, urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import postprocessor
+from circuit_breaker import CircuitOpen
+from octoprint_client import OCTOPRINT_BREAKER
+
+# the slicers mark the start of the config block at the end of the gcode with one of these lines
+CONFIG_BLOCK_MARKERS = (b"; prusaslicer_config = begin", b"; CONFIG_BLOCK_START", b"; SuperSlicer_config = begin")
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class RemoteTailReader:
+    """
+    Reads the config block at the end of gcode files stored on OctoPrint with HTTP Range requests, so only the tail of
+    each file is transferred. Requests share one pooled session and many files can be read at once
+    """
+
+    def __init__(self, url: str, api_key: Union[str, None] = None, max_connections: int = 16,
+                 initial_window: int = 64 * 1024, max_window: int = 8 * 1024 * 1024, num_lines: int = 1000,
+                 timeout: float = 10):
+        """
+        :param url: the base octoprint url
+        :param api_key: the octoprint api key
+        :param max_connections: the maximum number of files read at once
+        :param initial_window: the number of tail bytes requested first, doubled until the config block is found
+        :param max_window: the most tail bytes requested for one file
+        :param num_lines: stop growing the window once it holds this many lines, like the local tail reader
+        :param timeout: the timeout of each request in seconds
+        """
+        self.url = url.rstrip("/") + "/"
+        self.max_connections = max_connections
+        self.initial_window = initial_window
+        self.max_window = max_window
+        self.num_lines = num_lines
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key is not None and api_key.strip() != "":
+            self.session.headers["X-Api-Key"] = api_key.strip()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> RemoteTailReader:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def get(self, request_url: str, **kwargs: Any) -> requests.Response:
+        """
+        Make a request through the octoprint circuit breaker, so once the printer stops answering the files left fail
+        right away instead of each waiting for the timeout
+        :param request_url: the full url of the request
+        :param kwargs: the arguments of requests.Session.get
+        :return: the response, whatever its status
+        """
+        OCTOPRINT_BREAKER.check(request_url)
+        try:
+            response = self.session.get(request_url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            OCTOPRINT_BREAKER.record_failure(request_url)
+            raise
+        OCTOPRINT_BREAKER.record_success(request_url)
+        return response
+
+    def list_files(self) -> list[str]:
+        """
+        List the gcode files stored on the printer
+        :return: the path of each gcode file, relative to the local storage
+        """
+        response = self.get(urljoin(self.url, "api/files/local"), params={"recursive": "true"})
+        response.raise_for_status()
+        paths = []
+        stack = list(response.json().get("files", []))
+        while stack:
+            entry = stack.pop()
+            if entry.get("type") == "folder":
+                stack.extend(entry.get("children", []))
+            elif entry.get("type") == "machinecode":
+                paths.append(entry["path"])
+        return sorted(paths)
+
+    def read_tail(self, path: str) -> tuple[str, int]:
+        """
+        Read the tail of a gcode file on the printer, the requested window grows until it holds the config block and
+        the summary lines before it
+        :param path: the path of the file, relative to the local storage
+        :return: the decoded tail starting at a line boundary, and the number of bytes transferred
+        """
+        file_url = urljoin(self.url, "downloads/files/local/" + quote(path))
+        window = self.initial_window
+        transferred = 0
+        while True:
+            response = self.get(file_url, headers={"Range": f"bytes=-{window}"})
+            if response.status_code == 416:
+                # an empty file
+                return "", transferred
+            response.raise_for_status()
+            data = response.content
+            transferred += len(data)
+            at_start = True
+            if response.status_code == 206:
+                match = CONTENT_RANGE_PATTERN.match(response.headers.get("Content-Range", ""))
+                at_start = match is None or int(match.group(1)) == 0
+            if at_start or window >= self.max_window or self._holds_config(data):
+                break
+            window = min(window * 2, self.max_window)
+        if not at_start:
+            # the window starts in the middle of a line
+            data = data[data.find(b"\n") + 1:]
+        return data.decode("utf-8", errors="replace"), transferred
+
+    def _holds_config(self, data: bytes) -> bool:
+        """
+        :return: True if the tail holds as many lines as the local tail reader reads, or the start of the config block
+        with the whole run of comment lines before it, where PrusaSlicer writes the filament used summary
+        """
+        if data.count(b"\n") > self.num_lines:
+            return True
+        marker = min((data.find(marker) for marker in CONFIG_BLOCK_MARKERS if marker in data), default=-1)
+        if marker < 0:
+            return False
+        # the first line is only partly in the window, the summary is covered once a gcode line comes before it
+        lines = data[data.find(b"\n") + 1:marker].splitlines()
+        return any(line.strip() and not line.startswith(b";") for line in lines)
+
+    def inspect(self, path: str) -> dict[str, Any]:
+        """
+        Read the filament metadata of a gcode file on the printer, with the same parser used for local files
+        :param path: the path of the file, relative to the local storage
+        :return: the metadata record of the file, or a record with an error message if it could not be read
+        """
+        try:
+            tail, transferred = self.read_tail(path)
+        except (requests.exceptions.RequestException, CircuitOpen, ValueError) as e:
+            return {"path": path, "error": str(e)}
+        return {"path": path, **postprocessor.get_filament_metadata(tail), "bytes_transferred": transferred}
+
+    def inspect_files(self, paths: Union[Iterable[str], None] = None) -> Iterator[dict[str, Any]]:
+        """
+        Read the filament metadata of many gcode files on the printer at once
+        :param paths: the paths of the files relative to the local storage, None for every gcode file on the printer
+        :return: the metadata record of each file, in the order of paths
+        """
+        if paths is None:
+            paths = self.list_files()
+        with ThreadPoolExecutor(self.max_connections, thread_name_prefix="nvf-remote") as executor:
+            yield from executor.map(self.inspect, paths)
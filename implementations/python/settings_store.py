@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import copy
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Union
+
+from file_lock import locked
+
+SETTINGS_VERSION = 1
+
+
+class SettingsStore:
+    """
+    A single in-memory copy of the settings file with debounced, atomic write-behind.
+    The file is parsed once, saves are coalesced and written through a fsynced temp file that is renamed over the
+    settings file, and changes made by other post-processor instances in the meantime are merged instead of clobbered.
+    """
+
+    def __init__(self, path: str, legacy_paths: tuple[str, ...] = (), debounce: float = 0.5):
+        """
+        :param path: the path the settings are saved to
+        :param legacy_paths: older settings paths to read from when path does not exist yet
+        :param debounce: the delay in seconds used to coalesce saves
+        """
+        self.path = path
+        self.legacy_paths = legacy_paths
+        self.debounce = debounce
+        self._lock = threading.RLock()
+        self._timer: Union[threading.Timer, None] = None
+        # the settings shared with the caller, only ever read or changed on the caller's thread
+        self._data: Union[dict[str, Any], None] = None
+        # a copy of the settings taken by the last save, written by the debounce timer
+        self._pending: Union[dict[str, Any], None] = None
+        # the settings of this instance when they were last read or written, used to work out what it changed
+        self._base: dict[str, Any] = {}
+        # the settings file as it was when last read or written
+        self._disk: dict[str, Any] = {}
+        self._fingerprint: Union[tuple[int, int], None] = None
+
+    def load(self) -> dict[str, Any]:
+        """
+        Get the settings, parsing the file on the first call only
+        :return: the shared settings dictionary
+        """
+        with self._lock:
+            if self._data is None:
+                self._data = self._read_disk()
+                self._base = copy.deepcopy(self._data)
+                self._disk = copy.deepcopy(self._data)
+            return self._data
+
+    def save(self, data: Union[dict[str, Any], None] = None) -> None:
+        """
+        Schedule the settings to be written after the debounce delay, restarting the delay if one is pending.
+        The settings are copied right away, the timer only writes the copy so the caller can keep editing them
+        :param data: new settings replacing the in-memory copy, None to save the in-memory copy
+        """
+        with self._lock:
+            shared = self.load()
+            if data is not None and data is not shared:
+                for key in [key for key in shared if key not in data]:
+                    del shared[key]
+                shared.update(data)
+            self._pending = copy.deepcopy(shared)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """
+        Write the last saved settings to disk now
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            settings, self._pending = self._pending, None
+            if settings is None:
+                return
+            # other instances take the same lock, so none can write between the check and the rename
+            with locked(self.path):
+                if self._fingerprint != self._disk_fingerprint():
+                    self._disk = self._read_disk()
+                merged = self._merge_external_changes(settings)
+                self._base = settings
+                if merged == self._disk and self._fingerprint is not None:
+                    return
+                write_json_atomic(self.path, merged)
+                self._disk = merged
+                self._fingerprint = self._disk_fingerprint()
+
+    def _merge_external_changes(self, settings: dict[str, Any]) -> dict[str, Any]:
+        """
+        Another process may have written the file since it was read, keep its values for every key this instance did
+        not change
+        :param settings: the settings of this instance
+        :return: the settings to write
+        """
+        merged = copy.deepcopy(self._disk)
+        for key in set(self._base) | set(settings):
+            if key not in settings:
+                if key in self._base:
+                    merged.pop(key, None)
+            elif key not in self._base or self._base[key] != settings[key]:
+                merged[key] = settings[key]
+        merged["settings version"] = SETTINGS_VERSION
+        return merged
+
+    def _read_disk(self) -> dict[str, Any]:
+        """
+        Read the settings file, falling back to the legacy files
+        :return: the parsed settings or an empty dictionary if no file could be read
+        """
+        for path in (self.path,) + tuple(self.legacy_paths):
+            if os.path.isdir(path) or not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r') as file:
+                    fingerprint = os.fstat(file.fileno())
+                    data = json.load(file)
+            except (json.JSONDecodeError, FileNotFoundError):
+                continue
+            if not isinstance(data, dict):
+                continue
+            if path == self.path:
+                self._fingerprint = (fingerprint.st_mtime_ns, fingerprint.st_size)
+            return data
+        self._fingerprint = self._disk_fingerprint()
+        return {}
+
+    def _disk_fingerprint(self) -> Union[tuple[int, int], None]:
+        """
+        :return: the modification time and size of the settings file, or None if it does not exist
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+def write_json_atomic(path: str, data: Any) -> None:
+    """
+    Write json data through a temp file that is fsynced and renamed over path, so a crash never leaves a partial file
+    :param path: the destination path
+    :param data: the json serializable data
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', delete=False, dir=directory, prefix='.nfvsettings-', suffix='.tmp') as file:
+        temp_path = file.name
+        try:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.close()
+            os.unlink(temp_path)
+            raise
+    os.replace(temp_path, path)
+    fsync_directory(directory)
+
+
+def fsync_directory(directory: str) -> None:
+    """
+    Flush a directory entry to disk so a rename in it survives power loss, a no-op where directories can't be opened
+    :param directory: the directory path
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import heapq
+import math
+from typing import Any, Iterable, Mapping, NamedTuple, Union
+
+# the rgb cube is split into buckets of this many values per channel so spools of a similar color share a bucket
+COLOR_BUCKET_SIZE = 32
+# the number of rings of neighbouring color buckets searched for candidates
+MAX_COLOR_RINGS = 2
+# the most candidate spools kept per extruder for the matching, extruders sliced with the same filament share their
+# candidates so this many are kept on top of one per extruder
+MAX_CANDIDATES = 8
+# the most spools whose cost is computed for an extruder sliced without a color, where the color buckets can't narrow
+# the catalog down
+MAX_SCANNED = 512
+
+# costs of the differences between a spool and the filament an extruder was sliced with, the color costs at most
+# COLOR_COST when the colors are as far apart as black and white
+MATERIAL_COST = 100.0
+COLOR_COST = 50.0
+UNKNOWN_COLOR_COST = 25.0
+VENDOR_COST = 10.0
+LOW_REMAINING_COST = 30.0
+# the cost of leaving an extruder without a spool, higher than any spool of the right material so one is proposed if
+# one is left, and lower than any spool of another material so those are never proposed
+NO_SPOOL_COST = COLOR_COST + VENDOR_COST + LOW_REMAINING_COST + 1
+# proposals costing more than this, or made without knowing the material, are flagged to be checked before they are
+# written
+REVIEW_COST = UNKNOWN_COLOR_COST
+
+_MAX_COLOR_DISTANCE = math.sqrt(3 * 255 ** 2)
+
+
+class Filament(NamedTuple):
+    """
+    The filament an extruder was sliced with, read from the config block of the gcode
+    """
+    material: str
+    color: Union[tuple[int, int, int], None]
+    vendor: str
+    used_g: Union[float, None]
+
+
+class Match(NamedTuple):
+    """
+    The spool proposed for an extruder
+    """
+    spool: Union[dict[str, Any], None]
+    cost: float
+    # the spool is a poor fit or the extruder's material is unknown, it should be checked before it is written
+    review: bool = False
+
+
+def parse_color(value: Any) -> Union[tuple[int, int, int], None]:
+    """
+    Parse a #RRGGBB or #RGB color
+    :param value: the color
+    :return: the red, green and blue values, or None if the value is not a color
+    """
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lstrip("#")
+    if len(value) == 3:
+        value = "".join(digit * 2 for digit in value)
+    if len(value) != 6:
+        return None
+    try:
+        return int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16)
+    except ValueError:
+        return None
+
+
+def color_bucket(color: tuple[int, int, int]) -> tuple[int, int, int]:
+    return color[0] // COLOR_BUCKET_SIZE, color[1] // COLOR_BUCKET_SIZE, color[2] // COLOR_BUCKET_SIZE
+
+
+def normalize(value: Any) -> str:
+    return str(value).strip().casefold() if value is not None else ""
+
+
+def gcode_filaments(metadata: Mapping[str, Any]) -> list[Filament]:
+    """
+    Get the filament of each extruder from the gcode metadata
+    :param metadata: the metadata from postprocessor.get_filament_metadata
+    :return: the filament of each extruder, in order of the extruders
+    """
+
+    def item(values: list, index: int) -> Any:
+        return values[index] if index < len(values) else None
+
+    return [Filament(normalize(item(metadata["filament_type"], i)), parse_color(item(metadata["filament_colour"], i)),
+                     normalize(item(metadata["filament_vendor"], i)), item(metadata["filament_used_g"], i))
+            for i in range(metadata["extruders"])]
+
+
+def catalog_records(data: Any) -> list[dict[str, Any]]:
+    """
+    Get the spool records from a SpoolManager catalog, a loadSpoolsByQuery response or a list of spool records
+    :param data: the parsed catalog
+    :return: the spool records that have a name
+    """
+    if isinstance(data, dict):
+        data = data.get("allSpools") or []
+    return [spool for spool in data if isinstance(spool, dict) and spool.get("displayName")]
+
+
+class SpoolCatalog:
+    """
+    The SpoolManager catalog indexed by material, color bucket and vendor, so the spools that could match an extruder
+    are found without looking at the whole catalog. Build it once per catalog, matching against it is cheap
+    """
+
+    def __init__(self, spools: Iterable[dict[str, Any]], skip_inactive: bool = True):
+        """
+        :param spools: the spool records from SpoolManager, see catalog_records
+        :param skip_inactive: leave out the spools SpoolManager marks as inactive, keep them to index the spools of a
+        printer by extruder
+        """
+        self.spools: list[dict[str, Any]] = []
+        self.materials: list[str] = []
+        self.colors: list[Union[tuple[int, int, int], None]] = []
+        self.vendors: list[str] = []
+        self.remaining: list[Union[float, None]] = []
+        # (material, color bucket) -> spool indexes, spools without a color are in the None bucket
+        self.by_material_color: dict[tuple[str, Union[tuple[int, int, int], None]], list[int]] = {}
+        # color bucket -> spool indexes of every material
+        self.by_color: dict[Union[tuple[int, int, int], None], list[int]] = {}
+        # material -> vendor -> spool indexes
+        self.by_material_vendor: dict[str, dict[str, list[int]]] = {}
+        for spool in spools:
+            if skip_inactive and spool.get("isActive") is False:
+                continue
+            index = len(self.spools)
+            material = normalize(spool.get("material"))
+            color = parse_color(spool.get("color"))
+            bucket = color_bucket(color) if color is not None else None
+            self.spools.append(spool)
+            self.materials.append(material)
+            self.colors.append(color)
+            vendor = normalize(spool.get("vendor"))
+            self.vendors.append(vendor)
+            self.remaining.append(_number(spool.get("remainingWeight")))
+            self.by_material_color.setdefault((material, bucket), []).append(index)
+            self.by_color.setdefault(bucket, []).append(index)
+            self.by_material_vendor.setdefault(material, {}).setdefault(vendor, []).append(index)
+
+    def __len__(self) -> int:
+        return len(self.spools)
+
+    def cost(self, filament: Filament, index: int) -> float:
+        """
+        Get how badly a spool fits an extruder, 0 is a perfect fit
+        :param filament: the filament the extruder was sliced with
+        :param index: the index of the spool in the catalog
+        :return: the cost of putting the spool in the extruder
+        """
+        cost = 0.0
+        if filament.material and self.materials[index] != filament.material:
+            cost += MATERIAL_COST
+        color = self.colors[index]
+        if filament.color is not None:
+            cost += UNKNOWN_COLOR_COST if color is None else COLOR_COST * math.dist(filament.color, color) / \
+                _MAX_COLOR_DISTANCE
+        if filament.vendor and self.vendors[index] != filament.vendor:
+            cost += VENDOR_COST
+        remaining = self.remaining[index]
+        if filament.used_g is not None and remaining is not None and remaining < filament.used_g:
+            cost += LOW_REMAINING_COST
+        return cost
+
+    def candidates(self, filament: Filament, max_candidates: int = MAX_CANDIDATES) -> list[tuple[float, int]]:
+        """
+        Find the spools that fit an extruder best, through the index: spools of the same material in the same and
+        neighbouring color buckets, then a bounded number of spools of the material, the same vendor first. Spools of
+        another material are only looked at when the material is unknown, then by color, and nothing is proposed when
+        neither the material nor the color is known
+        :param filament: the filament the extruder was sliced with
+        :param max_candidates: the most spools returned
+        :return: (cost, spool index) of the best spools, cheapest first
+        """
+        indexes: list[int] = []
+        if not filament.material:
+            if filament.color is None:
+                return []
+            for ring in range(MAX_COLOR_RINGS + 1):
+                for bucket in _ring(color_bucket(filament.color), ring):
+                    indexes += self.by_color.get(bucket, ())
+                if len(indexes) >= max_candidates:
+                    break
+        else:
+            if filament.color is not None:
+                for ring in range(MAX_COLOR_RINGS + 1):
+                    for bucket in _ring(color_bucket(filament.color), ring):
+                        indexes += self.by_material_color.get((filament.material, bucket), ())
+                    if len(indexes) >= max_candidates:
+                        break
+                indexes += self.by_material_color.get((filament.material, None), ())[:MAX_SCANNED]
+            if len(indexes) < max_candidates:
+                # no color or none close enough, the vendor and the remaining weight are left to tell the spools apart,
+                # look at a bounded number of them, the vendor's first
+                vendors = self.by_material_vendor.get(filament.material, {})
+                scanned: list[int] = []
+                for vendor_indexes in [vendors.get(filament.vendor, [])] + \
+                        [vendor_indexes for vendor, vendor_indexes in vendors.items() if vendor != filament.vendor]:
+                    scanned += vendor_indexes[:MAX_SCANNED - len(scanned)]
+                    if len(scanned) >= MAX_SCANNED:
+                        break
+                indexes += scanned
+        return heapq.nsmallest(max_candidates, ((self.cost(filament, index), index) for index in set(indexes)))
+
+    def assign(self, filaments: list[Filament], max_candidates: int = MAX_CANDIDATES) -> list[Match]:
+        """
+        Propose a spool for each extruder, no spool is proposed for two extruders and the total cost is the lowest
+        possible among the candidates of each extruder. Extruders sliced with the same filament share one candidate
+        list, long enough to give each of them a spool
+        :param filaments: the filament each extruder was sliced with
+        :param max_candidates: the most candidate spools considered per extruder
+        :return: the proposed spool of each extruder, in order of the extruders
+        """
+        shared: dict[Filament, int] = {}
+        for filament in filaments:
+            shared[filament] = shared.get(filament, 0) + 1
+        candidates_of = {filament: self.candidates(filament, max_candidates + count - 1)
+                         for filament, count in shared.items()}
+        candidates = [candidates_of[filament] for filament in filaments]
+        columns = sorted({index for extruder_candidates in candidates for _, index in extruder_candidates})
+        column_of = {index: column for column, index in enumerate(columns)}
+        # every extruder can also be left without a spool, one "no spool" column per extruder
+        costs = []
+        for row, extruder_candidates in enumerate(candidates):
+            row_costs = [math.inf] * (len(columns) + len(filaments))
+            for cost, index in extruder_candidates:
+                row_costs[column_of[index]] = cost
+            row_costs[len(columns) + row] = NO_SPOOL_COST
+            costs.append(row_costs)
+
+        matches = []
+        for row, column in enumerate(min_cost_assignment(costs)):
+            if column < len(columns):
+                cost = costs[row][column]
+                matches.append(Match(self.spools[columns[column]], cost,
+                                     cost > REVIEW_COST or not filaments[row].material))
+            else:
+                matches.append(Match(None, NO_SPOOL_COST))
+        return matches
+
+
+def min_cost_assignment(costs: list[list[float]]) -> list[int]:
+    """
+    Solve the assignment problem with the Hungarian algorithm, in O(rows² * columns)
+    :param costs: the cost of each row and column, there must be at least as many columns as rows and each row must
+    have a finite cost in a column of its own
+    :return: the column assigned to each row
+    """
+    rows = len(costs)
+    if rows == 0:
+        return []
+    columns = len(costs[0])
+    # potentials of the rows and columns, and the row matched to each column, 1-based with 0 as the free row
+    row_potential = [0.0] * (rows + 1)
+    column_potential = [0.0] * (columns + 1)
+    column_row = [0] * (columns + 1)
+    way = [0] * (columns + 1)
+    for row in range(1, rows + 1):
+        column_row[0] = row
+        column = 0
+        min_slack = [math.inf] * (columns + 1)
+        used = [False] * (columns + 1)
+        while True:
+            used[column] = True
+            current_row = column_row[column]
+            delta = math.inf
+            next_column = 0
+            for j in range(1, columns + 1):
+                if used[j]:
+                    continue
+                slack = costs[current_row - 1][j - 1] - row_potential[current_row] - column_potential[j]
+                if slack < min_slack[j]:
+                    min_slack[j] = slack
+                    way[j] = column
+                if min_slack[j] < delta:
+                    delta = min_slack[j]
+                    next_column = j
+            for j in range(columns + 1):
+                if used[j]:
+                    row_potential[column_row[j]] += delta
+                    column_potential[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            column = next_column
+            if column_row[column] == 0:
+                break
+        # flip the augmenting path
+        while column:
+            previous = way[column]
+            column_row[column] = column_row[previous]
+            column = previous
+
+    assignment = [0] * rows
+    for column in range(1, columns + 1):
+        if column_row[column]:
+            assignment[column_row[column] - 1] = column - 1
+    return assignment
+
+
+def _ring(center: tuple[int, int, int], radius: int) -> Iterable[tuple[int, int, int]]:
+    """
+    :return: the color buckets at exactly radius buckets from center, along the furthest channel
+    """
+    limit = 256 // COLOR_BUCKET_SIZE
+    for r in range(center[0] - radius, center[0] + radius + 1):
+        for g in range(center[1] - radius, center[1] + radius + 1):
+            for b in range(center[2] - radius, center[2] + radius + 1):
+                if max(abs(r - center[0]), abs(g - center[1]), abs(b - center[2])) != radius:
+                    continue
+                if 0 <= r < limit and 0 <= g < limit and 0 <= b < limit:
+                    yield r, g, b
+
+
+def _number(value: Any) -> Union[float, None]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import json
+import random
+from typing import Any, Callable, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from PyQt6.QtCore import QObject, QTimer, QUrl, pyqtSignal
+from PyQt6.QtWebSockets import QWebSocket
+
+from octoprint_client import octoprint_login
+from task_runner import task_runner
+
+SPOOL_MANAGER_PLUGIN = "SpoolManager"
+# the delay before the first reconnect, doubled after every failed attempt up to the maximum
+MIN_RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+
+
+def push_socket_url(url: str) -> str:
+    """
+    :param url: the base octoprint url
+    :return: the url of the raw websocket of octoprint's push socket
+    """
+    scheme, netloc, path, _, _ = urlsplit(url.rstrip("/") + "/")
+    return urlunsplit(("wss" if scheme == "https" else "ws", netloc, path + "sockjs/websocket", "", ""))
+
+
+class spool_subscription(QObject):
+    """
+    Keeps the spool selection current by listening to octoprint's push socket for SpoolManager messages, instead of
+    downloading the spools on every click. The socket runs on the Qt event loop and the blocking requests on the task
+    runner, a dropped connection is retried with exponential backoff
+    """
+    # the spool record of each extruder, in order of the extruders
+    selection_changed = pyqtSignal(object)
+    # a short description of the connection, for the window to show
+    status_changed = pyqtSignal(str)
+
+    def __init__(self, url: str, api_key: Union[str, None], tasks: task_runner,
+                 load_selection: Callable[[str, Union[str, None]], tuple[Union[list, None], Union[str, None]]],
+                 parent: Union[QObject, None] = None):
+        """
+        :param url: the base octoprint url
+        :param api_key: the octoprint api key
+        :param tasks: the runner the login and spool requests are run on
+        :param load_selection: loads the selected spool records, called as load_selection(url, api_key) and returning
+        the records and None or None and an error message
+        :param parent: the owner of the subscription
+        """
+        super().__init__(parent)
+        self.url = url
+        self.api_key = api_key
+        self.tasks = tasks
+        self.load_selection = load_selection
+        self.selection: Union[list, None] = None
+        self.socket = QWebSocket()
+        self.socket.setParent(self)
+        self.socket.connected.connect(self.socket_connected)
+        self.socket.disconnected.connect(self.socket_disconnected)
+        self.socket.textMessageReceived.connect(self.message_received)
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.timeout.connect(self.connect_socket)
+        self.reconnect_delay = MIN_RECONNECT_DELAY
+        self.credentials: Union[tuple[str, str], None] = None
+        self.running = False
+        self.connecting = False
+        # a refresh is running, and another one was asked for while it ran
+        self.refreshing = False
+        self.refresh_pending = False
+
+    def start(self) -> None:
+        """
+        Load the current selection and connect to the push socket
+        """
+        self.running = True
+        self.refresh()
+        self.connect_socket()
+
+    def stop(self) -> None:
+        """
+        Close the connection and stop reconnecting
+        """
+        self.running = False
+        self.reconnect_timer.stop()
+        self.socket.abort()
+
+    def connect_socket(self) -> None:
+        """
+        Log in in the background and open the push socket once logged in
+        """
+        if not self.running or self.connecting:
+            return
+        self.connecting = True
+        self.tasks.start(lambda _: octoprint_login(self.url, self.api_key), on_finished=self.logged_in,
+                         on_failed=self.connection_failed)
+
+    def logged_in(self, credentials: tuple[str, str]) -> None:
+        self.credentials = credentials
+        if not self.running:
+            self.connecting = False
+            return
+        self.socket.open(QUrl(push_socket_url(self.url)))
+
+    def connection_failed(self, error: Any) -> None:
+        """
+        Try to connect again after the backoff delay
+        :param error: what went wrong
+        """
+        self.connecting = False
+        if not self.running:
+            return
+        self.status_changed.emit(f"Lost the connection to OctoPrint ({error}), retrying in "
+                                 f"{self.reconnect_delay:.0f}s")
+        # a little jitter so windows that lost the same server don't all reconnect at once
+        self.reconnect_timer.start(int(self.reconnect_delay * random.uniform(1000, 1250)))
+        self.reconnect_delay = min(self.reconnect_delay * 2, MAX_RECONNECT_DELAY)
+
+    def socket_connected(self) -> None:
+        self.connecting = False
+        self.reconnect_delay = MIN_RECONNECT_DELAY
+        name, session = self.credentials
+        self.socket.sendTextMessage(json.dumps({"auth": f"{name}:{session}"}))
+        self.status_changed.emit("Receiving spool changes from OctoPrint")
+        # changes made while the socket was down were missed
+        self.refresh()
+
+    def socket_disconnected(self) -> None:
+        if self.connecting:
+            self.connection_failed(self.socket.errorString())
+        elif self.running:
+            self.connecting = True
+            self.connection_failed("disconnected")
+
+    def message_received(self, message: str) -> None:
+        """
+        Handle a message of the push socket, a SpoolManager message updates the selection
+        :param message: the json message
+        """
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        if not isinstance(payload, dict):
+            return
+        if "reauthRequired" in payload:
+            # the session expired, log in again on a new connection
+            self.socket.abort()
+            return
+        plugin = payload.get("plugin")
+        if not isinstance(plugin, dict) or plugin.get("plugin") != SPOOL_MANAGER_PLUGIN:
+            return
+        data = plugin.get("data")
+        selected_spools = data.get("selectedSpools") if isinstance(data, dict) else None
+        if isinstance(selected_spools, list):
+            self.set_selection(selected_spools)
+        else:
+            # most SpoolManager messages only say that something changed
+            self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Load the selected spools in the background, requests made while one is running are merged into one
+        """
+        if self.refreshing:
+            self.refresh_pending = True
+            return
+        self.refreshing = True
+        self.tasks.start(lambda _: self.load_selection(self.url, self.api_key), on_finished=self.refreshed,
+                         on_failed=lambda e: self.refreshed((None, str(e))))
+
+    def refreshed(self, result: tuple[Union[list, None], Union[str, None]]) -> None:
+        self.refreshing = False
+        selection, error = result
+        if selection is not None:
+            self.set_selection(selection)
+        elif self.running:
+            self.status_changed.emit(error)
+        if self.refresh_pending:
+            self.refresh_pending = False
+            self.refresh()
+
+    def set_selection(self, selection: list) -> None:
+        """
+        Store the selected spools and tell the window if they changed
+        :param selection: the spool record of each extruder
+        """
+        if selection != self.selection:
+            self.selection = selection
+            self.selection_changed.emit(selection)
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import threading
+import traceback
+from typing import Any, Callable, Union
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class task_signals(QObject):
+    """
+    The signals of a task, they are emitted from the worker thread and delivered on the GUI thread
+    """
+    # object instead of int so byte counts of files over 2 GB don't overflow
+    progress = pyqtSignal(object, object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+
+
+class task(QRunnable):
+    """
+    A cancellable background job run on a QThreadPool.
+    The job function is called with the task as its first argument so it can report progress and check for
+    cancellation
+    """
+
+    def __init__(self, fn: Callable[..., Any], *args: Any, **kwargs: Any):
+        """
+        :param fn: the job function, called as fn(task, *args, **kwargs)
+        """
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = task_signals()
+        self._cancelled = threading.Event()
+        # the runnable is owned by python, not deleted by the pool when it finishes
+        self.setAutoDelete(False)
+
+    def cancel(self) -> None:
+        """
+        Ask the job to stop, the result of a cancelled job is never delivered
+        """
+        self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        """
+        :return: True if cancel was called
+        """
+        return self._cancelled.is_set()
+
+    def report_progress(self, done: int, total: int) -> None:
+        """
+        Report the progress of the job, safe to call from the worker thread
+        :param done: the amount of work done
+        :param total: the total amount of work
+        """
+        self.signals.progress.emit(done, total)
+
+    def run(self) -> None:
+        try:
+            result = self.fn(self, *self.args, **self.kwargs)
+        except Exception as e:
+            if self.is_cancelled():
+                self.signals.cancelled.emit()
+            else:
+                traceback.print_exc()
+                self.signals.failed.emit(e)
+            return
+        if self.is_cancelled():
+            self.signals.cancelled.emit()
+        else:
+            self.signals.finished.emit(result)
+
+
+class task_runner(QObject):
+    """
+    Runs tasks on a thread pool and keeps track of them so they can be cancelled together
+    """
+
+    def __init__(self, parent: Union[QObject, None] = None, max_threads: Union[int, None] = None):
+        """
+        :param parent: the owner of the runner
+        :param max_threads: the maximum number of tasks run at once, defaults to the Qt default
+        """
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_threads is not None:
+            self.pool.setMaxThreadCount(max_threads)
+        self.tasks: set[task] = set()
+
+    def start(self, fn: Callable[..., Any], *args: Any, on_finished: Union[Callable[[Any], None], None] = None,
+              on_failed: Union[Callable[[Exception], None], None] = None,
+              on_progress: Union[Callable[[int, int], None], None] = None,
+              on_cancelled: Union[Callable[[], None], None] = None, **kwargs: Any) -> task:
+        """
+        Run a job in the background, the callbacks are called on the GUI thread
+        :param fn: the job function, called as fn(task, *args, **kwargs)
+        :param on_finished: called with the return value of the job
+        :param on_failed: called with the exception the job raised
+        :param on_progress: called with the amount of work done and the total amount of work
+        :param on_cancelled: called when a cancelled job stops
+        :return: the started task
+        """
+        job = task(fn, *args, **kwargs)
+        if on_progress is not None:
+            job.signals.progress.connect(on_progress)
+        for signal, callback in ((job.signals.finished, on_finished), (job.signals.failed, on_failed),
+                                 (job.signals.cancelled, on_cancelled)):
+            if callback is not None:
+                signal.connect(callback)
+        return self.start_task(job)
+
+    def start_task(self, job: task) -> task:
+        """
+        Run a task whose signals are already connected, for callers that need the task in their callbacks
+        :param job: the task
+        :return: the started task
+        """
+        for signal in (job.signals.finished, job.signals.failed, job.signals.cancelled):
+            signal.connect(lambda *_: self.tasks.discard(job))
+        self.tasks.add(job)
+        self.pool.start(job)
+        return job
+
+    def cancel_all(self) -> None:
+        """
+        Cancel every running task
+        """
+        for job in list(self.tasks):
+            job.cancel()
+
+    def wait(self, timeout_ms: int = -1) -> bool:
+        """
+        Wait for the running tasks to stop
+        :param timeout_ms: the maximum time to wait, -1 to wait forever
+        :return: True if every task stopped
+        """
+        return self.pool.waitForDone(timeout_ms)
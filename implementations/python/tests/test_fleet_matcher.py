@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import time
+
+from fleet_matcher import FleetIndex, Printer, load_fleet
+from spool_matcher import Filament
+
+PLA = {"displayName": "Red PLA", "material": "PLA", "color": "#ff0000", "vendor": "Prusament"}
+PETG = {"displayName": "Blue PETG", "material": "PETG", "color": "#0000ff", "vendor": "Prusament"}
+
+
+def test_failed_polls_are_reported_with_their_error():
+    answers = {"http://mk4": ([PLA], None), "http://xl": (None, "Could not connect to OctoPrint: refused")}
+
+    def load_selection(url: str, api_key: str | None) -> tuple[list | None, str | None]:
+        if url == "http://mini":
+            raise OSError("no route to host")
+        return answers[url]
+
+    printers = load_fleet([{"name": "MK4", "url": "http://mk4"}, {"url": "http://xl"},
+                           {"name": "MINI", "url": "http://mini", "api_key": "key"}])
+    index = FleetIndex(printers, load_selection)
+    index.refresh()
+
+    assert printers[2] == Printer("MINI", "http://mini", "key")
+    assert index.errors() == {"http://xl": "Could not connect to OctoPrint: refused", "MINI": "no route to host"}
+    assert [match.printer.name for match in index.match([Filament("pla", (255, 0, 0), "prusament", 5.0)], [""])] \
+        == ["MK4"]
+
+    # a printer that stops answering keeps its last spools and reports the error
+    answers["http://mk4"] = (None, "timed out")
+    answers["http://xl"] = ([PETG], None)
+    index.refresh()
+    assert index.errors() == {"MK4": "timed out", "MINI": "no route to host"}
+    assert {state.printer.name: state.error for state in index.states()} == {"MK4": "timed out", "http://xl": None}
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_background_polling_keeps_the_index_fresh():
+    loaded = {"http://mk4": [PLA]}
+    failures = []
+    polls = []
+
+    def load_selection(url: str, api_key: str | None) -> tuple[list | None, str | None]:
+        polls.append(url)
+        if url not in loaded:
+            return None, "refused"
+        return list(loaded[url]), None
+
+    printers = [Printer("MK4", "http://mk4"), Printer("XL", "http://xl")]
+    with FleetIndex(printers, load_selection, poll_interval=0.02,
+                    on_error=lambda printer, error: failures.append((printer.name, error))) as index:
+        assert index.wait_ready(5)
+        assert index.spools(printers[0]) == (PLA,)
+
+        # the spool is swapped and the other printer comes online, without anyone calling refresh
+        loaded["http://mk4"] = [PETG]
+        loaded["http://xl"] = [PLA]
+        wait_until(lambda: index.spools(printers[0]) == (PETG,) and index.spools(printers[1]) == (PLA,))
+        assert index.errors() == {}
+        thread = index._thread
+
+    assert not thread.is_alive()
+    assert ("XL", "refused") in failures
+    # no poll after the index stopped
+    count = len(polls)
+    time.sleep(0.1)
+    assert len(polls) == count
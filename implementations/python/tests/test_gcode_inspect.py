@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import io
+import json
+
+import gcode_inspect
+
+CONFIG_BLOCK = (b"; prusaslicer_config = begin\n"
+                b"; filament_type = PLA\n"
+                b"; filament_notes = \"%s[sm_name = %s]\"\n"
+                b"; prusaslicer_config = end\n")
+
+
+def test_oversized_file_is_reported_and_the_others_are_still_audited(tmp_path):
+    for name, padding in (("a", b""), ("b", b"x" * (5 * 1024 * 1024)), ("c", b"")):
+        (tmp_path / f"{name}.gcode").write_bytes(b"G1 X1\n" * 100 + CONFIG_BLOCK % (padding, name.encode()))
+    output = io.StringIO()
+
+    errors = gcode_inspect.inspect_files([str(tmp_path)], output, workers=2)
+
+    records = {record["path"].rsplit("/", 1)[-1]: record for record in map(json.loads, output.getvalue().splitlines())}
+    assert errors == 1
+    assert sorted(records) == ["a.gcode", "b.gcode", "c.gcode"]
+    assert set(records["b.gcode"]) == {"path", "error"} and "tail budget" in records["b.gcode"]["error"]
+    assert records["a.gcode"]["sm_name"] == ["a"] and records["c.gcode"]["sm_name"] == ["c"]
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import socket
+import threading
+import time
+
+import pytest
+
+import octoprint_client
+from circuit_breaker import BudgetExceeded, CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def silent_octoprint():
+    """
+    An octoprint that accepts connections and never answers
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}"
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def client_state(monkeypatch):
+    monkeypatch.setattr(octoprint_client, "OCTOPRINT_BREAKER", CircuitBreaker())
+    monkeypatch.setattr(octoprint_client, "REQUESTS_ABORTED", threading.Event())
+    monkeypatch.setattr(octoprint_client, "LATENCY_BUDGET", 0.3)
+
+
+def test_login_gives_up_within_the_budget_then_fails_fast(silent_octoprint):
+    start = time.monotonic()
+    for _ in range(2):
+        with pytest.raises(BudgetExceeded):
+            octoprint_client.octoprint_login(silent_octoprint, "key")
+    assert time.monotonic() - start < 1.5
+
+    start = time.monotonic()
+    with pytest.raises(CircuitOpen):
+        octoprint_client.octoprint_login(silent_octoprint, "key")
+    data, error = octoprint_client.get_spool_manager_response(silent_octoprint, "key")
+    assert data is None and "did not respond recently" in error
+    assert time.monotonic() - start < 0.1
+
+
+def test_aborted_requests_stop_waiting_right_away(silent_octoprint, monkeypatch):
+    monkeypatch.setattr(octoprint_client, "LATENCY_BUDGET", 30.0)
+    errors = []
+
+    def login() -> None:
+        try:
+            octoprint_client.octoprint_login(silent_octoprint, "key")
+        except BudgetExceeded as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=login)
+    thread.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    octoprint_client.abort_requests()
+    thread.join(5)
+
+    assert not thread.is_alive() and len(errors) == 1
+    assert time.monotonic() - start < 0.5
+    # giving up because the program is closing is not held against the host
+    octoprint_client.OCTOPRINT_BREAKER.check(silent_octoprint)
+
+
+def test_selection_is_only_written_when_it_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(octoprint_client, "SELECTION_CACHE_PATH", str(tmp_path / "nfvselection.json"))
+    writes = []
+    monkeypatch.setattr(octoprint_client, "write_json_atomic",
+                        lambda path, data, original=octoprint_client.write_json_atomic:
+                        (writes.append(path), original(path, data)))
+    red, blue = [{"databaseId": 1, "displayName": "Red PLA"}], [{"databaseId": 2, "displayName": "Blue PETG"}]
+
+    for _ in range(3):
+        octoprint_client.save_last_selection("http://printer/", red)
+    first = octoprint_client.load_last_selection("http://printer")
+    octoprint_client.save_last_selection("http://printer", blue)
+    octoprint_client.save_last_selection("http://other", blue)
+
+    assert len(writes) == 3
+    assert first["selectedSpools"] == red
+    assert octoprint_client.load_last_selection("http://printer")["selectedSpools"] == blue
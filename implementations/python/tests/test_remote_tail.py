@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import pytest
+
+import postprocessor
+from remote_tail import RemoteTailReader
+
+CONFIG_BLOCK = (b"; prusaslicer_config = begin\n"
+                b"; filament_type = PLA;PETG\n"
+                b"; filament_notes = \"[sm_name = Red PLA]\";\"[sm_name = Blue PETG]\"\n"
+                b"; prusaslicer_config = end\n")
+
+
+class FakeOctoPrint:
+    """
+    A local stand-in for the OctoPrint file api, serving suffix byte ranges of in-memory files
+    """
+
+    def __init__(self, files: dict[str, bytes], honor_ranges: bool = True):
+        self.files = files
+        self.honor_ranges = honor_ranges
+        # (path, Range header) of every download request
+        self.requests: list[tuple[str, str | None]] = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                fake.handle(self)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def handle(self, request: BaseHTTPRequestHandler) -> None:
+        path = unquote(urlsplit(request.path).path)
+        if path == "/api/files/local":
+            folders = sorted({name.rsplit("/", 1)[0] for name in self.files if "/" in name})
+            entries = [{"type": "machinecode", "path": name} for name in self.files if "/" not in name]
+            entries += [{"type": "folder", "children": [{"type": "machinecode", "path": name}
+                                                        for name in self.files if name.startswith(folder + "/")]}
+                        for folder in folders]
+            return self.send(request, 200, json.dumps({"files": entries}).encode())
+        prefix = "/downloads/files/local/"
+        name = path[len(prefix):]
+        if not path.startswith(prefix) or name not in self.files:
+            return self.send(request, 404, b"not found")
+        data = self.files[name]
+        range_header = request.headers.get("Range")
+        self.requests.append((name, range_header))
+        match = re.fullmatch(r"bytes=-(\d+)", range_header or "")
+        if not self.honor_ranges or match is None:
+            return self.send(request, 200, data)
+        if not data:
+            return self.send(request, 416, b"", {"Content-Range": "bytes */0"})
+        start = max(0, len(data) - int(match.group(1)))
+        self.send(request, 206, data[start:], {"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"})
+
+    @staticmethod
+    def send(request: BaseHTTPRequestHandler, status: int, body: bytes, headers: dict[str, str] | None = None) -> None:
+        request.send_response(status)
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def octoprint():
+    servers = []
+
+    def start(files: dict[str, bytes], honor_ranges: bool = True) -> FakeOctoPrint:
+        server = FakeOctoPrint(files, honor_ranges)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def gcode(moves: int) -> bytes:
+    return b"G1 X1 Y1\n" * moves + CONFIG_BLOCK
+
+
+def test_reads_only_the_tail(octoprint):
+    server = octoprint({"print.gcode": gcode(100_000)})
+    with RemoteTailReader(server.url, initial_window=4096) as reader:
+        record = reader.inspect("print.gcode")
+    assert record["sm_name"] == ["Red PLA", "Blue PETG"]
+    assert record["filament_type"] == ["PLA", "PETG"]
+    assert record["bytes_transferred"] == 4096
+    assert server.requests == [("print.gcode", "bytes=-4096")]
+
+
+def test_window_doubles_until_the_config_block(octoprint):
+    # 40 KB of settings after the marker, so the 8 and 16 KB windows miss it
+    data = gcode(10_000).replace(b"; prusaslicer_config = end", b"; long_setting = " + b"x" * 40_000 +
+                                 b"\n; prusaslicer_config = end")
+    server = octoprint({"print.gcode": data})
+    with RemoteTailReader(server.url, initial_window=8192, num_lines=10_000) as reader:
+        tail, transferred = reader.read_tail("print.gcode")
+    assert [header for _, header in server.requests] == ["bytes=-8192", "bytes=-16384", "bytes=-32768",
+                                                         "bytes=-65536"]
+    assert transferred == 8192 + 16384 + 32768 + 65536
+    assert "; prusaslicer_config = begin" in tail
+    # the window started in the middle of a line, the partial line is dropped
+    assert tail.startswith("G1 X1 Y1\n")
+
+
+def test_window_stops_growing_at_the_max_window(octoprint):
+    server = octoprint({"print.gcode": b"G1 X1 Y1\n" * 100_000})
+    with RemoteTailReader(server.url, initial_window=1024, max_window=8192, num_lines=100_000) as reader:
+        tail, _ = reader.read_tail("print.gcode")
+    assert [header for _, header in server.requests] == ["bytes=-1024", "bytes=-2048", "bytes=-4096", "bytes=-8192"]
+    assert tail.startswith("G1") and len(tail) <= 8192
+
+
+def test_window_stops_growing_once_it_holds_enough_lines(octoprint):
+    server = octoprint({"print.gcode": b"G1 X1 Y1\n" * 100_000})
+    with RemoteTailReader(server.url, initial_window=1024, num_lines=200) as reader:
+        tail, _ = reader.read_tail("print.gcode")
+    assert len(server.requests) == 2
+    assert tail.count("\n") > 200
+
+
+def test_summary_before_a_marker_at_the_window_boundary_is_read(octoprint, tmp_path):
+    # PrusaSlicer writes the filament used summary right before the config block
+    summary = (b"M84 ; disable motors\n"
+               b"; filament used [mm] = 1234.50, 678.90\n"
+               b"; filament used [cm3] = 2.97, 1.63\n"
+               b"; filament used [g] = 3.68, 2.08\n"
+               b"; total filament used [g] = 5.76\n"
+               b"; estimated printing time (normal mode) = 1h 2m 3s\n"
+               b"\n")
+    data = b"G1 X1 Y1\n" * 10_000 + summary + CONFIG_BLOCK
+    server = octoprint({"print.gcode": data})
+    local = tmp_path / "print.gcode"
+    local.write_bytes(data)
+
+    # the first window starts exactly at the marker
+    with RemoteTailReader(server.url, initial_window=len(CONFIG_BLOCK)) as reader:
+        record = reader.inspect("print.gcode")
+
+    assert len(server.requests) > 1
+    expected = postprocessor.get_filament_metadata(postprocessor.parse_gcode(str(local)))
+    assert expected["filament_used_g"] == [3.68, 2.08]
+    assert {key: value for key, value in record.items() if key not in ("path", "bytes_transferred")} == expected
+
+
+def test_small_file_is_read_whole(octoprint):
+    data = gcode(10)
+    server = octoprint({"print.gcode": data})
+    with RemoteTailReader(server.url) as reader:
+        tail, transferred = reader.read_tail("print.gcode")
+    assert tail == data.decode()
+    assert transferred == len(data)
+
+
+def test_empty_file_answers_416(octoprint):
+    server = octoprint({"empty.gcode": b""})
+    with RemoteTailReader(server.url) as reader:
+        assert reader.read_tail("empty.gcode") == ("", 0)
+        record = reader.inspect("empty.gcode")
+    assert record["extruders"] == 0 and "error" not in record
+
+
+def test_server_without_range_support_sends_the_whole_file(octoprint):
+    data = gcode(1000)
+    server = octoprint({"print.gcode": data}, honor_ranges=False)
+    with RemoteTailReader(server.url, initial_window=1024) as reader:
+        tail, transferred = reader.read_tail("print.gcode")
+    assert len(server.requests) == 1
+    assert transferred == len(data)
+    assert tail == data.decode()
+
+
+def test_missing_file_is_an_error_record(octoprint):
+    server = octoprint({})
+    with RemoteTailReader(server.url) as reader:
+        record = reader.inspect("missing.gcode")
+    assert record["path"] == "missing.gcode"
+    assert "404" in record["error"]
+
+
+def test_unreachable_printer_is_an_error_record(octoprint):
+    server = octoprint({})
+    url = server.url
+    server.close()
+    with RemoteTailReader(url, timeout=2) as reader:
+        record = reader.inspect("print.gcode")
+    assert record["path"] == "print.gcode" and record["error"]
+
+
+def test_inspect_files_lists_every_file_in_order(octoprint):
+    server = octoprint({"b.gcode": gcode(10), "folder/a b.gcode": gcode(10), "empty.gcode": b""})
+    with RemoteTailReader(server.url, max_connections=4) as reader:
+        records = list(reader.inspect_files())
+    assert [record["path"] for record in records] == ["b.gcode", "empty.gcode", "folder/a b.gcode"]
+    assert records[2]["sm_name"] == ["Red PLA", "Blue PETG"]
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import json
+import threading
+
+from file_lock import locked
+from settings_store import SettingsStore, write_json_atomic
+
+
+def test_flush_waits_for_another_writer_and_merges_its_changes(tmp_path):
+    path = str(tmp_path / "nfvsettings.json")
+    write_json_atomic(path, {"theme": "dark", "url": "http://old"})
+    store = SettingsStore(path, debounce=60)
+    store.load()["url"] = "http://new"
+    store.save()
+
+    # another instance holds the lock while it rewrites the file
+    with locked(path):
+        flush = threading.Thread(target=store.flush)
+        flush.start()
+        flush.join(0.2)
+        assert flush.is_alive()
+        with open(path, 'r') as file:
+            other = json.load(file)
+        other["theme"] = "light"
+        write_json_atomic(path, other)
+    flush.join(5)
+
+    assert not flush.is_alive()
+    with open(path, 'r') as file:
+        assert json.load(file) == {"theme": "light", "url": "http://new", "settings version": 1}
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from spool_matcher import MAX_CANDIDATES, Filament, SpoolCatalog
+
+
+def spool(index: int, material: str = "PLA", color: str | None = "#ff0000", vendor: str = "Prusament",
+          remaining: float = 1000) -> dict:
+    return {"databaseId": index, "displayName": f"Spool {index}", "material": material, "color": color,
+            "vendor": vendor, "remainingWeight": remaining}
+
+
+def test_extruders_sharing_a_filament_all_get_a_spool():
+    catalog = SpoolCatalog([spool(i) for i in range(40)])
+    filament = Filament("pla", (255, 0, 0), "prusament", 10.0)
+
+    matches = catalog.assign([filament] * (MAX_CANDIDATES * 2))
+
+    assert all(match.spool is not None for match in matches)
+    assert len({match.spool["databaseId"] for match in matches}) == MAX_CANDIDATES * 2
+    assert not any(match.review for match in matches)
+
+
+def test_spool_of_another_material_is_never_proposed():
+    catalog = SpoolCatalog([spool(1, "PLA"), spool(2, "PETG")])
+
+    matches = catalog.assign([Filament("petg", (255, 0, 0), "prusament", 10.0),
+                              Filament("petg", (255, 0, 0), "prusament", 10.0)])
+
+    assert sorted(match.spool["databaseId"] if match.spool else 0 for match in matches) == [0, 2]
+
+
+def test_poor_fit_and_unknown_material_are_flagged():
+    catalog = SpoolCatalog([spool(1, color="#000000", vendor="Other"), spool(2, "PETG", color="#00ff00")])
+
+    poor, unknown = catalog.assign([Filament("pla", (255, 255, 255), "prusament", 10.0),
+                                    Filament("", (0, 255, 0), "", None)])
+
+    assert poor.spool["databaseId"] == 1 and poor.review
+    assert unknown.spool["databaseId"] == 2 and unknown.review
+
+
+@pytest.mark.parametrize("filament", [Filament("", None, "", None), Filament("", None, "prusament", 10.0)])
+def test_nothing_to_match_on_proposes_nothing(filament):
+    catalog = SpoolCatalog([spool(i) for i in range(10)])
+
+    assert catalog.candidates(filament) == []
+    assert catalog.assign([filament])[0].spool is None
+
+
+def test_extruder_without_color_does_not_scan_the_catalog():
+    catalog = SpoolCatalog([spool(i, color=None, vendor=f"Vendor {i % 100}") for i in range(50_000)])
+    costs = []
+    cost = catalog.cost
+    catalog.cost = lambda filament, index: costs.append(index) or cost(filament, index)
+
+    start = time.perf_counter()
+    candidates = catalog.candidates(Filament("pla", None, "vendor 7", 10.0))
+    elapsed = time.perf_counter() - start
+
+    assert len(costs) < 1000
+    assert all(catalog.vendors[index] == "vendor 7" for _, index in candidates)
+    assert elapsed < 0.05
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+import pytest
+from PyQt6.QtCore import QCoreApplication
+
+import spool_subscription as subscription_module
+from spool_subscription import spool_subscription
+from task_runner import task_runner
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+RED = {"databaseId": 1, "displayName": "Red PLA"}
+BLUE = {"databaseId": 2, "displayName": "Blue PETG"}
+
+
+class PushConnection:
+    """
+    One client of the fake push socket, a minimal server side of the websocket protocol
+    """
+
+    def __init__(self, request: BaseHTTPRequestHandler):
+        self.request = request
+        self.lock = threading.Lock()
+        # the text messages the client sent
+        self.received: list[str] = []
+        self.closed = threading.Event()
+
+    def send(self, message: Any) -> None:
+        payload = json.dumps(message).encode()
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        else:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+        with self.lock:
+            self.request.wfile.write(header + payload)
+
+    def close(self) -> None:
+        with self.lock:
+            try:
+                self.request.wfile.write(struct.pack("!BB", 0x88, 0))
+            except OSError:
+                pass
+        self.closed.set()
+
+    def serve(self) -> None:
+        while not self.closed.is_set():
+            header = self.request.rfile.read(2)
+            if len(header) < 2:
+                break
+            opcode = header[0] & 0x0f
+            length = header[1] & 0x7f
+            if length == 126:
+                length = struct.unpack("!H", self.request.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.request.rfile.read(8))[0]
+            mask = self.request.rfile.read(4) if header[1] & 0x80 else b"\0\0\0\0"
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(self.request.rfile.read(length)))
+            if opcode == 0x1:
+                self.received.append(payload.decode())
+            elif opcode == 0x8:
+                break
+        self.closed.set()
+
+
+class FakeOctoPrint:
+    """
+    A local stand-in for the OctoPrint login api and push socket
+    """
+
+    def __init__(self):
+        # the number of logins answered with an error before they succeed again
+        self.failing_logins = 0
+        self.logins = 0
+        self.connections: list[PushConnection] = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # the websocket upgrade needs http/1.1
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                fake.login(self)
+
+            def do_GET(self) -> None:
+                fake.push_socket(self)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def login(self, request: BaseHTTPRequestHandler) -> None:
+        request.rfile.read(int(request.headers.get("Content-Length", 0)))
+        if request.path != "/api/login" or self.failing_logins > 0:
+            self.failing_logins -= 1
+            body = b"unavailable"
+            request.send_response(503)
+        else:
+            self.logins += 1
+            body = json.dumps({"name": "pi", "session": f"session-{self.logins}"}).encode()
+            request.send_response(200)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def push_socket(self, request: BaseHTTPRequestHandler) -> None:
+        if request.path != "/sockjs/websocket":
+            request.send_response(404)
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+        accept = base64.b64encode(hashlib.sha1((request.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode())
+                                  .digest()).decode()
+        request.send_response(101)
+        request.send_header("Upgrade", "websocket")
+        request.send_header("Connection", "Upgrade")
+        request.send_header("Sec-WebSocket-Accept", accept)
+        request.end_headers()
+        request.wfile.flush()
+        connection = PushConnection(request)
+        self.connections.append(connection)
+        connection.serve()
+        request.close_connection = True
+
+    def drop_connections(self) -> None:
+        for connection in self.connections:
+            connection.close()
+
+    def close(self) -> None:
+        self.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def app() -> QCoreApplication:
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+@pytest.fixture
+def octoprint():
+    server = FakeOctoPrint()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def subscribe(app, octoprint, monkeypatch):
+    monkeypatch.setattr(subscription_module, "MIN_RECONNECT_DELAY", 0.05)
+    monkeypatch.setattr(subscription_module, "MAX_RECONNECT_DELAY", 0.2)
+    subscriptions = []
+
+    def start(selection: list) -> tuple[spool_subscription, list, list, list]:
+        """
+        :param selection: the spools the stand-in's SpoolManager has selected, returned by every refresh
+        :return: the subscription, the selections it emitted, its status messages and one entry per refresh
+        """
+        refreshes = []
+
+        def load_selection(url: str, api_key: str | None) -> tuple[list, None]:
+            refreshes.append(url)
+            return list(selection), None
+
+        subscription = spool_subscription(octoprint.url, "key", task_runner(), load_selection)
+        emitted, statuses = [], []
+        subscription.selection_changed.connect(emitted.append)
+        subscription.status_changed.connect(statuses.append)
+        subscriptions.append(subscription)
+        subscription.start()
+        return subscription, emitted, statuses, refreshes
+
+    yield start
+    for subscription in subscriptions:
+        subscription.stop()
+        subscription.tasks.wait(5000)
+
+
+def wait_until(app: QCoreApplication, condition: Callable[[], Any], timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def authenticated(octoprint: FakeOctoPrint, connections: int) -> Callable[[], bool]:
+    return lambda: len(octoprint.connections) >= connections and bool(octoprint.connections[connections - 1].received)
+
+
+def test_pushed_selection_is_delivered(app, octoprint, subscribe):
+    subscription, emitted, _, _ = subscribe([RED])
+    wait_until(app, authenticated(octoprint, 1))
+
+    assert json.loads(octoprint.connections[0].received[0]) == {"auth": "pi:session-1"}
+    wait_until(app, lambda: emitted == [[RED]])
+
+    octoprint.connections[0].send({"plugin": {"plugin": "SpoolManager", "data": {"selectedSpools": [BLUE]}}})
+    wait_until(app, lambda: emitted == [[RED], [BLUE]])
+    # messages of other plugins are ignored
+    octoprint.connections[0].send({"plugin": {"plugin": "other", "data": {"selectedSpools": [RED]}}})
+    octoprint.connections[0].send({"current": {}})
+    octoprint.connections[0].send({"plugin": {"plugin": "SpoolManager", "data": {"selectedSpools": [BLUE, RED]}}})
+    wait_until(app, lambda: len(emitted) == 3)
+    assert emitted[-1] == [BLUE, RED]
+
+
+def test_change_notice_refreshes_the_selection(app, octoprint, subscribe):
+    selection = [RED]
+    subscription, emitted, _, refreshes = subscribe(selection)
+    wait_until(app, lambda: authenticated(octoprint, 1)() and emitted == [[RED]] and not subscription.refreshing)
+    count = len(refreshes)
+
+    selection[:] = [BLUE]
+    octoprint.connections[0].send({"plugin": {"plugin": "SpoolManager", "data": {"type": "spoolsChanged"}}})
+
+    wait_until(app, lambda: emitted == [[RED], [BLUE]])
+    assert len(refreshes) == count + 1
+
+
+def test_dropped_connection_resubscribes_and_catches_up(app, octoprint, subscribe):
+    selection = [RED]
+    subscription, emitted, statuses, refreshes = subscribe(selection)
+    wait_until(app, lambda: authenticated(octoprint, 1)() and emitted == [[RED]] and not subscription.refreshing)
+    count = len(refreshes)
+
+    # the spools change while the socket is down
+    selection[:] = [BLUE]
+    octoprint.drop_connections()
+
+    wait_until(app, authenticated(octoprint, 2))
+    assert octoprint.logins == 2
+    assert json.loads(octoprint.connections[1].received[0]) == {"auth": "pi:session-2"}
+    wait_until(app, lambda: emitted == [[RED], [BLUE]])
+    assert len(refreshes) > count
+    assert any("retrying" in status for status in statuses)
+
+    octoprint.connections[1].send({"plugin": {"plugin": "SpoolManager", "data": {"selectedSpools": [RED]}}})
+    wait_until(app, lambda: emitted[-1] == [RED])
+
+
+def test_failed_logins_back_off_until_the_server_answers(app, octoprint, subscribe):
+    octoprint.failing_logins = 4
+    subscription, _, statuses, _ = subscribe([RED])
+
+    wait_until(app, authenticated(octoprint, 1))
+    assert len([status for status in statuses if "retrying" in status]) == 4
+    assert subscription.reconnect_delay == subscription_module.MIN_RECONNECT_DELAY
+    assert octoprint.logins == 1
+
+
+def test_backoff_delay_doubles_up_to_the_maximum(app, monkeypatch, subscribe):
+    octoprint_down = "http://127.0.0.1:9"
+    monkeypatch.setattr(subscription_module, "MIN_RECONNECT_DELAY", 0.01)
+    delays = []
+    monkeypatch.setattr(spool_subscription, "connection_failed",
+                        lambda self, error, original=spool_subscription.connection_failed:
+                        (delays.append(self.reconnect_delay), original(self, error)))
+    subscription = spool_subscription(octoprint_down, None, task_runner(), lambda url, api_key: ([], None))
+    subscription.start()
+    try:
+        wait_until(app, lambda: len(delays) >= 6)
+    finally:
+        subscription.stop()
+        subscription.tasks.wait(5000)
+
+    assert delays[:6] == [0.01, 0.02, 0.04, 0.08, 0.16, 0.2]
+
+
+def test_reauth_required_logs_in_again(app, octoprint, subscribe):
+    subscription, _, _, _ = subscribe([RED])
+    wait_until(app, authenticated(octoprint, 1))
+
+    octoprint.connections[0].send({"reauthRequired": {"reason": "stale"}})
+
+    wait_until(app, authenticated(octoprint, 2))
+    assert octoprint.logins == 2
+    assert json.loads(octoprint.connections[1].received[0]) == {"auth": "pi:session-2"}
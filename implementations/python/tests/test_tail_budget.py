@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import tracemalloc
+from typing import Any, Callable
+
+import pytest
+
+import postprocessor
+
+CONFIG_BLOCK = (b"; prusaslicer_config = begin\n"
+                b"; filament_type = PLA\n"
+                b"; filament_notes = \"%s[sm_name = Old Spool]\"\n"
+                b"; prusaslicer_config = end\n")
+
+
+def write_gcode(path, notes_padding: bytes = b"", long_line: bytes = b"") -> bytes:
+    data = b"G1 X1 Y1\n" * 1000 + long_line + CONFIG_BLOCK % notes_padding
+    path.write_bytes(data)
+    return data
+
+
+# what reading a tail may use on top of its byte budget: the read chunks and the bookkeeping
+BUDGET_SLACK = 64 * 1024
+
+
+def peak_memory(read: Callable[[], Any]) -> tuple[Any, int]:
+    tracemalloc.start()
+    try:
+        result = read()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def test_long_lines_are_read_within_the_memory_budget(tmp_path):
+    gcode = tmp_path / "thumbnail.gcode"
+    long_line = b"; thumbnail = " + b"A" * (32 * 1024 * 1024) + b"\n"
+    data = write_gcode(gcode, long_line=long_line)
+    del long_line
+    del data
+
+    tail, peak = peak_memory(lambda: postprocessor.read_gcode_tail(str(gcode), 1000, max_bytes=1024 * 1024,
+                                                                   max_line_bytes=64 * 1024))
+    assert peak < 1024 * 1024 + BUDGET_SLACK
+    assert len(tail.skipped) == 1
+    assert postprocessor.get_spools(tail.data.decode()) == {1: "Old Spool"}
+
+
+@pytest.mark.parametrize("max_bytes,max_line_bytes", [(1024 * 1024, 64 * 1024), (64 * 1024, 16 * 1024),
+                                                      (64 * 1024, 64 * 1024)])
+def test_lines_near_the_limit_are_read_within_the_memory_budget(tmp_path, max_bytes, max_line_bytes):
+    gcode = tmp_path / "long_lines.gcode"
+    # lines just short of being skipped, enough of them to fill the budget twice over
+    line = b";" + b"A" * (max_line_bytes - 2) + b"\n"
+    write_gcode(gcode, long_line=line * (2 * max_bytes // max_line_bytes + 4))
+
+    tail, peak = peak_memory(lambda: postprocessor.read_gcode_tail(str(gcode), 1000, max_bytes=max_bytes,
+                                                                   max_line_bytes=max_line_bytes))
+    assert peak < max_bytes + BUDGET_SLACK
+    assert max_bytes - max_line_bytes < len(tail.data) <= max_bytes
+    assert not tail.skipped
+    assert postprocessor.get_spools(tail.data.decode()) == {1: "Old Spool"}
+
+
+def test_skipped_lines_are_copied_back_unchanged(tmp_path):
+    gcode = tmp_path / "thumbnail.gcode"
+    long_line = b"; thumbnail = " + b"A" * (1024 * 1024) + b"\n"
+    data = write_gcode(gcode, long_line=long_line)
+    postprocessor.main(str(gcode), json_data=[{"sm_name": "New Spool"}])
+    edited = gcode.read_bytes()
+    assert long_line in edited
+    assert edited.endswith(CONFIG_BLOCK.replace(b"Old Spool", b"New Spool") % b"")
+    assert len(edited) == len(data) - len(b"Old Spool") + len(b"New Spool") + len(postprocessor.EDITED_HEADER)
+
+
+def test_long_filament_notes_are_kept_and_edited(tmp_path):
+    gcode = tmp_path / "notes.gcode"
+    padding = b"n" * (postprocessor.TAIL_MAX_LINE_BYTES * 2)
+    write_gcode(gcode, notes_padding=padding)
+    tail = postprocessor.read_gcode_tail(str(gcode), 1000)
+    assert tail.skipped == ()
+    assert postprocessor.get_spools(tail.data.decode()) == {1: "Old Spool"}
+
+    postprocessor.main(str(gcode), json_data=[{"sm_name": "New Spool"}])
+    assert gcode.read_bytes().endswith(CONFIG_BLOCK.replace(b"Old Spool", b"New Spool") % padding)
+
+
+def test_filament_notes_over_the_tail_budget_are_an_error(tmp_path):
+    gcode = tmp_path / "notes.gcode"
+    data = write_gcode(gcode, notes_padding=b"n" * (2 * 1024 * 1024))
+    with pytest.raises(postprocessor.TailBudgetExceeded):
+        postprocessor.read_gcode_tail(str(gcode), 1000, max_bytes=1024 * 1024, max_line_bytes=64 * 1024)
+
+    max_bytes = postprocessor.TAIL_MAX_BYTES
+    postprocessor.set_tail_budget(1024 * 1024)
+    try:
+        with pytest.raises(postprocessor.TailBudgetExceeded):
+            postprocessor.main(str(gcode), json_data=[{"sm_name": "New Spool"}])
+    finally:
+        postprocessor.set_tail_budget(max_bytes)
+    assert gcode.read_bytes() == data
+
+
+def test_short_notes_that_do_not_fit_are_an_error(tmp_path):
+    gcode = tmp_path / "notes.gcode"
+    write_gcode(gcode, notes_padding=b"n" * 1000)
+    with pytest.raises(postprocessor.TailBudgetExceeded):
+        postprocessor.read_gcode_tail(str(gcode), 1000, max_bytes=1024)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+import postprocessor
+import undo_journal
+
+CONFIG_BLOCK = (b"; prusaslicer_config = begin\n"
+                b"; filament_type = PLA\n"
+                b"; filament_notes = \"[sm_name = Old Spool]\"\n"
+                b"; prusaslicer_config = end\n")
+
+
+def write_gcode(path, long_line: bytes = b"") -> bytes:
+    data = b"G1 X1 Y1\n" * 1000 + long_line + CONFIG_BLOCK
+    path.write_bytes(data)
+    return data
+
+
+def test_failed_replace_leaves_no_journal_entry(tmp_path, monkeypatch):
+    gcode = tmp_path / "print.gcode"
+    data = write_gcode(gcode)
+
+    def fail_replace(source: str, destination: str) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(postprocessor.os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        postprocessor.main(str(gcode), json_data=[{"sm_name": "New Spool"}], undo=True)
+
+    assert gcode.read_bytes() == data
+    assert undo_journal.read_entries(str(gcode)) == []
+    assert not os.path.exists(undo_journal.journal_path(str(gcode)))
+
+
+@pytest.mark.parametrize("keep_header", [False, True])
+@pytest.mark.parametrize("long_line", [b"", b"; thumbnail = " + b"A" * (64 * 1024) + b"\n"])
+def test_undo_restores_the_original_through_a_replace(tmp_path, monkeypatch, keep_header, long_line):
+    monkeypatch.setattr(postprocessor, "TAIL_MAX_LINE_BYTES", 16 * 1024)
+    gcode = tmp_path / "print.gcode"
+    data = write_gcode(gcode, long_line)
+    postprocessor.main(str(gcode), json_data=[{"sm_name": "New Spool"}], undo=True)
+    assert b"[sm_name = New Spool]" in gcode.read_bytes()
+    replaced = []
+    monkeypatch.setattr(undo_journal.os, "replace",
+                        lambda source, destination, original=os.replace:
+                        (replaced.append(destination), original(source, destination)))
+
+    undo_journal.undo(str(gcode), keep_header)
+
+    # the file is never written in place, even when only the tail changes
+    assert replaced[0] == str(gcode)
+    expected = postprocessor.EDITED_HEADER + data if keep_header else data
+    assert gcode.read_bytes() == expected
+    assert undo_journal.read_entries(str(gcode)) == []
+    with pytest.raises(undo_journal.UndoError):
+        undo_journal.undo(str(gcode))
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+
+from file_lock import locked
+from settings_store import fsync_directory
+
+JOURNAL_DIRNAME = ".nvf_undo"
+# the journal of a file is compacted to the newest edits that fit in these limits
+MAX_ENTRIES = 10
+MAX_JOURNAL_BYTES = 16 * 1024 * 1024
+
+
+class UndoError(Exception):
+    """
+    Raised when an edit can't be undone
+    """
+
+
+def journal_path(gcode_path: str) -> str:
+    """
+    Get the path of the undo journal of a gcode file
+    :param gcode_path: the path to the gcode file
+    :return: the path to the journal
+    """
+    directory, file_name = os.path.split(os.path.abspath(gcode_path))
+    return os.path.join(directory, JOURNAL_DIRNAME, file_name + ".journal")
+
+
+def record_edit(gcode_path: str, original_tail: bytes, offset: int, header: bytes, new_tail_length: int,
+                new_tail_sha256: str, skipped: list[tuple[int, int]] = ()) -> None:
+    """
+    Add an edit to the journal of a gcode file, this is done once the edited file has replaced the original so the
+    journal never describes an edit that didn't happen
+    :param gcode_path: the path to the gcode file
+    :param original_tail: the tail bytes the edit replaces, lines too long to keep in memory are markers
+    :param offset: where the tail starts in the original file
+    :param header: the header line the edit inserts at the start of the file, empty if it inserts none
+    :param new_tail_length: the length of the tail the edit writes
+    :param new_tail_sha256: the sha256 hex digest of the tail the edit writes
+    :param skipped: the spans of the lines replaced by markers, relative to the start of the tail the edit writes
+    """
+    new_offset = offset + len(header)
+    meta = {
+        "offset": offset,
+        "header_inserted": bool(header),
+        "header_length": len(header),
+        "tail_length": len(original_tail),
+        "skipped": [list(span) for span in skipped],
+        "fingerprint": {
+            "size": new_offset + new_tail_length,
+            "tail_offset": new_offset,
+            "tail_sha256": new_tail_sha256,
+        },
+    }
+    entries = read_entries(gcode_path)
+    entries.append((meta, original_tail))
+    write_entries(gcode_path, compact(entries))
+
+
+def undo(gcode_path: str, keep_header: bool = False) -> None:
+    """
+    Revert the last journaled edit of a gcode file by splicing the original tail back in.
+    The file is rewritten through a temp file that replaces it, so a crash leaves either the edited or the original file
+    :param gcode_path: the path to the gcode file
+    :param keep_header: leave the header line of the edit in the file
+    """
+    with locked(gcode_path):
+        entries = read_entries(gcode_path)
+        if not entries:
+            raise UndoError(f"There is no edit to undo for {gcode_path}")
+        meta, original_tail = entries[-1]
+        fingerprint = meta["fingerprint"]
+        if not matches_fingerprint(gcode_path, fingerprint):
+            raise UndoError(f"{gcode_path} was changed after the last edit, it can't be undone")
+
+        tail_offset = fingerprint["tail_offset"]
+        skipped = [(tail_offset + start, tail_offset + end) for start, end in meta.get("skipped", ())]
+        header_length = meta["header_length"] if meta["header_inserted"] and not keep_header else 0
+        _rewrite(gcode_path, header_length, tail_offset, original_tail, tuple(skipped))
+        write_entries(gcode_path, entries[:-1])
+
+
+def matches_fingerprint(gcode_path: str, fingerprint: dict[str, Any]) -> bool:
+    """
+    Check that a file is still the way an edit left it, only the tail written by the edit is hashed
+    :param gcode_path: the path to the gcode file
+    :param fingerprint: the fingerprint recorded with the edit
+    :return: True if the file matches
+    """
+    if os.path.getsize(gcode_path) != fingerprint["size"]:
+        return False
+    digest = hashlib.sha256()
+    with open(gcode_path, 'rb') as file:
+        file.seek(fingerprint["tail_offset"])
+        for chunk in iter(lambda: file.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest() == fingerprint["tail_sha256"]
+
+
+def _rewrite(gcode_path: str, header_length: int, tail_offset: int, original_tail: bytes,
+             skipped: tuple[tuple[int, int], ...]) -> None:
+    """
+    Rewrite a file through a temp file without its first header_length bytes and with the original tail, the skipped
+    lines of the tail are copied from their spans in the current file
+    """
+    # imported here because postprocessor imports this module
+    import postprocessor
+
+    directory = os.path.dirname(os.path.abspath(gcode_path))
+    with open(gcode_path, 'rb') as source:
+        with tempfile.NamedTemporaryFile('wb', delete=False, dir=directory) as temp_file:
+            temp_path = temp_file.name
+            try:
+                source.seek(header_length)
+                remaining = tail_offset - header_length
+                while remaining > 0:
+                    chunk = source.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    temp_file.write(chunk)
+                    remaining -= len(chunk)
+                postprocessor.write_tail(temp_file.write, original_tail, skipped,
+                                         lambda pos, size: postprocessor.read_at(source, pos, size))
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            except BaseException:
+                temp_file.close()
+                os.unlink(temp_path)
+                raise
+    os.replace(temp_path, gcode_path)
+    fsync_directory(directory)
+
+
+def compact(entries: list[tuple[dict[str, Any], bytes]]) -> list[tuple[dict[str, Any], bytes]]:
+    """
+    Drop the oldest edits until the journal fits in MAX_ENTRIES and MAX_JOURNAL_BYTES, the newest edit is always kept
+    :param entries: the journal entries, oldest first
+    :return: the kept entries
+    """
+    entries = entries[-MAX_ENTRIES:]
+    size = sum(len(tail) for _, tail in entries)
+    while len(entries) > 1 and size > MAX_JOURNAL_BYTES:
+        size -= len(entries[0][1])
+        entries = entries[1:]
+    return entries
+
+
+def read_entries(gcode_path: str) -> list[tuple[dict[str, Any], bytes]]:
+    """
+    Read the journal of a gcode file
+    :param gcode_path: the path to the gcode file
+    :return: the metadata and original tail of each journaled edit, oldest first
+    """
+    entries = []
+    try:
+        with open(journal_path(gcode_path), 'rb') as file:
+            while True:
+                line = file.readline()
+                if not line:
+                    break
+                meta = json.loads(line)
+                tail = file.read(meta["tail_length"])
+                if len(tail) != meta["tail_length"]:
+                    # a journal cut short by a crash, the incomplete entry is dropped
+                    break
+                entries.append((meta, tail))
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError):
+        raise UndoError(f"The undo journal of {gcode_path} is corrupt")
+    return entries
+
+
+def write_entries(gcode_path: str, entries: list[tuple[dict[str, Any], bytes]]) -> None:
+    """
+    Atomically replace the journal of a gcode file, the journal is removed when there are no entries
+    :param gcode_path: the path to the gcode file
+    :param entries: the metadata and original tail of each journaled edit, oldest first
+    """
+    path = journal_path(gcode_path)
+    directory = os.path.dirname(path)
+    if not entries:
+        _remove_journal(path)
+        return
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', delete=False, dir=directory) as file:
+        temp_path = file.name
+        for meta, tail in entries:
+            file.write(json.dumps(meta).encode('utf-8') + b'\n')
+            file.write(tail)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    fsync_directory(directory)
+
+
+def _remove_journal(path: str) -> None:
+    try:
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+
@@ -2,10 +2,15 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import json
 import os
 import platform
 import shutil
 import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
 
@@ -13,38 +18,198 @@ APP_NAME = "Nozzle Filament Validator Post-Processor"
 BIN_NAME = "nvf_postprocessor"
 DESKTOP_ID = "nvf-postprocessor"
 
+LINUX_ICON_SIZES = (16, 32, 48, 64, 128, 256, 512)
+WINDOWS_ICO_SIZES = (16, 24, 32, 48, 64, 128, 256)
+MACOS_ICNS_SIZE = 1024
+# bump when make_rounded_icon changes so icons rendered by the old code are not reused
+ICON_RENDER_VERSION = 1
+# the inputs of cargo build besides src/, a change to any of them rebuilds the binary
+BUILD_INPUTS = ("Cargo.toml", "Cargo.lock", "build.rs")
+
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Build and install the Rust NVF post-processor.")
     parser.add_argument("--debug", action="store_true", help="Build the debug binary instead of release.")
     parser.add_argument("--build-only", action="store_true", help="Only build, do not install.")
     parser.add_argument("--install-dir", help="Override the platform default install directory.")
+    parser.add_argument("--cache-dir", help="Where built binaries and rendered icons are cached, defaults to "
+                                            "target/nvf-cache in the checkout so machines sharing it share the cache.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Build, render and copy everything even if the inputs did not change.")
     args = parser.parse_args()
 
     rust_dir = Path(__file__).resolve().parent
     implementations_dir = rust_dir.parent
     profile = "debug" if args.debug else "release"
+    cache = AssetCache(Path(args.cache_dir).expanduser() if args.cache_dir else rust_dir / "target" / "nvf-cache",
+                       icon_png(implementations_dir), enabled=not args.no_cache)
 
-    build(rust_dir, args.debug)
+    build(rust_dir, args.debug, cache)
     binary = built_binary(rust_dir, profile)
     if not binary.exists():
         raise FileNotFoundError(f"Expected build output was not found: {binary}")
 
     if args.build_only:
+        cache.print_timings()
         print_setup_instructions(binary)
         return 0
 
-    installed_binary = install(implementations_dir, binary, args.install_dir)
+    installed_binary = install(implementations_dir, binary, args.install_dir, cache)
+    cache.print_timings()
     print_setup_instructions(installed_binary)
     return 0
 
 
-def build(rust_dir: Path, debug: bool) -> None:
-    command = ["cargo", "build"]
-    if not debug:
-        command.append("--release")
-    print(f"Building Rust app with: {' '.join(command)}")
-    subprocess.run(command, cwd=rust_dir, check=True)
+class AssetCache:
+    """Content-addressed cache of the build and the rendered icons, with the time spent on each install step.
+
+    A step is skipped when the hash of its inputs matches the last run, and a file is only copied when the installed
+    copy differs from the cached one.
+    """
+
+    def __init__(self, cache_dir: Path, source_png: Path, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.source_png = source_png
+        self.enabled = enabled
+        # (step, seconds, what was done)
+        self.timings: list[tuple[str, float, str]] = []
+        self._icon_dir: Path | None = None
+
+    @contextmanager
+    def step(self, name: str):
+        outcome = ["done"]
+        started = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            self.timings.append((name, time.perf_counter() - started, outcome[0]))
+
+    def print_timings(self) -> None:
+        print()
+        print("Timing summary:")
+        width = max(len(name) for name, _, _ in self.timings)
+        for name, seconds, outcome in self.timings:
+            print(f"  {name:<{width}}  {seconds:7.2f}s  {outcome}")
+        print(f"  {'total':<{width}}  {sum(seconds for _, seconds, _ in self.timings):7.2f}s")
+
+    def build_is_current(self, key: str, binary: Path) -> bool:
+        stamp = self._read_json(self.cache_dir / f"build-{binary.parent.name}.json")
+        return self.enabled and stamp.get("key") == key and stamp.get("binary") == file_signature(binary)
+
+    def record_build(self, key: str, binary: Path) -> None:
+        self._write_json(self.cache_dir / f"build-{binary.parent.name}.json",
+                         {"key": key, "binary": file_signature(binary)})
+
+    def icon_dir(self) -> Path:
+        if self._icon_dir is None:
+            from PIL import __version__ as pil_version
+
+            key = hashlib.sha256(self.source_png.read_bytes())
+            key.update(f"render {ICON_RENDER_VERSION} pillow {pil_version}".encode())
+            self._icon_dir = self.cache_dir / "icons" / key.hexdigest()[:16]
+        return self._icon_dir
+
+    def icon_path(self, name: str) -> Path:
+        return self.icon_dir() / name
+
+    def render_icons(self, png_sizes: tuple[int, ...] = (), ico: bool = False, icns: bool = False) -> None:
+        """Render the missing icons into the cache, each on its own process when there are several."""
+        with self.step("render icons") as outcome:
+            icon_dir = self.icon_dir()
+            pngs = sorted(set(png_sizes) | (set(WINDOWS_ICO_SIZES) if ico else set()))
+            missing = [size for size in pngs if not self.enabled or not (icon_dir / f"icon-{size}.png").exists()]
+            bundles = []
+            if ico and (not self.enabled or not (icon_dir / "icon.ico").exists()):
+                bundles.append((assemble_windows_ico, icon_dir, icon_dir / "icon.ico"))
+            if icns and (not self.enabled or not (icon_dir / "AppIcon.icns").exists()):
+                bundles.append((create_macos_icns, self.source_png, icon_dir / "AppIcon.icns"))
+            if not missing and not bundles:
+                outcome[0] = "cached"
+                return
+            icon_dir.mkdir(parents=True, exist_ok=True)
+            jobs = [(render_cached_icon, self.source_png, icon_dir / f"icon-{size}.png", size) for size in missing]
+            # the ico is assembled from the rendered pngs, the icns only needs the source
+            run_jobs(jobs + [job for job in bundles if job[0] is not assemble_windows_ico])
+            run_jobs([job for job in bundles if job[0] is assemble_windows_ico])
+            outcome[0] = f"rendered {len(missing) + len(bundles)} of {len(pngs) + int(ico) + int(icns)}"
+
+    def install_file(self, source: Path, destination: Path, outcome: list[str]) -> None:
+        """Copy a file unless the installed copy has the same size and modification time, which copy2 keeps."""
+        if self.enabled and destination.exists() and file_signature(destination) == file_signature(source):
+            return
+        shutil.copy2(source, destination)
+        outcome.append(destination.name)
+
+    def write_text(self, destination: Path, text: str, outcome: list[str]) -> None:
+        if self.enabled and destination.exists() and destination.read_text() == text:
+            return
+        destination.write_text(text)
+        outcome.append(destination.name)
+
+    @contextmanager
+    def install_step(self, name: str):
+        """Time a step of installing files, the files that had to be written are collected."""
+        with self.step(name) as outcome:
+            written: list[str] = []
+            yield written
+            outcome[0] = f"copied {len(written)} file{'s' if len(written) > 1 else ''}" if written else "up to date"
+
+    @staticmethod
+    def _read_json(path: Path) -> dict:
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_json(path: Path, data: dict) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp.write_text(json.dumps(data))
+        os.replace(temp, path)
+
+
+def file_signature(path: Path) -> list[int] | None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_key(rust_dir: Path, profile: str) -> str:
+    """Hash everything cargo build reads: the sources, the manifest, the icon and the toolchain."""
+    key = hashlib.sha256(f"profile {profile}\nRUSTFLAGS {os.environ.get('RUSTFLAGS', '')}\n".encode())
+    inputs = [rust_dir / name for name in BUILD_INPUTS] + sorted((rust_dir / "src").rglob("*"))
+    inputs.append(icon_png(rust_dir.parent))
+    for path in inputs:
+        if path.is_file():
+            key.update(str(path.relative_to(rust_dir.parent)).encode() + b"\0")
+            key.update(hashlib.sha256(path.read_bytes()).digest())
+    for command in (["rustc", "-vV"], ["pkg-config", "--modversion", "Qt6Widgets"]):
+        try:
+            key.update(subprocess.run(command, capture_output=True, check=False).stdout)
+        except OSError:
+            pass
+    return key.hexdigest()
+
+
+def build(rust_dir: Path, debug: bool, cache: AssetCache) -> None:
+    profile = "debug" if debug else "release"
+    with cache.step("cargo build") as outcome:
+        key = build_key(rust_dir, profile)
+        binary = built_binary(rust_dir, profile)
+        if cache.build_is_current(key, binary):
+            print(f"Rust app is up to date: {binary}")
+            outcome[0] = "cached"
+            return
+        command = ["cargo", "build"]
+        if not debug:
+            command.append("--release")
+        print(f"Building Rust app with: {' '.join(command)}")
+        subprocess.run(command, cwd=rust_dir, check=True)
+        if binary.exists():
+            cache.record_build(key, binary)
 
 
 def built_binary(rust_dir: Path, profile: str) -> Path:
@@ -52,16 +217,16 @@ def built_binary(rust_dir: Path, profile: str) -> Path:
     return rust_dir / "target" / profile / f"{BIN_NAME}{suffix}"
 
 
-def install(implementations_dir: Path, binary: Path, override: str | None) -> Path:
+def install(implementations_dir: Path, binary: Path, override: str | None, cache: AssetCache) -> Path:
     system = platform.system()
     if system == "Darwin":
-        return install_macos(implementations_dir, binary, override)
+        return install_macos(implementations_dir, binary, override, cache)
     if system == "Windows":
-        return install_windows(implementations_dir, binary, override)
-    return install_linux(implementations_dir, binary, override)
+        return install_windows(implementations_dir, binary, override, cache)
+    return install_linux(implementations_dir, binary, override, cache)
 
 
-def install_linux(implementations_dir: Path, binary: Path, override: str | None) -> Path:
+def install_linux(implementations_dir: Path, binary: Path, override: str | None, cache: AssetCache) -> Path:
     home = Path.home()
     bin_dir = Path(override).expanduser() if override else home / ".local" / "bin"
     app_binary = bin_dir / BIN_NAME
@@ -70,14 +235,16 @@ def install_linux(implementations_dir: Path, binary: Path, override: str | None)
 
     bin_dir.mkdir(parents=True, exist_ok=True)
     applications_dir.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(binary, app_binary)
-    app_binary.chmod(app_binary.stat().st_mode | 0o755)
-    install_linux_icons(implementations_dir, home)
+    with cache.install_step("install binary") as written:
+        cache.install_file(binary, app_binary, written)
+        app_binary.chmod(app_binary.stat().st_mode | 0o755)
+    cache.render_icons(png_sizes=LINUX_ICON_SIZES)
+    install_linux_icons(home, cache)
     settings_path.touch(exist_ok=True)
 
     desktop_file = applications_dir / f"{DESKTOP_ID}.desktop"
-    desktop_file.write_text(
-        "\n".join(
+    with cache.install_step("install desktop entry") as written:
+        cache.write_text(desktop_file, "\n".join(
             [
                 "[Desktop Entry]",
                 "Type=Application",
@@ -89,15 +256,14 @@ def install_linux(implementations_dir: Path, binary: Path, override: str | None)
                 "MimeType=text/x-gcode;",
                 "",
             ]
-        )
-    )
+        ), written)
     desktop_file.chmod(desktop_file.stat().st_mode | 0o755)
     maybe_add_path_hint(bin_dir)
     print(f"Installed Linux desktop entry: {desktop_file}")
     return app_binary
 
 
-def install_macos(implementations_dir: Path, binary: Path, override: str | None) -> Path:
+def install_macos(implementations_dir: Path, binary: Path, override: str | None, cache: AssetCache) -> Path:
     requested = Path(override).expanduser() if override else Path("/Applications")
     applications_dir = requested if can_write_dir(requested) else Path.home() / "Applications"
     app_dir = applications_dir / f"{APP_NAME}.app"
@@ -108,34 +274,45 @@ def install_macos(implementations_dir: Path, binary: Path, override: str | None)
 
     macos_dir.mkdir(parents=True, exist_ok=True)
     resources_dir.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(binary, app_binary)
-    app_binary.chmod(app_binary.stat().st_mode | 0o755)
-    write_rounded_icon_png(icon_png(implementations_dir), resources_dir / "icon.png", 512)
-    create_macos_icns(icon_png(implementations_dir), resources_dir / "AppIcon.icns")
+    with cache.install_step("install binary") as written:
+        cache.install_file(binary, app_binary, written)
+        app_binary.chmod(app_binary.stat().st_mode | 0o755)
+    cache.render_icons(png_sizes=(512,), icns=True)
+    with cache.install_step("install icons") as written:
+        cache.install_file(cache.icon_path("icon-512.png"), resources_dir / "icon.png", written)
+        stale_iconset = (resources_dir / "AppIcon.icns").with_suffix(".iconset")
+        if stale_iconset.exists():
+            shutil.rmtree(stale_iconset)
+        cache.install_file(cache.icon_path("AppIcon.icns"), resources_dir / "AppIcon.icns", written)
     (macos_dir / "nfvsettings.json").touch(exist_ok=True)
-    (contents / "Info.plist").write_text(macos_info_plist())
+    with cache.install_step("install Info.plist") as written:
+        cache.write_text(contents / "Info.plist", macos_info_plist(), written)
     print(f"Installed macOS app bundle: {app_dir}")
     return app_binary
 
 
-def install_windows(implementations_dir: Path, binary: Path, override: str | None) -> Path:
+def install_windows(implementations_dir: Path, binary: Path, override: str | None, cache: AssetCache) -> Path:
     local_app_data = os.environ.get("LOCALAPPDATA")
     default_dir = Path(local_app_data) / APP_NAME if local_app_data else Path.home() / APP_NAME
     install_dir = Path(override).expanduser() if override else default_dir
     install_dir.mkdir(parents=True, exist_ok=True)
     app_binary = install_dir / f"{BIN_NAME}.exe"
-    shutil.copy2(binary, app_binary)
-    write_rounded_icon_png(icon_png(implementations_dir), install_dir / "icon.png", 512)
-    create_windows_ico(icon_png(implementations_dir), install_dir / "icon.ico")
+    with cache.install_step("install binary") as written:
+        cache.install_file(binary, app_binary, written)
+    cache.render_icons(png_sizes=(512,), ico=True)
+    with cache.install_step("install icons") as written:
+        cache.install_file(cache.icon_path("icon-512.png"), install_dir / "icon.png", written)
+        cache.install_file(cache.icon_path("icon.ico"), install_dir / "icon.ico", written)
     (install_dir / "nfvsettings.json").touch(exist_ok=True)
-    (install_dir / "setup-postprocessor-rust.bat").write_text(
-        "@echo off\n"
-        "echo Postprocessor setup complete.\n"
-        "echo.\n"
-        "echo Enter the following in your slicer's post processor section:\n"
-        "echo.\n"
-        f'echo "{app_binary}"\n'
-    )
+    with cache.install_step("install setup script") as written:
+        cache.write_text(install_dir / "setup-postprocessor-rust.bat", (
+            "@echo off\n"
+            "echo Postprocessor setup complete.\n"
+            "echo.\n"
+            "echo Enter the following in your slicer's post processor section:\n"
+            "echo.\n"
+            f'echo "{app_binary}"\n'
+        ), written)
     maybe_create_windows_start_menu_entry(app_binary)
     print(f"Installed Windows files: {install_dir}")
     return app_binary
@@ -156,30 +333,47 @@ def icon_png(implementations_dir: Path) -> Path:
     return implementations_dir / "python" / "icon.png"
 
 
-def install_linux_icons(implementations_dir: Path, home: Path) -> None:
-    for size in (16, 32, 48, 64, 128, 256, 512):
-        icon_dir = home / ".local" / "share" / "icons" / "hicolor" / f"{size}x{size}" / "apps"
-        icon_dir.mkdir(parents=True, exist_ok=True)
-        write_rounded_icon_png(icon_png(implementations_dir), icon_dir / f"{DESKTOP_ID}.png", size)
+def install_linux_icons(home: Path, cache: AssetCache) -> None:
+    with cache.install_step("install icons") as written:
+        for size in LINUX_ICON_SIZES:
+            icon_dir = home / ".local" / "share" / "icons" / "hicolor" / f"{size}x{size}" / "apps"
+            icon_dir.mkdir(parents=True, exist_ok=True)
+            cache.install_file(cache.icon_path(f"icon-{size}.png"), icon_dir / f"{DESKTOP_ID}.png", written)
+
+
+def run_jobs(jobs: list[tuple]) -> None:
+    """Run (function, *args) jobs, on a process pool when there is more than one."""
+    if len(jobs) == 1:
+        jobs[0][0](*jobs[0][1:])
+    elif jobs:
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+            for future in [pool.submit(*job) for job in jobs]:
+                future.result()
+
+
+def render_cached_icon(source_png: Path, output: Path, size: int) -> None:
+    write_atomic(output, lambda path: make_rounded_icon(source_png, size).save(path, format="PNG"))
 
 
 def create_macos_icns(source_png: Path, icns_path: Path) -> None:
-    stale_iconset = icns_path.with_suffix(".iconset")
-    if stale_iconset.exists():
-        shutil.rmtree(stale_iconset)
+    icon = make_rounded_icon(source_png, MACOS_ICNS_SIZE)
+    write_atomic(icns_path, lambda path: icon.save(path, format="ICNS"))
 
-    icon = make_rounded_icon(source_png, 1024)
-    icon.save(icns_path)
 
+def assemble_windows_ico(icon_dir: Path, ico_path: Path) -> None:
+    from PIL import Image
 
-def create_windows_ico(source_png: Path, ico_path: Path) -> None:
-    sizes = [16, 24, 32, 48, 64, 128, 256]
-    images = [make_rounded_icon(source_png, size) for size in sizes]
-    images[-1].save(ico_path, sizes=[(size, size) for size in sizes], append_images=images[:-1])
+    images = [Image.open(icon_dir / f"icon-{size}.png") for size in WINDOWS_ICO_SIZES]
+    write_atomic(ico_path, lambda path: images[-1].save(path, format="ICO",
+                                                        sizes=[(size, size) for size in WINDOWS_ICO_SIZES],
+                                                        append_images=images[:-1]))
 
 
-def write_rounded_icon_png(source_png: Path, output: Path, size: int) -> None:
-    make_rounded_icon(source_png, size).save(output)
+def write_atomic(output: Path, save) -> None:
+    # other machines sharing the cache never see a half written icon
+    temp = output.with_name(f".{output.name}.{os.getpid()}.tmp")
+    save(temp)
+    os.replace(temp, output)
 
 
 def make_rounded_icon(source_png: Path, size: int):
@@ -1,4 +1,7 @@
+pub mod placeholders;
+
 use anyhow::{Context, Result, bail};
+use placeholders::{fill_spool_name, find_spool_name};
 use regex::Regex;
 use reqwest::blocking::Client;
 use serde::{Deserialize, Serialize};
@@ -186,7 +189,6 @@ pub fn replace_names(gcode: &str, spool_names: &[Option<String>]) -> Result<Stri
     let filament_notes_re = Regex::new(r"; filament_notes = (.+)")?;
     let filament_type_re = Regex::new(r"; filament_type = (.+)")?;
     let filament_used_re = Regex::new(r"; filament used \[mm] = (.+)")?;
-    let sm_name_re = Regex::new(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]")?;
 
     let Some(notes_match) = filament_notes_re.find(gcode) else {
         return Ok(gcode.to_owned());
@@ -239,10 +241,7 @@ pub fn replace_names(gcode: &str, spool_names: &[Option<String>]) -> Result<Stri
         let Some(Some(spool_name)) = spool_names.get(idx) else {
             continue;
         };
-        if sm_name_re.is_match(note) {
-            let replacement = sm_name_re
-                .replace(note, format!("[sm_name = {spool_name}]"))
-                .into_owned();
+        if let Some(replacement) = fill_spool_name(note, spool_name) {
             new_parts[idx] = new_parts[idx].replace(note, &replacement);
         }
     }
@@ -254,7 +253,6 @@ pub fn replace_names(gcode: &str, spool_names: &[Option<String>]) -> Result<Stri
 pub fn get_spools_from_gcode(gcode_path: &Path) -> Result<BTreeMap<String, SpoolData>> {
     let gcode = parse_gcode_tail(gcode_path)?;
     let notes_re = Regex::new(r"; filament_notes = (.+)")?;
-    let sm_name_re = Regex::new(r"\[\s*sm_name\s*=\s*([^]]*\S)?\s*]")?;
     let Some(captures) = notes_re.captures(&gcode) else {
         return Ok(BTreeMap::new());
     };
@@ -267,10 +265,7 @@ pub fn get_spools_from_gcode(gcode_path: &Path) -> Result<BTreeMap<String, Spool
     }
     let mut spools = BTreeMap::new();
     for (idx, note) in notes.split(';').enumerate() {
-        let name = sm_name_re
-            .captures(note)
-            .and_then(|captures| captures.get(1).map(|value| value.as_str().to_owned()))
-            .unwrap_or_default();
+        let name = find_spool_name(note).unwrap_or_default();
         spools.insert((idx + 1).to_string(), SpoolData { sm_name: name });
     }
     Ok(spools)
@@ -374,6 +369,29 @@ mod tests {
         assert!(output.contains("; filament_notes = [sm_name = Purple PLA];  [sm_name = Blue PETG];  [sm_name = Black ABS]"));
     }
 
+    #[test]
+    fn reads_the_escaped_names_it_writes() {
+        let dir = tempfile::tempdir().unwrap();
+        let path = dir.path().join("sample.gcode");
+        fs::write(
+            &path,
+            "G1 X0\n; filament_type = PLA;PETG\n; filament used [mm] = 12, 3\n; filament_notes = [sm_name = Old \\[1\\]] [sm_material];[sm_name=B]\n",
+        )
+        .unwrap();
+        assert_eq!(
+            get_spools_from_gcode(&path).unwrap()["1"].sm_name,
+            "Old [1]"
+        );
+
+        process_gcode_file(&path, &[Some("New [2]".to_owned()), None]).unwrap();
+        let output = fs::read_to_string(&path).unwrap();
+
+        assert!(output.contains(r"[sm_name = New \[2\]] [sm_material]"));
+        let spools = get_spools_from_gcode(&path).unwrap();
+        assert_eq!(spools["1"].sm_name, "New [2]");
+        assert_eq!(spools["2"].sm_name, "B");
+    }
+
     #[test]
     fn rewrites_tail_without_loading_full_file_contract() {
         let dir = tempfile::tempdir().unwrap();
@@ -0,0 +1,210 @@
+//! The placeholder scanner of the filament notes, a port of `implementations/python/placeholders.py` so both
+//! implementations read and write the same notes. Brackets and backslashes in a value are escaped with a backslash,
+//! `[sm_name = Spool \[2\]]` is the spool `Spool [2]`.
+
+/// Characters that are escaped with a backslash in a placeholder value.
+const ESCAPED: [char; 3] = ['[', ']', '\\'];
+
+/// A placeholder found in filament notes: its unescaped value (`None` if it has no `=`) and its byte span.
+#[derive(Debug, Clone, PartialEq, Eq)]
+pub struct Placeholder {
+    pub value: Option<String>,
+    pub start: usize,
+    pub end: usize,
+}
+
+/// Find the placeholders named `field` in filament notes, like `[sm_name = Spool]` or `[sm_name]`.
+/// The notes are scanned once from left to right without backtracking, so the time is linear in their length.
+pub fn scan_placeholders(notes: &str, field: &str) -> Vec<Placeholder> {
+    let bytes = notes.as_bytes();
+    let mut placeholders = Vec::new();
+    let mut pos = find_from(notes, '[', 0);
+    while let Some(start) = pos {
+        let name_start = skip_whitespace(notes, start + 1);
+        let name_end = skip_name(notes, name_start);
+        let after = skip_whitespace(notes, name_end);
+        if &notes[name_start..name_end] != field
+            || after >= bytes.len()
+            || !matches!(bytes[after], b'=' | b']')
+        {
+            // not a placeholder, none can start before `after` since a name and whitespace don't hold a '['
+            pos = find_from(notes, '[', after.max(start + 1));
+            continue;
+        }
+        if bytes[after] == b']' {
+            placeholders.push(Placeholder {
+                value: None,
+                start,
+                end: after + 1,
+            });
+            pos = find_from(notes, '[', after + 1);
+            continue;
+        }
+        let Some(value_end) = find_closing_bracket(notes, after + 1) else {
+            // no later placeholder can be closed either, the closing bracket it needs would have closed this one
+            break;
+        };
+        placeholders.push(Placeholder {
+            value: Some(unescape_value(notes[after + 1..value_end].trim())),
+            start,
+            end: value_end + 1,
+        });
+        pos = find_from(notes, '[', value_end + 1);
+    }
+    placeholders
+}
+
+/// The value of the first `[sm_name = ...]` tag of the notes of an extruder, `None` if the notes have no tag.
+pub fn find_spool_name(notes: &str) -> Option<String> {
+    scan_placeholders(notes, "sm_name")
+        .into_iter()
+        .find_map(|placeholder| placeholder.value)
+}
+
+/// Fill every `sm_name` placeholder of the notes of an extruder with a spool name, `None` if the notes have none.
+pub fn fill_spool_name(notes: &str, spool_name: &str) -> Option<String> {
+    let placeholders = scan_placeholders(notes, "sm_name");
+    if placeholders.is_empty() {
+        return None;
+    }
+    let tag = format!("[sm_name = {}]", escape_value(spool_name));
+    let mut out = String::with_capacity(notes.len() + tag.len());
+    let mut copied = 0;
+    for placeholder in placeholders {
+        out.push_str(&notes[copied..placeholder.start]);
+        out.push_str(&tag);
+        copied = placeholder.end;
+    }
+    out.push_str(&notes[copied..]);
+    Some(out)
+}
+
+/// Remove the escapes from a placeholder value, a backslash that doesn't escape a bracket or backslash is kept.
+pub fn unescape_value(value: &str) -> String {
+    if !value.contains('\\') {
+        return value.to_owned();
+    }
+    let mut out = String::with_capacity(value.len());
+    let mut chars = value.chars().peekable();
+    while let Some(char) = chars.next() {
+        match chars.peek() {
+            Some(&next) if char == '\\' && ESCAPED.contains(&next) => {
+                out.push(next);
+                chars.next();
+            }
+            _ => out.push(char),
+        }
+    }
+    out
+}
+
+/// Escape a placeholder value so it can be written in the notes, values without brackets are written as they are.
+pub fn escape_value(value: &str) -> String {
+    if !value.contains(ESCAPED) {
+        return value.to_owned();
+    }
+    let mut out = String::with_capacity(value.len() + 4);
+    let mut chars = value.chars().peekable();
+    while let Some(char) = chars.next() {
+        let next_escaped = chars.peek().is_none_or(|next| ESCAPED.contains(next));
+        if char == '[' || char == ']' || (char == '\\' && next_escaped) {
+            out.push('\\');
+        }
+        out.push(char);
+    }
+    out
+}
+
+/// The position of the first unescaped ']' from `pos`.
+fn find_closing_bracket(notes: &str, mut pos: usize) -> Option<usize> {
+    loop {
+        let bracket = find_from(notes, ']', pos)?;
+        // the bracket is escaped if an odd number of backslashes come right before it, the text between pos and the
+        // bracket is only looked at once
+        let before = &notes[pos..bracket];
+        if (before.len() - before.trim_end_matches('\\').len()) % 2 == 0 {
+            return Some(bracket);
+        }
+        pos = bracket + 1;
+    }
+}
+
+fn find_from(notes: &str, char: char, pos: usize) -> Option<usize> {
+    notes[pos..].find(char).map(|offset| pos + offset)
+}
+
+fn skip_whitespace(notes: &str, pos: usize) -> usize {
+    notes[pos..]
+        .find(|char: char| !char.is_whitespace())
+        .map_or(notes.len(), |offset| pos + offset)
+}
+
+fn skip_name(notes: &str, pos: usize) -> usize {
+    notes[pos..]
+        .find(|char: char| char.is_whitespace() || matches!(char, '=' | '[' | ']'))
+        .map_or(notes.len(), |offset| pos + offset)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn reads_escaped_names() {
+        assert_eq!(
+            find_spool_name(r"[sm_name = New \[1\]]"),
+            Some("New [1]".to_owned())
+        );
+        assert_eq!(
+            find_spool_name(r"x [sm_name=A\\] [sm_name = B]"),
+            Some(r"A\".to_owned())
+        );
+        assert_eq!(
+            find_spool_name(r"[sm_name = C:\path]"),
+            Some(r"C:\path".to_owned())
+        );
+        assert_eq!(find_spool_name("[sm_name = ]"), Some(String::new()));
+        assert_eq!(find_spool_name("[sm_name]"), None);
+        assert_eq!(find_spool_name(r"[sm_name = open \]"), None);
+        assert_eq!(
+            find_spool_name("[[sm_name = Ünïcode ]]"),
+            Some("Ünïcode".to_owned())
+        );
+    }
+
+    #[test]
+    fn escaped_names_round_trip() {
+        for name in ["Spool [2]", r"back\slash", r"ends with \", "]][[", "plain"] {
+            let notes = fill_spool_name("note [sm_name = old] [sm_name]", name).unwrap();
+            assert_eq!(find_spool_name(&notes), Some(name.to_owned()));
+            assert_eq!(scan_placeholders(&notes, "sm_name").len(), 2);
+        }
+        assert_eq!(escape_value("Spool [2]"), r"Spool \[2\]");
+        assert_eq!(fill_spool_name("no tag here", "x"), None);
+    }
+
+    #[test]
+    fn matches_the_python_scanner() {
+        // the values placeholders.py reads from these notes
+        let notes =
+            r"[sm_material] [ sm_name = A \[1\] ] [sm_name = B] [sm_namex = C] \[sm_name = D]";
+        let placeholders = scan_placeholders(notes, "sm_name");
+        let values: Vec<_> = placeholders.iter().map(|p| p.value.clone()).collect();
+        assert_eq!(
+            values,
+            vec![
+                Some("A [1]".to_owned()),
+                Some("B".to_owned()),
+                Some("D".to_owned())
+            ]
+        );
+    }
+
+    #[test]
+    fn scan_is_linear_on_adversarial_notes() {
+        let notes = "[sm_name = ".repeat(200_000) + &"\\".repeat(200_000);
+        let start = std::time::Instant::now();
+        assert!(scan_placeholders(&notes, "sm_name").is_empty());
+        assert!(start.elapsed().as_secs_f64() < 1.0);
+    }
+}